@@ -21,22 +21,43 @@ PORT = os.getenv("PORT", "8000")
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "django-insecure-77!phd4(h_hif3nwwy*g0n8rlg255yb^f8!xnka!y8*=h3g!b="
+SECRET_KEY = os.getenv(
+    "DJANGO_SECRET_KEY",
+    "django-insecure-77!phd4(h_hif3nwwy*g0n8rlg255yb^f8!xnka!y8*=h3g!b=",
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = False
+DEBUG = os.getenv("DJANGO_DEBUG", "") == "1"
 
-ALLOWED_HOSTS = ['*']
+ALLOWED_HOSTS = os.getenv("DJANGO_ALLOWED_HOSTS", "*").split(",")
 
 
 # Application definition
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        "shop.authentication.CachedTokenAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "shop.permissions.IsAuthenticatedOrAdmin",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "shop.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    # Per-scope limits for shop.throttling; a scope without a rate is unlimited.
+    "DEFAULT_THROTTLE_RATES": {
+        "register": "10/hour",  # per client IP
+        "login": "30/min",  # per client IP
+        "login_username": "10/min",  # per account, across IPs
+        "products": "600/min",  # per user
+    },
+}
+
+# Counters for the throttles above; see shop/throttling.py. ALIAS None counts
+# per process.
+SHOP_THROTTLE = {
+    "ENABLED": os.getenv("SHOP_THROTTLE", "1") == "1",
+    "ALIAS": "default",
 }
 
 INSTALLED_APPS = [
@@ -51,16 +72,31 @@ INSTALLED_APPS = [
     "shop",
 ]
 
+# WhiteNoise is sync-only: under ASGI it would put every request, async views
+# included, on a thread. gunicorn.conf.py turns it off for Uvicorn workers,
+# where STATIC_ROOT is served by the CDN or web server in front instead.
+SERVE_STATIC = os.getenv("SERVE_STATIC", "1") == "1"
+
 MIDDLEWARE = [
+    "shop.instrumentation.PerformanceMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    *(["whitenoise.middleware.WhiteNoiseMiddleware"] if SERVE_STATIC else []),
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "shop.routers.ReplicaMiddleware",
 ]
 
+# Per-request profiling and /api/metrics histograms; see shop/instrumentation.py
+SHOP_PERFORMANCE = {
+    "ENABLED": os.getenv("SHOP_PERFORMANCE_METRICS", "") == "1",
+    "SERVER_TIMING": True,
+    "DUPLICATE_QUERY_THRESHOLD": 3,
+}
+
 ROOT_URLCONF = "ECommercePlatform.urls"
 
 TEMPLATES = [
@@ -85,11 +121,151 @@ WSGI_APPLICATION = "ECommercePlatform.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
+# PostgreSQL is used when POSTGRES_DB is set, SQLite otherwise. PostgreSQL
+# connections come from a per-process psycopg pool (DB_POOL_MAX_SIZE=0 turns
+# it off); other connections are kept open between requests, checked before
+# reuse, except under ASGI. There each request's sync code runs on a new
+# thread, so a persistent connection would never be reused and would stay
+# open until garbage collected. asgi.py sets SERVE_ASGI.
+SERVE_ASGI = os.getenv("SERVE_ASGI", "") == "1"
+
+if os.getenv("POSTGRES_DB"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB"),
+            "USER": os.getenv("POSTGRES_USER", ""),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", ""),
+            "PORT": os.getenv("POSTGRES_PORT", ""),
+            "OPTIONS": {},
+        }
+    }
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+    if DB_POOL_MAX_SIZE:
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        }
+    }
+
+# Read replicas for the product and order reads; see shop/routers.py. Each
+# host in POSTGRES_REPLICA_HOSTS (comma-separated) gets an alias with the
+# primary's credentials. With SQLite, SQLITE_REPLICA_PATH adds a second file
+# as a stand-in replica, refreshed by `manage.py sync_replica`.
+REPLICA_HOSTS = [h for h in os.getenv("POSTGRES_REPLICA_HOSTS", "").split(",") if h]
+if os.getenv("POSTGRES_DB"):
+    for number, host in enumerate(REPLICA_HOSTS, 1):
+        DATABASES[f"replica{number}"] = {
+            **DATABASES["default"],
+            "HOST": host,
+            "OPTIONS": dict(DATABASES["default"]["OPTIONS"]),
+            "TEST": {"MIRROR": "default"},
+        }
+elif os.getenv("SQLITE_REPLICA_PATH"):
+    DATABASES["replica"] = {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("SQLITE_REPLICA_PATH"),
+        "TEST": {"MIRROR": "default"},
+    }
+
+for database in DATABASES.values():
+    if "pool" not in database.get("OPTIONS", {}):
+        database["CONN_MAX_AGE"] = (
+            0 if SERVE_ASGI else int(os.getenv("DB_CONN_MAX_AGE", 60))
+        )
+        database["CONN_HEALTH_CHECKS"] = not SERVE_ASGI
+
+DATABASE_ROUTERS = ["shop.routers.ReplicaRouter"]
+
+# STRATEGY is "round_robin" or "least_latency". After a write, the user's
+# reads stay on the primary for PIN_SECONDS.
+SHOP_REPLICAS = {
+    "ALIASES": [alias for alias in DATABASES if alias != "default"],
+    "STRATEGY": os.getenv("DB_REPLICA_STRATEGY", "round_robin"),
+    "PIN_SECONDS": int(os.getenv("DB_REPLICA_PIN_SECONDS", 5)),
+    "CACHE_ALIAS": "default",
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# REDIS_URL shares the caches between workers and hosts; without it every
+# process keeps its own.
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+        "carts": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "carts",
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+        # Separate so catalog entries never push carts out.
+        "carts": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "carts",
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        },
     }
+
+# Product list/detail responses are cached per catalog version; see shop/cache.py
+SHOP_CATALOG_CACHE = {
+    "ENABLED": os.getenv("SHOP_CATALOG_CACHE", "1") == "1",
+    "ALIAS": "default",
+    "TIMEOUT": 300,
+}
+
+# Carts live in the cache, never the database; see shop/cart.py
+SHOP_CART = {
+    "ALIAS": "carts",
+    "TIMEOUT": 60 * 60 * 24 * 14,
+    "MAX_LINES": 100,
+}
+
+# Pending orders hold their stock this long (seconds) before
+# `manage.py sweep_reservations` cancels them and restocks; see shop/services.py
+SHOP_RESERVATIONS = {
+    "TTL": int(os.getenv("RESERVATION_TTL", 15 * 60)),
+}
+
+# Post-commit work queued in the outbox and run by `manage.py run_worker`;
+# see shop/outbox.py. Failed jobs are retried BACKOFF * 2**n seconds later.
+SHOP_OUTBOX = {
+    "THREADS": int(os.getenv("OUTBOX_THREADS", 4)),
+    "BATCH_SIZE": 50,
+    "LEASE": 300,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF": 10,
+    "MAX_BACKOFF": 3600,
+}
+
+EMAIL_BACKEND = os.getenv(
+    "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
+)
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "shop@localhost")
+
+# Resolved token users are kept in-process; see shop/authentication.py
+SHOP_TOKEN_CACHE = {
+    "TTL": 30,
+    "MAX_SIZE": 10000,
 }
 
 
@@ -111,6 +287,35 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# DJANGO_PASSWORD_HASHER picks the hasher for new hashes (argon2 needs
+# argon2-cffi and falls back to scrypt without it). The rest stay listed so
+# existing hashes still verify, and are upgraded on the next login.
+PASSWORD_HASHER = os.getenv("DJANGO_PASSWORD_HASHER") or "pbkdf2"
+if PASSWORD_HASHER == "argon2":
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        PASSWORD_HASHER = "scrypt"
+PASSWORD_HASHER_CLASSES = {
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "pbkdf2_sha1": "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "argon2": "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "bcrypt": "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "scrypt": "django.contrib.auth.hashers.ScryptPasswordHasher",
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    path for name, path in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+]
+
+# Hashing and verification run on a bounded thread pool; see shop/passwords.py
+SHOP_PASSWORD_HASHING = {
+    "WORKERS": int(os.getenv("PASSWORD_HASHING_WORKERS", os.cpu_count() or 1)),
+    "MAX_PENDING": int(os.getenv("PASSWORD_HASHING_MAX_PENDING", 64)),
+}
+
+# ModelBackend, with the password check on that pool.
+AUTHENTICATION_BACKENDS = ["shop.passwords.HashingPoolBackend"]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -128,10 +333,34 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = "static/"
-STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATIC_ROOT = os.getenv("STATIC_ROOT", BASE_DIR / 'staticfiles')
+
+# Compressed, content-hashed files in STATIC_ROOT, served by WhiteNoise when
+# SERVE_STATIC is on. collectstatic builds them at release; run it locally
+# before serving or benchmarking with DEBUG off.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", BASE_DIR / 'media')
+
+# Product images; see shop/images.py. Uploads and renditions are stored under
+# content-hashed names, so whatever serves MEDIA_URL can cache them forever
+# ("Cache-Control: public, max-age=31536000, immutable"). RENDITIONS maps a
+# name to the longest edge in pixels.
+SHOP_IMAGES = {
+    "RENDITIONS": {"thumb": 200, "medium": 800, "large": 1600},
+    "FORMAT": "WEBP",
+    "QUALITY": 80,
+    "MAX_UPLOAD_SIZE": 10 * 1024 * 1024,
+    "WORKERS": int(os.getenv("IMAGE_WORKERS", 0)) or os.cpu_count() or 1,
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
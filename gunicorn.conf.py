@@ -0,0 +1,43 @@
+"""
+Gunicorn settings for production:
+
+    gunicorn -c gunicorn.conf.py
+
+By default this serves the ASGI application with Uvicorn workers, one per
+CPU: each runs an event loop, so the async views hold slow connections
+without tying up a thread. That only holds while every middleware is
+async-capable, so WhiteNoise is off (SERVE_STATIC=0) and static files must
+come from a CDN or the web server in front. Database connections are not
+persistent under ASGI either; PostgreSQL's pool reuses them instead. Set
+GUNICORN_WORKER_CLASS=gthread to serve the WSGI application with
+2 * CPUs + 1 threaded workers, static files through WhiteNoise and
+persistent connections instead. Every setting can be overridden from the
+environment.
+"""
+
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+if worker_class.startswith("uvicorn."):
+    wsgi_app = "ECommercePlatform.asgi:application"
+    workers = int(os.getenv("WEB_CONCURRENCY", cpus))
+    raw_env = [f"SERVE_STATIC={os.getenv('SERVE_STATIC', '0')}"]
+else:
+    wsgi_app = "ECommercePlatform.wsgi:application"
+    workers = int(os.getenv("WEB_CONCURRENCY", cpus * 2 + 1))
+    threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# Keep idle client connections open long enough to be reused behind a load
+# balancer, and recycle workers periodically to bound memory growth.
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
@@ -1,19 +1,87 @@
+from django import forms
 from django.contrib import admin
-from .models import Product, Order, OrderItem
+from django.db import transaction
+
+from .models import OutboxJob, Product, Order, OrderItem, StockReservation
+from .services import delete_orders, update_order_statuses
 
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ("name", "description", "price", "stock")
+    list_display = ("name", "description", "price", "stock", "image")
+    # Uploads go through the API, which hashes them and queues renditions.
+    readonly_fields = ("image", "image_renditions")
+
+
+class OrderAdminForm(forms.ModelForm):
+    def clean_status(self):
+        status = self.cleaned_data["status"]
+        if (
+            self.instance.pk
+            and "status" in self.changed_data
+            and self.initial["status"] != "Pending"
+        ):
+            raise forms.ValidationError("Only pending orders can be updated.")
+        return status
 
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("user", "status")
+    list_display = ("user", "status", "total_amount", "item_count", "completed_at")
+    form = OrderAdminForm
+    # Kept by shop/signals.py and the services.
+    readonly_fields = ("total_amount", "item_count", "completed_at")
+
+    # Orders are placed through the API, which takes their stock.
+    def has_add_permission(self, request):
+        return False
+
+    # Status changes and deletes go through shop/services.py like the API's,
+    # so reserved stock is kept or put back and completions queue their jobs.
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            if change and "status" in form.changed_data:
+                update_order_statuses([obj])
+            super().save_model(request, obj, form, change)
+
+    def get_deleted_objects(self, objs, request):
+        deleted, counts, perms_needed, protected = super().get_deleted_objects(
+            objs, request
+        )
+        # Items go with their order; they just cannot be deleted on their own.
+        perms_needed.discard(OrderItem._meta.verbose_name)
+        return deleted, counts, perms_needed, protected
+
+    def delete_model(self, request, obj):
+        delete_orders([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        delete_orders(list(queryset.values_list("pk", flat=True)))
 
 
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ("order", "product", "quantity")
+    list_display = ("order", "product", "quantity", "unit_price")
+
+    # Items are fixed at checkout, as in the API.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ("order", "product", "quantity", "expires_at")
+
+
+class OutboxJobAdmin(admin.ModelAdmin):
+    list_display = ("task", "status", "attempts", "available_at", "last_error")
+    list_filter = ("status", "task")
 
 
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(StockReservation, StockReservationAdmin)
+admin.site.register(OutboxJob, OutboxJobAdmin)
@@ -0,0 +1,166 @@
+"""
+Sales rollups for the admin analytics endpoints.
+
+Completed orders are folded into per-day and per-product-per-day tables in
+``(completed_at, id)`` order, a batch per transaction, with the position of
+the last folded order saved as a watermark in the same transaction. Each
+run only reads the orders completed since the previous one, and reports
+read the small rollup tables instead of the order history.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    DailySales,
+    Order,
+    OrderItem,
+    Product,
+    ProductDailySales,
+    RollupWatermark,
+)
+
+SALES_ROLLUP = "sales"
+
+# Orders completed this recently are left for the next run, so a checkout
+# still committing with an earlier completed_at cannot slip behind the
+# watermark.
+DEFAULT_LAG = timedelta(seconds=60)
+
+
+def pending_orders(watermark, cutoff):
+    orders = Order.objects.filter(status="Completed", completed_at__lte=cutoff)
+    if watermark.completed_at is not None:
+        orders = orders.filter(
+            Q(completed_at__gt=watermark.completed_at)
+            | Q(completed_at=watermark.completed_at, pk__gt=watermark.order_id)
+        )
+    return orders.order_by("completed_at", "pk")
+
+
+def merge_rows(model, rows, unique_fields, sum_fields):
+    """Add ``rows`` (dicts of keys and amounts) onto the rollup rows they hit."""
+    if not rows:
+        return
+    lookup = {f"{field}__in": {row[field] for row in rows} for field in unique_fields}
+    existing = {
+        tuple(getattr(obj, field) for field in unique_fields): obj
+        for obj in model.objects.filter(**lookup)
+    }
+    objs = []
+    for row in rows:
+        obj = existing.get(tuple(row[field] for field in unique_fields))
+        if obj is not None:
+            for field in sum_fields:
+                row[field] += getattr(obj, field)
+        objs.append(model(**row))
+    model.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=[field.removesuffix("_id") for field in unique_fields],
+        update_fields=sum_fields,
+    )
+
+
+def add_daily_sales(order_ids):
+    rows = (
+        Order.objects.filter(pk__in=order_ids)
+        .annotate(date=TruncDate("completed_at"))
+        .values("date")
+        .annotate(
+            orders=Count("pk"), items=Sum("item_count"), revenue=Sum("total_amount")
+        )
+        .order_by()
+    )
+    merge_rows(DailySales, list(rows), ["date"], ["orders", "items", "revenue"])
+
+
+def add_product_sales(order_ids):
+    subtotal = ExpressionWrapper(
+        F("quantity") * F("unit_price"),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    rows = (
+        OrderItem.objects.filter(order__in=order_ids)
+        .annotate(date=TruncDate("order__completed_at"))
+        .values("date", "product_id")
+        # revenue first, while F("quantity") still means the column.
+        .annotate(revenue=Sum(subtotal), quantity=Sum("quantity"))
+        .order_by()
+    )
+    merge_rows(
+        ProductDailySales, list(rows), ["date", "product_id"], ["quantity", "revenue"]
+    )
+
+
+def update_sales_rollups(batch_size=1000, lag=DEFAULT_LAG):
+    """
+    Fold the orders completed since the watermark (and at least ``lag`` ago)
+    into the rollups. Returns the number of orders taken in.
+    """
+    cutoff = timezone.now() - lag
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(
+                name=SALES_ROLLUP
+            )
+            batch = list(
+                pending_orders(watermark, cutoff).values_list("pk", "completed_at")[
+                    :batch_size
+                ]
+            )
+            if not batch:
+                return processed
+            order_ids = [pk for pk, _ in batch]
+            add_daily_sales(order_ids)
+            add_product_sales(order_ids)
+            watermark.order_id, watermark.completed_at = batch[-1]
+            watermark.save()
+        processed += len(batch)
+
+
+def reset_sales_rollups():
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        ProductDailySales.objects.all().delete()
+        RollupWatermark.objects.filter(name=SALES_ROLLUP).delete()
+
+
+def rolled_up_until():
+    """``completed_at`` of the last order in the rollups, or None."""
+    return (
+        RollupWatermark.objects.filter(name=SALES_ROLLUP)
+        .values_list("completed_at", flat=True)
+        .first()
+    )
+
+
+def revenue_by_day(start, end):
+    return list(
+        DailySales.objects.filter(date__range=(start, end))
+        .order_by("date")
+        .values("date", "orders", "items", "revenue")
+    )
+
+
+def top_products(start, end, limit):
+    return list(
+        ProductDailySales.objects.filter(date__range=(start, end))
+        .values("product_id", "product__name")
+        .annotate(quantity=Sum("quantity"), revenue=Sum("revenue"))
+        .order_by("-revenue", "product_id")[:limit]
+    )
+
+
+def low_stock(threshold, limit):
+    # Current state rather than history, read straight from product_stock_idx.
+    return list(
+        Product.objects.filter(stock__lte=threshold)
+        .order_by("stock", "id")
+        .values("id", "name", "stock")[:limit]
+    )
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        # jobs registers outbox tasks, routers its connection_created hook.
+        from . import jobs, routers, signals  # noqa: F401
+
+        post_migrate.connect(signals.ensure_search_index, sender=self)
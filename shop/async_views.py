@@ -0,0 +1,220 @@
+"""
+Async (ASGI) variants of the read-heavy endpoints.
+
+They reuse the filters, paginators and serializers of the DRF views in
+``views.py`` but run on the event loop with the async ORM and the async cache
+API, so a worker can hold many slow connections without blocking a thread on
+each. Like the sync views they read from a replica and answer conditional
+requests from their ETags.
+"""
+
+from functools import partial, wraps
+
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .authentication import CachedTokenAuthentication
+from .cache import catalog_cache
+from .conditional import check_preconditions, page_validators, set_validators
+from .models import Product
+from .passwords import INVALID_CREDENTIALS, ahash_password
+from .routers import aread_from_replica
+from .search import aprepare_search_backend
+from .serializers import LoginSerializer
+from . import views
+
+
+def render(data, status=200, headers=None):
+    return HttpResponse(
+        JSONRenderer().render(data),
+        status=status,
+        content_type="application/json",
+        headers=headers,
+    )
+
+
+def render_conditional(request, validators, get_data, headers=None):
+    """
+    The 304 or 412 the request's preconditions call for, or ``get_data()``
+    rendered, with the validators set either way.
+    """
+    response = check_preconditions(request, *validators)
+    if response is None:
+        response = render(get_data())
+    elif isinstance(response, Response):
+        response = render(response.data, response.status_code)
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return set_validators(response, *validators)
+
+
+def handle_exception(exc):
+    """The JSON body and status DRF's exception handler would produce."""
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {"detail": exc.detail}
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers["WWW-Authenticate"] = CachedTokenAuthentication.keyword
+    if getattr(exc, "wait", None):
+        headers["Retry-After"] = "%d" % exc.wait
+    return render(data, exc.status_code, headers)
+
+
+def async_api_view(view=None, methods=("GET",)):
+    """
+    Authenticate the request with the token cache (or the async ORM on a
+    miss) and turn DRF exceptions into JSON responses. GET only unless
+    ``methods`` says otherwise.
+    """
+    if view is None:
+        return partial(async_api_view, methods=methods)
+
+    # Token authentication only, so no CSRF token is expected, as with DRF.
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        parsers = [parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]
+        request = Request(request, parsers=parsers)
+        try:
+            if request.method not in methods:
+                raise exceptions.MethodNotAllowed(request.method)
+            result = await CachedTokenAuthentication().aauthenticate(request)
+            request.user = result[0] if result else AnonymousUser()
+            return await view(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return handle_exception(exc)
+
+    return wrapper
+
+
+def get_view(view_class, request, **kwargs):
+    """An instance of the sync view, for its queryset and filter configuration."""
+    return view_class(request=request, kwargs=kwargs, format_kwarg=None)
+
+
+def check_permissions(view, request):
+    for permission in view.get_permissions():
+        if not permission.has_permission(request, view):
+            if not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied(getattr(permission, "message", None))
+
+
+async def check_throttles(view, request):
+    waits = [
+        throttle.wait()
+        for throttle in view.get_throttles()
+        if not await throttle.aallow_request(request, view)
+    ]
+    if waits:
+        raise exceptions.Throttled(max(waits))
+
+
+async def fetch_page(view, request):
+    """The requested page's rows and their ETag."""
+    queryset = view.filter_queryset(view.get_queryset())
+    paginator = view.paginator
+    page = paginator.get_page_queryset(queryset, request, view)
+    rows = [row async for row in page]
+    if paginator.get_include_count(request):
+        paginator.count = await queryset.acount()
+    rows = paginator.paginate_rows(rows)
+    return rows, page_validators(request, paginator, rows, view.validator_fields)
+
+
+def page_data(view, rows):
+    serializer = view.get_serializer(rows, many=True)
+    return view.paginator.get_paginated_response(serializer.data).data
+
+
+@async_api_view
+async def product_list(request):
+    view = get_view(views.ProductListCreateView, request)
+    check_permissions(view, request)
+    await check_throttles(view, request)
+    await aread_from_replica(request)
+    await aprepare_search_backend()
+
+    async def build():
+        rows, etag = await fetch_page(view, request)
+        return page_data(view, rows), (etag, None)
+
+    data, validators, hit = await catalog_cache.afetch(request, "list", build)
+    return render_conditional(
+        request, validators, lambda: data, {"X-Cache": "HIT" if hit else "MISS"}
+    )
+
+
+@async_api_view
+async def product_detail(request, pk):
+    view = get_view(views.ProductRetrieveUpdateDestroyView, request, pk=pk)
+    check_permissions(view, request)
+    await aread_from_replica(request)
+
+    async def build():
+        try:
+            product = await view.get_queryset().aget(pk=pk)
+        except Product.DoesNotExist:
+            raise exceptions.NotFound("No Product matches the given query.")
+        return view.get_serializer(product).data, view.get_object_validators(product)
+
+    data, validators, hit = await catalog_cache.afetch(request, "detail", build)
+    return render_conditional(
+        request, validators, lambda: data, {"X-Cache": "HIT" if hit else "MISS"}
+    )
+
+
+@async_api_view
+async def order_list(request):
+    view = get_view(views.OrderListCreateView, request)
+    check_permissions(view, request)
+    await aread_from_replica(request)
+    rows, etag = await fetch_page(view, request)
+    # Checked before the page is serialized, as in ConditionalListMixin.
+    return render_conditional(request, (etag, None), lambda: page_data(view, rows))
+
+
+@async_api_view(methods=["POST"])
+async def register(request):
+    view = get_view(views.register_user.cls, request)
+    await check_throttles(view, request)
+    username = request.data.get("username")
+    password = request.data.get("password")
+    email = request.data.get("email")
+
+    if not username or not password or not email:
+        return render({"error": "Username, Password and email are required!"}, 400)
+    if await User.objects.filter(username=username).aexists():
+        return render({"error": "Username already exists!!"}, 400)
+
+    user = await User.objects.acreate(
+        username=username, email=email, password=await ahash_password(password)
+    )
+    await Token.objects.acreate(user=user)
+    return render({"message": "User registered successfully!"}, 201)
+
+
+@async_api_view(methods=["POST"])
+async def login(request):
+    view = get_view(views.CustomLogin, request)
+    await check_throttles(view, request)
+    credentials = LoginSerializer().to_internal_value(request.data)
+    user = await aauthenticate(
+        request,
+        username=credentials["username"],
+        password=credentials["password"],
+    )
+    if user is None:
+        raise exceptions.ValidationError({"non_field_errors": [INVALID_CREDENTIALS]})
+    token, _ = await Token.objects.aget_or_create(user=user)
+    return render({"token": token.key})
@@ -0,0 +1,142 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+
+class TokenUserCache:
+    """
+    Bounded LRU of token key -> (user, token) with a TTL.
+
+    Entries are dropped by signal handlers when a token is deleted or its user
+    is saved (password change, deactivation). Those signals only reach the
+    current process, so the TTL bounds how long other workers may keep
+    serving a revoked token.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def options(self):
+        return getattr(settings, "SHOP_TOKEN_CACHE", {})
+
+    @property
+    def ttl(self):
+        return self.options.get("TTL", 30)
+
+    @property
+    def max_size(self):
+        return self.options.get("MAX_SIZE", 10000)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, user, token = entry
+        # Hand out copies so per-request changes never leak between requests.
+        user = copy.copy(user)
+        token = copy.copy(token)
+        token.user = user
+        return user, token
+
+    def set(self, key, user, token):
+        expires = time.monotonic() + self.ttl
+        entry = (expires, copy.copy(user), copy.copy(token))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [
+                key
+                for key, (_, user, _) in self._entries.items()
+                if user.pk == user_id
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "size": size,
+        }
+
+
+token_cache = TokenUserCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for ``TokenAuthentication`` that skips the
+    Token -> User query while the token is in ``token_cache``.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
+
+    async def aauthenticate(self, request):
+        """
+        ``authenticate`` for async views: a cache hit never leaves the event
+        loop and a miss uses the async ORM.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        try:
+            key = auth[1].decode() if len(auth) == 2 else None
+        except UnicodeError:
+            key = None
+        if key is None:
+            # Malformed header: the sync path raises before querying.
+            return self.authenticate(request)
+
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related("user").aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        token_cache.set(key, token.user, token)
+        return token.user, token
@@ -0,0 +1,195 @@
+import hashlib
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .conditional import check_preconditions, set_validators
+from .routers import primary_reads
+
+
+def normalize_text(value):
+    return " ".join(value.lower().split())
+
+
+def normalize_decimal(value):
+    try:
+        return str(Decimal(value).normalize())
+    except InvalidOperation:
+        return value
+
+
+class CatalogCache:
+    """
+    Read-through cache for catalog responses.
+
+    Every key embeds a catalog version number. Writes bump the version, which
+    orphans all existing entries at once (they age out through the backend's
+    own eviction), so invalidation never needs to scan or delete keys.
+    """
+
+    version_key = "shop:catalog:version"
+    key_prefix = "shop:catalog"
+
+    # Query parameters that select what the catalog endpoints return, and how
+    # to normalize them so equivalent queries share an entry.
+    query_params = {
+        "search": normalize_text,
+        "price": normalize_decimal,
+        "price__gte": normalize_decimal,
+        "price__lte": normalize_decimal,
+        "count": normalize_text,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def options(self):
+        return getattr(settings, "SHOP_CATALOG_CACHE", {})
+
+    @property
+    def enabled(self):
+        return self.options.get("ENABLED", True)
+
+    @property
+    def cache(self):
+        return caches[self.options.get("ALIAS", "default")]
+
+    @property
+    def timeout(self):
+        return self.options.get("TIMEOUT", 300)
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            # Seed with the clock so a version lost to eviction can never
+            # resurrect entries written under an older number.
+            self.cache.add(self.version_key, int(time.time() * 1000), timeout=None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def bump_version(self):
+        try:
+            return self.cache.incr(self.version_key)
+        except ValueError:
+            self.get_version()
+            return self.cache.incr(self.version_key)
+
+    def invalidate(self):
+        self.bump_version()
+        # Bump again once the write is visible, so a read that raced the
+        # transaction cannot keep stale rows cached under the new version.
+        transaction.on_commit(self.bump_version)
+
+    def normalize_query(self, query_params):
+        normalized = []
+        for name in sorted(query_params):
+            value = query_params.get(name)
+            normalizer = self.query_params.get(name)
+            if normalizer is not None:
+                value = normalizer(value)
+            if value != "":
+                normalized.append(f"{name}={value}")
+        return "&".join(normalized)
+
+    def make_key(self, request, kind, version):
+        query = self.normalize_query(request.query_params)
+        raw = f"{request.get_host()}{request.path}?{query}"
+        digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        return f"{self.key_prefix}:{version}:{kind}:{digest}"
+
+    def fetch(self, request, kind, build):
+        """
+        Serve the request from the cache, calling ``build()`` to produce the
+        response on a miss. Only successful responses are stored, together
+        with their ETag so conditional requests can be answered from here.
+        """
+        if not self.enabled:
+            return build()
+
+        key = self.make_key(request, kind, self.get_version())
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.record(hit=True)
+            data, validators = entry
+            response = None
+            if validators:
+                response = check_preconditions(request, *validators)
+            if response is None:
+                response = Response(data)
+                if validators:
+                    set_validators(response, *validators)
+            response["X-Cache"] = "HIT"
+            return response
+
+        self.record(hit=False)
+        # Stored under the current version for everyone, so read it from the
+        # primary: a lagging replica could cache rows older than the version.
+        with primary_reads():
+            response = build()
+        if response.status_code == 200:
+            validators = getattr(response, "validators", None)
+            self.cache.set(key, (response.data, validators), self.timeout)
+        response["X-Cache"] = "MISS"
+        return response
+
+    async def aget_version(self):
+        version = await self.cache.aget(self.version_key)
+        if version is None:
+            await self.cache.aadd(
+                self.version_key, int(time.time() * 1000), timeout=None
+            )
+            version = await self.cache.aget(self.version_key)
+        return version
+
+    async def afetch(self, request, kind, build):
+        """
+        Async counterpart of ``fetch``: ``build`` is a coroutine function
+        returning ``(data, validators)``, and so is this, plus whether it was
+        a hit.
+        """
+        if not self.enabled:
+            return *await build(), False
+
+        key = self.make_key(request, kind, await self.aget_version())
+        entry = await self.cache.aget(key)
+        if entry is not None:
+            self.record(hit=True)
+            return *entry, True
+
+        self.record(hit=False)
+        with primary_reads():
+            data, validators = await build()
+        await self.cache.aset(key, (data, validators), self.timeout)
+        return data, validators, False
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+catalog_cache = CatalogCache()
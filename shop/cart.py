@@ -0,0 +1,195 @@
+"""
+Shopping carts kept in the cache (``SHOP_CART["ALIAS"]``) rather than the
+database.
+
+A cart is just ``{product_id: quantity}`` under one key per user. Prices,
+names and stock are looked up live, with one ``Product`` query per cart
+read, and checkout hands the lines to ``place_order`` so the order and its
+items are written in a single transaction. Browsing and basket edits never
+write to the database. Each edit reads, changes and writes the whole cart
+under a short per-cart lock, so concurrent edits cannot drop each other.
+"""
+
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import Product
+from .services import place_order
+
+
+class CheckoutInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "This cart is already being checked out."
+    default_code = "checkout_in_progress"
+
+
+class CartBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The cart is being updated, try again."
+    default_code = "cart_busy"
+
+
+class CartStore:
+    key_prefix = "shop:cart"
+    # Seconds an edit may hold the cart, and wait for another edit to finish.
+    lock_timeout = 5
+    lock_wait = 2
+
+    @property
+    def options(self):
+        return getattr(settings, "SHOP_CART", {})
+
+    @property
+    def cache(self):
+        return caches[self.options.get("ALIAS", "default")]
+
+    @property
+    def max_lines(self):
+        return self.options.get("MAX_LINES", 100)
+
+    def key(self, user_id):
+        return f"{self.key_prefix}:{user_id}"
+
+    def get(self, user_id):
+        return self.cache.get(self.key(user_id)) or {}
+
+    def save(self, user_id, lines):
+        if lines:
+            timeout = self.options.get("TIMEOUT", 60 * 60 * 24 * 14)
+            self.cache.set(self.key(user_id), lines, timeout)
+        else:
+            self.clear(user_id)
+
+    def clear(self, user_id):
+        self.cache.delete(self.key(user_id))
+
+    @contextmanager
+    def update_lock(self, user_id):
+        """Held around each read-modify-write of the cart."""
+        key = f"{self.key(user_id)}:lock"
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(key, 1, timeout=self.lock_timeout):
+            if time.monotonic() >= deadline:
+                raise CartBusy()
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            self.cache.delete(key)
+
+    @contextmanager
+    def checkout_lock(self, user_id):
+        """Held for one checkout, so a double submit cannot order twice."""
+        key = f"{self.key(user_id)}:checkout"
+        if not self.cache.add(key, 1, timeout=30):
+            raise CheckoutInProgress()
+        try:
+            yield
+        finally:
+            self.cache.delete(key)
+
+
+cart_store = CartStore()
+
+
+def check_stock(product_id, quantity):
+    stock = (
+        Product.objects.filter(pk=product_id).values_list("stock", flat=True).first()
+    )
+    if stock is None:
+        raise ValidationError({"product_id": f"Product {product_id} does not exist."})
+    if quantity > stock:
+        raise ValidationError({"quantity": f"Only {stock} left in stock."})
+
+
+def update_line(user_id, product_id, get_quantity):
+    """Set a line to ``get_quantity(current quantity)`` under the cart's lock."""
+    with cart_store.update_lock(user_id):
+        lines = cart_store.get(user_id)
+        if product_id not in lines and len(lines) >= cart_store.max_lines:
+            raise ValidationError(
+                {"product_id": f"A cart holds at most {cart_store.max_lines} products."}
+            )
+        quantity = get_quantity(lines.get(product_id, 0))
+        check_stock(product_id, quantity)
+        lines[product_id] = quantity
+        cart_store.save(user_id, lines)
+        return lines
+
+
+def set_quantity(user_id, product_id, quantity):
+    return update_line(user_id, product_id, lambda current: quantity)
+
+
+def add_item(user_id, product_id, quantity):
+    return update_line(user_id, product_id, lambda current: current + quantity)
+
+
+def remove_item(user_id, product_id):
+    with cart_store.update_lock(user_id):
+        lines = cart_store.get(user_id)
+        lines.pop(product_id, None)
+        cart_store.save(user_id, lines)
+        return lines
+
+
+def summarize(user_id, lines=None):
+    """
+    The cart with current names, prices and stock from one query. Lines whose
+    product has been deleted are dropped from the stored cart.
+    """
+    if lines is None:
+        lines = cart_store.get(user_id)
+    products = Product.objects.only("id", "name", "price", "stock").in_bulk(lines)
+    gone = set(lines).difference(products)
+    if gone:
+        lines = {pk: quantity for pk, quantity in lines.items() if pk not in gone}
+        with cart_store.update_lock(user_id):
+            stored = cart_store.get(user_id)
+            for pk in gone:
+                stored.pop(pk, None)
+            cart_store.save(user_id, stored)
+
+    items, total = [], Decimal("0.00")
+    for product_id, quantity in lines.items():
+        product = products[product_id]
+        subtotal = product.price * quantity
+        total += subtotal
+        items.append(
+            {
+                "product_id": product_id,
+                "name": product.name,
+                "unit_price": str(product.price),
+                "quantity": quantity,
+                "subtotal": str(subtotal),
+                "in_stock": quantity <= product.stock,
+            }
+        )
+    return {
+        "items": items,
+        "item_count": sum(lines.values()),
+        "total_amount": str(total),
+    }
+
+
+def checkout(user):
+    """Turn the user's cart into an order and empty it."""
+    with cart_store.checkout_lock(user.pk):
+        lines = cart_store.get(user.pk)
+        if not lines:
+            raise ValidationError({"items": "The cart is empty."})
+        order = place_order(
+            user,
+            [
+                {"product_id": product_id, "quantity": quantity}
+                for product_id, quantity in lines.items()
+            ],
+        )
+        cart_store.clear(user.pk)
+    return order
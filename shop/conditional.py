@@ -0,0 +1,82 @@
+"""
+ETag / Last-Modified validators computed from ``updated_at`` columns, so a
+client's copy can be confirmed current (304) or an update refused (412)
+before anything is serialized.
+"""
+
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256("|".join(map(str, parts)).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def object_validators(instance, fieldset=None):
+    """
+    ``(etag, last_modified)`` for a model instance with ``last_modified``.
+    A sparse representation (``?fields=`` / ``?omit=``) passes the fields it
+    carries and gets its own ETag, so a cache never confirms one body for
+    the other; None stands for the full representation.
+    """
+    last_modified = instance.last_modified
+    parts = [instance._meta.label, instance.pk, last_modified.isoformat()]
+    if fieldset is not None:
+        parts.append(",".join(fieldset))
+    return make_etag(*parts), last_modified
+
+
+def page_validators(request, paginator, rows, fields=("id", "updated_at")):
+    """
+    The ETag of a list page, from the rows fetched for it: their keys and
+    ``updated_at`` catch inserts, updates and deletions within the page, and
+    the paginator's count and links the ones that move it. The request's
+    path and query string (filters, cursor) distinguish pages.
+
+    Nothing is read beyond the page, so ``?count=false`` and deep keyset
+    pages keep their fixed cost. No Last-Modified is derived for lists
+    because a deletion does not move the newest ``updated_at``.
+    """
+    parts = [
+        request.get_full_path(),
+        paginator.count,
+        paginator.has_next,
+        paginator.has_previous,
+    ]
+    for row in rows:
+        for name in fields:
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            parts.append(value.isoformat() if hasattr(value, "isoformat") else value)
+    return make_etag(*parts)
+
+
+def set_validators(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    # Remembered so the catalog cache can answer conditional requests.
+    response.validators = (etag, last_modified)
+    return response
+
+
+def check_preconditions(request, etag, last_modified=None):
+    """
+    The 304 or 412 response that the request's If-None-Match, If-Match,
+    If-Modified-Since and If-Unmodified-Since headers call for, or None if
+    the request should be processed normally.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        return None
+    if response.status_code == status.HTTP_412_PRECONDITION_FAILED:
+        response = Response(
+            {"detail": "The resource has changed since it was fetched."},
+            status=status.HTTP_412_PRECONDITION_FAILED,
+        )
+    return set_validators(response, etag, last_modified)
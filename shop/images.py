@@ -0,0 +1,186 @@
+"""
+Product images.
+
+An upload is stored once under the hash of its content and the product is
+saved pointing at it; resizing is queued in the outbox (shop/outbox.py) so
+the request never waits for Pillow. The outbox task, and
+`manage.py regenerate_renditions` for the whole catalog, encode the
+``SHOP_IMAGES["RENDITIONS"]`` sizes on a process pool, one job per image,
+and record the rendition paths on the product for ``ProductSerializer``.
+
+Rendition names carry the source hash and the size, so a file at a given
+URL never changes and can be cached forever.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import imaging
+from .cache import catalog_cache
+from .models import Product
+from .outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+GENERATE_RENDITIONS = "generate_product_renditions"
+
+
+def get_options():
+    return getattr(settings, "SHOP_IMAGES", {})
+
+
+class ImagePool:
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @staticmethod
+    def start_method():
+        methods = multiprocessing.get_all_start_methods()
+        return "forkserver" if "forkserver" in methods else "spawn"
+
+    def get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Not forked: the pool starts in a threaded process holding
+                # locks and database connections. The children only run
+                # shop/imaging.py, which needs no Django setup.
+                self._executor = ProcessPoolExecutor(
+                    self.workers or get_options().get("WORKERS") or os.cpu_count(),
+                    mp_context=multiprocessing.get_context(self.start_method()),
+                )
+            return self._executor
+
+    def submit(self, fn, *args):
+        return self.get_executor().submit(fn, *args)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+
+
+image_pool = ImagePool()
+
+
+def read_upload(upload):
+    """The bytes and Pillow format of an uploaded image, or a 400."""
+    if upload.size > get_options().get("MAX_UPLOAD_SIZE", 10 * 1024 * 1024):
+        raise ValidationError({"image": "The image is too large."})
+    data = upload.read()
+    try:
+        image_format = imaging.identify(data)
+    except Exception:
+        raise ValidationError({"image": "Upload a valid image."})
+    if image_format not in imaging.EXTENSIONS:
+        raise ValidationError({"image": f"{image_format} images are not supported."})
+    return data, image_format
+
+
+def store(name, data):
+    # Content-addressed, so an existing file already holds these bytes.
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def set_image(product, upload):
+    """Store ``upload`` as the product's image and queue its renditions."""
+    data, image_format = read_upload(upload)
+    name = store(
+        f"products/{imaging.content_hash(data)}{imaging.EXTENSIONS[image_format]}",
+        data,
+    )
+    product.image = name
+    product.image_renditions = {}
+    with transaction.atomic():
+        product.save(update_fields=["image", "image_renditions", "updated_at"])
+        enqueue(GENERATE_RENDITIONS, [{"product_id": product.pk}])
+    return product
+
+
+def clear_image(product):
+    # The files stay: other products may share them, and caches may still
+    # serve them.
+    product.image = ""
+    product.image_renditions = {}
+    product.save(update_fields=["image", "image_renditions", "updated_at"])
+    return product
+
+
+def rendition_sizes():
+    return sorted(get_options().get("RENDITIONS", {}).items())
+
+
+def rendition_path(source, name, size):
+    # Everything that shapes the output is in the name.
+    options = get_options()
+    extension = imaging.EXTENSIONS[options.get("FORMAT", "WEBP")]
+    stem = os.path.splitext(os.path.basename(source))[0]
+    quality = options.get("QUALITY", 80)
+    return f"products/renditions/{stem}-{name}-{size}-q{quality}{extension}"
+
+
+def generate_renditions(product_ids, pool=image_pool):
+    """
+    Render and store the renditions of the given products' images, all of
+    them at once on ``pool``. Products without an image are skipped. Returns
+    ``(done, failed)`` product counts.
+    """
+    options = get_options()
+    sizes = rendition_sizes()
+    products = (
+        Product.objects.filter(pk__in=product_ids).exclude(image="").only("image")
+    )
+    jobs, failed = [], 0
+    for product in products:
+        source = product.image.name
+        paths = {name: rendition_path(source, name, size) for name, size in sizes}
+        if all(default_storage.exists(path) for path in paths.values()):
+            jobs.append((product, paths, None))
+            continue
+        try:
+            with default_storage.open(source, "rb") as stream:
+                data = stream.read()
+        except OSError:
+            logger.exception("Image %s of product %s is missing", source, product.pk)
+            failed += 1
+            continue
+        future = pool.submit(
+            imaging.render,
+            data,
+            sizes,
+            options.get("FORMAT", "WEBP"),
+            options.get("QUALITY", 80),
+        )
+        jobs.append((product, paths, future))
+
+    done, now = 0, timezone.now()
+    for product, paths, future in jobs:
+        if future is not None:
+            try:
+                rendered = future.result()
+            except Exception:
+                logger.exception("Could not render product %s's image", product.pk)
+                failed += 1
+                continue
+            for name, path in paths.items():
+                store(path, rendered[name])
+        # Matches nothing if a newer image was uploaded meanwhile.
+        current = Product.objects.filter(pk=product.pk, image=product.image.name)
+        done += current.update(image_renditions=paths, updated_at=now)
+    if done:
+        catalog_cache.invalidate()
+    return done, failed
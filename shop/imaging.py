@@ -0,0 +1,48 @@
+"""
+The Pillow side of product images. Nothing here touches Django, so the
+process pool in shop/images.py can import it in fresh workers under any
+multiprocessing start method.
+"""
+
+import hashlib
+import io
+
+from PIL import Image, ImageOps
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def identify(data):
+    """The Pillow format name of the image in ``data``; raises if it is not one."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.verify()
+        return image.format
+
+
+def render(data, sizes, output_format, quality):
+    """
+    Encode the image in ``data`` once per ``(name, size)`` in ``sizes``, scaled
+    down (never up) to fit ``size`` pixels on its longest edge, upright per its
+    EXIF orientation. Returns ``{name: bytes}``.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    if output_format == "JPEG" or not has_alpha:
+        image = image.convert("RGB")
+    elif image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    renditions = {}
+    for name, size in sizes:
+        scaled = image.copy()
+        scaled.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        scaled.save(buffer, output_format, quality=quality)
+        renditions[name] = buffer.getvalue()
+    return renditions
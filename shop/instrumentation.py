@@ -0,0 +1,271 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework import serializers
+
+logger = logging.getLogger("shop.performance")
+
+_current = contextvars.ContextVar("shop_request_metrics", default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def get_options():
+    return getattr(settings, "SHOP_PERFORMANCE", {})
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.statements = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        """SQL run at least ``threshold`` times: the signature of an N+1."""
+        return {
+            sql: count for sql, count in self.statements.items() if count >= threshold
+        }
+
+
+@contextmanager
+def timed_serialization():
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Attributes the time spent building ``serializer.data`` to the request."""
+
+    @property
+    def data(self):
+        with timed_serialization():
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Per-endpoint histograms kept for the life of the process and rendered in
+    the Prometheus text format; Prometheus derives rates and windows from the
+    cumulative counts.
+    """
+
+    histograms = {
+        "shop_request_duration_seconds": ("Wall time per request", DURATION_BUCKETS),
+        "shop_request_db_seconds": ("Time spent in SQL per request", DURATION_BUCKETS),
+        "shop_request_db_queries": ("SQL queries per request", QUERY_BUCKETS),
+        "shop_request_serialize_seconds": (
+            "Time spent in serializers per request",
+            DURATION_BUCKETS,
+        ),
+        "shop_response_size_bytes": ("Response body size", SIZE_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._duplicates = Counter()
+        self.collectors = []
+
+    def observe(self, route, method, values, duplicates):
+        labels = f'route="{route}",method="{method}"'
+        with self._lock:
+            for name, value in values.items():
+                key = (name, labels)
+                if key not in self._series:
+                    self._series[key] = Histogram(self.histograms[name][1])
+                self._series[key].observe(value)
+            if duplicates:
+                self._duplicates[labels] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in self.histograms.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (series, labels), histogram in sorted(self._series.items()):
+                    if series == name:
+                        lines.extend(histogram.render(name, labels))
+            name = "shop_requests_with_duplicate_queries_total"
+            lines.append(f"# HELP {name} Requests that repeated the same SQL")
+            lines.append(f"# TYPE {name} counter")
+            for labels, count in sorted(self._duplicates.items()):
+                lines.append(f"{name}{{{labels}}} {count}")
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._duplicates.clear()
+
+
+registry = MetricsRegistry()
+
+
+def cache_stats_collector():
+    from .authentication import token_cache
+    from .cache import catalog_cache
+
+    lines = []
+    for prefix, stats in (
+        ("shop_catalog_cache", catalog_cache.stats()),
+        ("shop_token_cache", token_cache.stats()),
+    ):
+        for kind in ("hits", "misses"):
+            lines.append(f"# TYPE {prefix}_{kind}_total counter")
+            lines.append(f"{prefix}_{kind}_total {stats[kind]}")
+    return lines
+
+
+registry.collectors.append(cache_stats_collector)
+
+
+class PerformanceMiddleware:
+    """
+    Opt-in (``SHOP_PERFORMANCE["ENABLED"]``) per-request profiling: wall time,
+    SQL count and time, serializer time and response size. Adds a
+    ``Server-Timing`` header, flags repeated SQL and feeds ``registry``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_options().get("ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with self.record_queries(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            # Connections are per thread: wrap the ones of the thread that
+            # runs this request's sync views and ORM calls.
+            stack = await sync_to_async(self.record_queries)(metrics)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    @staticmethod
+    def record_queries(metrics):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.record_query))
+        return stack
+
+    def finish(self, request, response, metrics, started):
+        options = get_options()
+        duration = time.perf_counter() - started
+
+        size = 0 if response.streaming else len(response.content)
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        duplicates = metrics.duplicates(options.get("DUPLICATE_QUERY_THRESHOLD", 3))
+
+        registry.observe(
+            route,
+            request.method,
+            {
+                "shop_request_duration_seconds": duration,
+                "shop_request_db_seconds": metrics.db_time,
+                "shop_request_db_queries": metrics.queries,
+                "shop_request_serialize_seconds": metrics.serialize_time,
+                "shop_response_size_bytes": size,
+            },
+            duplicates,
+        )
+
+        if options.get("SERVER_TIMING", True):
+            response["Server-Timing"] = (
+                f"total;dur={duration * 1000:.2f}, "
+                f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries", '
+                f"serialize;dur={metrics.serialize_time * 1000:.2f}"
+            )
+        if duplicates:
+            response["X-Duplicate-Queries"] = str(len(duplicates))
+            for sql, count in duplicates.items():
+                logger.warning(
+                    "%s %s ran the same query %d times: %s",
+                    request.method,
+                    route,
+                    count,
+                    sql,
+                )
+        return response
@@ -0,0 +1,37 @@
+"""Outbox tasks; see shop/outbox.py. Each must be safe to run twice."""
+
+from django.core.mail import send_mail
+
+from .images import GENERATE_RENDITIONS, generate_renditions
+from .models import Order
+from .outbox import task
+
+ORDER_COMPLETED = ["send_order_confirmation"]
+
+
+@task("send_order_confirmation")
+def send_order_confirmation(payload):
+    order = (
+        Order.objects.select_related("user")
+        .only("id", "total_amount", "item_count", "user__email", "user__username")
+        .filter(pk=payload["order_id"])
+        .first()
+    )
+    if order is None or not order.user.email:
+        return
+    send_mail(
+        f"Order #{order.pk} is complete",
+        f"Hi {order.user.username},\n\n"
+        f"Your order #{order.pk} of {order.item_count} items "
+        f"({order.total_amount}) is complete.\n",
+        None,
+        [order.user.email],
+    )
+
+
+@task(GENERATE_RENDITIONS)
+def generate_product_renditions(payload):
+    _, failed = generate_renditions([payload["product_id"]])
+    if failed:
+        # Raised so the outbox retries it later.
+        raise RuntimeError(f"Renditions of product {payload['product_id']} failed")
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop.query_audit import analyze_tables, audit_query_plans
+from shop.seed import seed_orders, seed_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large dataset inside a transaction that is rolled back, EXPLAIN "
+        "the query behind each shop endpoint and fail if any plan falls back "
+        "to a full table scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50_000)
+        parser.add_argument("--orders", type=int, default=20_000)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--verbose-plans", action="store_true")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                User(username=f"audit-user-{i}") for i in range(options["users"])
+            )
+            admin = User(username="audit-admin", is_staff=True, is_superuser=True)
+            admin.save()
+            seed_products(options["products"])
+            seed_orders(users, options["orders"])
+            analyze_tables()
+
+            audits = audit_query_plans(users[0], admin)
+            transaction.set_rollback(True)
+
+        failures = [audit for audit in audits if audit.full_scans]
+        for audit in audits:
+            verdict = "FULL SCAN" if audit.full_scans else "ok"
+            self.stdout.write(f"{audit.name:<28} {verdict}")
+            if audit.full_scans or options["verbose_plans"]:
+                self.stdout.write(f"    {audit.plan}".replace("\n", "\n    "))
+        if failures:
+            raise CommandError(
+                f"{len(failures)} endpoint queries scan full tables: "
+                + ", ".join(audit.name for audit in failures)
+            )
@@ -0,0 +1,582 @@
+import http.client
+import io
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.templatetags.static import static
+from django.test import Client, override_settings
+from django.test.client import encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from shop.analytics import update_sales_rollups
+from shop.cache import catalog_cache
+from shop.cart import cart_store
+from shop.models import Order, Product
+from shop.seed import seed_orders, seed_products
+
+PASSWORD = "benchmark-password"
+BOUNDARY = "BenchmarkBoundary"
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    route: str
+    args: object = None
+    query: object = None
+    body: object = None
+    auth: str = None
+    # Scenarios dominated by password hashing run fewer requests.
+    weight: float = 1.0
+    # Path of a static file, requested instead of a route.
+    asset: str = None
+    # Untimed setup for each "fresh" user, called with (ctx, user_id).
+    prepare: object = None
+    # Set when body() returns an already encoded body instead of JSON data.
+    content_type: str = None
+
+    def path(self, ctx):
+        if self.asset:
+            return static(self.asset)
+        args = self.args(ctx) if self.args else []
+        query = self.query(ctx) if self.query else ""
+        return reverse(self.route, args=args) + query
+
+
+def product(ctx):
+    return [ctx["product"]]
+
+
+def order(ctx):
+    return [ctx["order"]]
+
+
+def image_upload():
+    """A small PNG as a multipart body, encoded once."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (1200, 900), "orange").save(buffer, "PNG")
+    upload = SimpleUploadedFile("lamp.png", buffer.getvalue(), "image/png")
+    return encode_multipart(BOUNDARY, {"image": upload})
+
+
+def fill_cart(ctx, user_id):
+    # Written straight to the cart cache, so in gunicorn mode this needs a
+    # cache the workers share (REDIS_URL).
+    cart_store.save(user_id, {ctx["product"]: 1})
+
+
+def scenarios():
+    return [
+        Scenario("GET products/", "GET", "list-create-products"),
+        Scenario(
+            "GET products/?search",
+            "GET",
+            "list-create-products",
+            query=lambda ctx: "?search=lamp",
+        ),
+        Scenario(
+            "GET products/?cursor (deep page)",
+            "GET",
+            "list-create-products",
+            query=lambda ctx: ctx["deep_page"],
+        ),
+        Scenario(
+            "GET products/<pk>",
+            "GET",
+            "update-delete-retrieve-products",
+            args=product,
+            auth="admin",
+        ),
+        Scenario(
+            "PATCH products/<pk>",
+            "PATCH",
+            "update-delete-retrieve-products",
+            args=product,
+            body=lambda ctx, i: {"stock": 10**9 - i},
+            auth="admin",
+        ),
+        Scenario(
+            "PATCH products/bulk",
+            "PATCH",
+            "bulk-products",
+            body=lambda ctx, i: [{"id": pk, "stock": 10**9} for pk in ctx["products"]],
+            auth="admin",
+        ),
+        Scenario(
+            "PUT products/<pk>/image",
+            "PUT",
+            "product-image",
+            args=product,
+            body=lambda ctx, i: ctx["image_upload"],
+            auth="admin",
+            content_type=f"multipart/form-data; boundary={BOUNDARY}",
+        ),
+        Scenario("GET async/products/", "GET", "async-list-products"),
+        Scenario(
+            "GET async/products/<pk>",
+            "GET",
+            "async-retrieve-products",
+            args=product,
+            auth="admin",
+        ),
+        Scenario("GET orders", "GET", "list-create-orders", auth="user"),
+        Scenario("GET async/orders", "GET", "async-list-orders", auth="user"),
+        Scenario(
+            "GET orders/<pk>",
+            "GET",
+            "update-delete-retrieve-orders",
+            args=order,
+            auth="user",
+        ),
+        Scenario(
+            "POST orders (checkout)",
+            "POST",
+            "list-create-orders",
+            body=lambda ctx, i: {
+                "items": [{"product_id": ctx["product"], "quantity": 1}]
+            },
+            auth="user",
+        ),
+        Scenario("GET cart", "GET", "cart", auth="user"),
+        Scenario(
+            "POST cart/items",
+            "POST",
+            "cart-items",
+            body=lambda ctx, i: {"product_id": ctx["product"], "quantity": 1},
+            auth="user",
+        ),
+        Scenario(
+            "PUT cart/items/<pk>",
+            "PUT",
+            "cart-item",
+            args=product,
+            body=lambda ctx, i: {"quantity": 2},
+            auth="user",
+        ),
+        Scenario(
+            "POST cart/checkout",
+            "POST",
+            "cart-checkout",
+            auth="fresh",
+            prepare=fill_cart,
+        ),
+        Scenario(
+            "PATCH orders/status",
+            "PATCH",
+            "bulk-order-status",
+            body=lambda ctx, i: [{"id": ctx["order"], "status": "Pending"}],
+            auth="admin",
+        ),
+        Scenario(
+            "POST login",
+            "POST",
+            "login",
+            body=lambda ctx, i: {"username": "bench-user", "password": PASSWORD},
+            weight=0.1,
+        ),
+        Scenario(
+            "POST register",
+            "POST",
+            "register-user",
+            body=lambda ctx, i: {
+                "username": f"bench-new-{ctx['run']}-{i}",
+                "password": PASSWORD,
+                "email": "bench@example.com",
+            },
+            weight=0.1,
+        ),
+        Scenario(
+            "POST async/login",
+            "POST",
+            "async-login",
+            body=lambda ctx, i: {"username": "bench-user", "password": PASSWORD},
+            weight=0.1,
+        ),
+        Scenario(
+            "POST async/register",
+            "POST",
+            "async-register-user",
+            body=lambda ctx, i: {
+                "username": f"bench-async-{ctx['run']}-{i}",
+                "password": PASSWORD,
+                "email": "bench@example.com",
+            },
+            weight=0.1,
+        ),
+        Scenario("POST logout", "POST", "logout", auth="fresh"),
+        Scenario("GET metrics", "GET", "metrics", auth="admin"),
+        Scenario("GET analytics/revenue", "GET", "analytics-revenue", auth="admin"),
+        Scenario(
+            "GET analytics/top-products",
+            "GET",
+            "analytics-top-products",
+            auth="admin",
+        ),
+        Scenario(
+            "GET analytics/low-stock", "GET", "analytics-low-stock", auth="admin"
+        ),
+        Scenario("GET static asset", "GET", None, asset="admin/css/base.css"),
+    ]
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and benchmark every shop route through "
+        "the test client and real WSGI, ASGI or gunicorn servers. Prints "
+        "p50/p95/p99 latency, requests/sec and queries per request as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--orders", type=int, default=5_000)
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument(
+            "--server",
+            choices=["client", "wsgi", "asgi", "gunicorn"],
+            action="append",
+            help=(
+                "Repeat to run several modes (default: client and wsgi). "
+                "gunicorn runs the production profile from gunicorn.conf.py."
+            ),
+        )
+        parser.add_argument("--only", help="Run scenarios whose name contains this")
+        parser.add_argument(
+            "--no-cache", action="store_true", help="Disable the catalog cache"
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        modes = options["server"] or ["client", "wsgi"]
+        if "asgi" in modes:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError("--server asgi needs uvicorn installed")
+        if "gunicorn" in modes and connection.vendor == "sqlite":
+            # gunicorn serves from other processes, which cannot see an
+            # in-memory test database.
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                tempfile.gettempdir(), f"shop-benchmark-{os.getpid()}.sqlite3"
+            )
+
+        test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        media_root = tempfile.TemporaryDirectory(prefix="shop-benchmark-media-")
+        try:
+            # One client sends every request, so rate limits would turn the
+            # measurements into 429s. Uploads go to a throwaway MEDIA_ROOT.
+            with override_settings(
+                SHOP_CATALOG_CACHE={"ENABLED": not options["no_cache"]},
+                SHOP_THROTTLE={"ENABLED": False},
+                MEDIA_ROOT=media_root.name,
+            ):
+                context = self.seed(options)
+                results = []
+                for mode in modes:
+                    for scenario in scenarios():
+                        only = options["only"]
+                        if only and only not in scenario.name:
+                            continue
+                        context["run"] = mode
+                        results.append(self.run(mode, scenario, context, options))
+        finally:
+            connection.creation.destroy_test_db(test_db, verbosity=0)
+            media_root.cleanup()
+
+        report = {
+            "config": {
+                key: options[key]
+                for key in ("users", "products", "orders", "requests", "concurrency")
+            }
+            | {"modes": modes, "catalog_cache": not options["no_cache"]},
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as stream:
+                stream.write(output)
+        self.stdout.write(output)
+
+    def seed(self, options):
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            User(username=f"bench-{i}", password=password)
+            for i in range(options["users"])
+        )
+        user = User.objects.create(username="bench-user", password=password)
+        admin = User.objects.create(
+            username="bench-admin", password=password, is_staff=True, is_superuser=True
+        )
+        seed_products(options["products"])
+        seed_orders(users + [user], options["orders"])
+        update_sales_rollups(lag=timedelta(0))
+
+        product = Product.objects.create(
+            name="Benchmark lamp", description="lamp", price="10.00", stock=10**9
+        )
+        order = Order.objects.create(user=user)
+        products = list(Product.objects.values_list("id", flat=True)[:100])
+        cart_store.save(user.id, {pk: 1 for pk in products[:10]})
+        deep_page = self.find_deep_page()
+        return {
+            "tokens": {
+                "user": Token.objects.create(user=user).key,
+                "admin": Token.objects.create(user=admin).key,
+            },
+            "product": product.id,
+            "products": products,
+            "order": order.id,
+            "deep_page": deep_page,
+            "image_upload": image_upload(),
+            # Numbers the "fresh" users across every scenario and mode.
+            "fresh_users": itertools.count(),
+        }
+
+    def find_deep_page(self):
+        """The query string of a page ~2000 rows into the catalog."""
+        client = Client()
+        query = "?page_size=100&count=false"
+        for _ in range(20):
+            next_url = client.get(reverse("list-create-products") + query).json()
+            if not next_url["next"]:
+                break
+            query = "?" + urlsplit(next_url["next"]).query
+        return query
+
+    def run(self, mode, scenario, context, options):
+        total = max(1, int(options["requests"] * scenario.weight))
+        if mode == "client":
+            latencies, queries, errors, elapsed = self.run_client(
+                scenario, context, total
+            )
+        else:
+            latencies, errors, elapsed = self.run_server(
+                mode, scenario, context, total, options["concurrency"]
+            )
+            queries = None
+        result = {
+            "endpoint": scenario.name,
+            "mode": mode,
+            "requests": total,
+            "errors": errors,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "requests_per_sec": round(total / elapsed, 1),
+        }
+        if queries is not None:
+            result["queries_per_request"] = round(statistics.fmean(queries), 2)
+        self.stderr.write(
+            f"{mode:>6} {scenario.name:<34} p50={result['p50_ms']:.2f}ms "
+            f"p99={result['p99_ms']:.2f}ms rps={result['requests_per_sec']}"
+        )
+        return result
+
+    def headers(self, scenario, context):
+        if scenario.auth in context["tokens"]:
+            return {"Authorization": f"Token {context['tokens'][scenario.auth]}"}
+        return {}
+
+    def request_args(self, scenario, context, i):
+        """Path, body and per-request headers, prepared outside the timing."""
+        body = scenario.body(context, i) if scenario.body else None
+        headers = {}
+        if scenario.auth == "fresh":
+            number = next(context["fresh_users"])
+            user = User.objects.create(username=f"bench-fresh-{number}")
+            headers["Authorization"] = f"Token {Token.objects.create(user=user).key}"
+            if scenario.prepare:
+                scenario.prepare(context, user.id)
+        return scenario.path(context), body, headers
+
+    def run_client(self, scenario, context, total):
+        client = Client(headers=self.headers(scenario, context))
+        send = getattr(client, scenario.method.lower())
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for i in range(total):
+            path, body, headers = self.request_args(scenario, context, i)
+            kwargs = {"headers": headers}
+            if scenario.content_type:
+                kwargs.update(data=body, content_type=scenario.content_type)
+            elif body is not None:
+                kwargs.update(data=json.dumps(body), content_type="application/json")
+            with CaptureQueriesContext(connection) as ctx:
+                begin = time.perf_counter()
+                response = send(path, **kwargs)
+                latencies.append((time.perf_counter() - begin) * 1000)
+            queries.append(len(ctx.captured_queries))
+            errors += response.status_code >= 400
+        return latencies, queries, errors, time.perf_counter() - started
+
+    def run_server(self, mode, scenario, context, total, concurrency):
+        host, port, stop = self.start_server(mode)
+        content_type = scenario.content_type or "application/json"
+        headers = {"Content-Type": content_type} | self.headers(scenario, context)
+        lock = threading.Lock()
+        latencies, errors = [], [0]
+
+        def send(args, record=True):
+            path, body, extra_headers = args
+            data = body
+            if body is not None and not scenario.content_type:
+                data = json.dumps(body)
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            begin = time.perf_counter()
+            conn.request(
+                scenario.method, path, body=data, headers=headers | extra_headers
+            )
+            status = conn.getresponse()
+            status.read()
+            latency = (time.perf_counter() - begin) * 1000
+            conn.close()
+            if not record:
+                return
+            with lock:
+                latencies.append(latency)
+                errors[0] += status.status >= 400
+
+        requests = [self.request_args(scenario, context, i) for i in range(total)]
+        try:
+            if scenario.method == "GET":
+                # Untimed requests so each worker has imported, connected
+                # and warmed its caches before measuring.
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    list(pool.map(lambda args: send(args, False), requests))
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(send, requests))
+            elapsed = time.perf_counter() - started
+        finally:
+            stop()
+        return latencies, errors[0], elapsed
+
+    def start_server(self, mode):
+        if mode == "gunicorn":
+            return self.start_gunicorn()
+        if mode == "wsgi":
+            from django.core.wsgi import get_wsgi_application
+
+            server = make_server(
+                "127.0.0.1",
+                0,
+                get_wsgi_application(),
+                server_class=ThreadingWSGIServer,
+                handler_class=QuietHandler,
+            )
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+
+            def stop():
+                server.shutdown()
+                server.server_close()
+
+            return "127.0.0.1", server.server_port, stop
+
+        import uvicorn
+        from django.core.asgi import get_asgi_application
+
+        port = free_port()
+        server = uvicorn.Server(
+            uvicorn.Config(
+                get_asgi_application(), host="127.0.0.1", port=port, log_level="error"
+            )
+        )
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+
+        return "127.0.0.1", port, stop
+
+    def start_gunicorn(self):
+        port = free_port()
+        env = os.environ | {
+            "PORT": str(port),
+            "GUNICORN_ACCESS_LOG": "/dev/null",
+            "SHOP_CATALOG_CACHE": "1" if catalog_cache.enabled else "0",
+            "SHOP_THROTTLE": "0",
+            "MEDIA_ROOT": str(settings.MEDIA_ROOT),
+        }
+        name = str(connection.settings_dict["NAME"])
+        if connection.vendor == "sqlite":
+            env["SQLITE_PATH"] = name
+        else:
+            env["POSTGRES_DB"] = name
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise CommandError("gunicorn exited during startup")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    process.kill()
+                    raise CommandError("gunicorn did not start within 30s")
+                time.sleep(0.1)
+
+        def stop():
+            process.terminate()
+            process.wait(timeout=30)
+
+        return "127.0.0.1", port, stop
+
@@ -0,0 +1,81 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from shop.passwords import HashingPool, verify
+
+HASHERS = {
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "scrypt": "django.contrib.auth.hashers.ScryptPasswordHasher",
+    "argon2": "django.contrib.auth.hashers.Argon2PasswordHasher",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password verifications (logins) per second per core: checked "
+        "inline on each request thread, as before, and on the bounded hashing "
+        "pool, for each hasher profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=200)
+        parser.add_argument(
+            "--concurrency", type=int, default=16, help="Simulated request threads"
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument(
+            "--hasher", choices=sorted(HASHERS), action="append", help="Default: all"
+        )
+
+    def handle(self, *args, **options):
+        cores = os.cpu_count() or 1
+        self.stdout.write(
+            f"{cores} cores, {options['concurrency']} request threads, "
+            f"{options['workers']} pool workers"
+        )
+        for name in options["hasher"] or sorted(HASHERS):
+            try:
+                with override_settings(PASSWORD_HASHERS=[HASHERS[name]]):
+                    self.compare(name, options, cores)
+            except ValueError as exc:
+                if options["hasher"]:
+                    raise CommandError(exc)
+                self.stdout.write(f"{name:<7} skipped: {exc}")
+
+    def compare(self, name, options, cores):
+        # Raises ValueError when the hasher's library is not installed.
+        encoded = make_password("correct horse battery staple")
+        inline = self.measure(
+            lambda: check_password("correct horse battery staple", encoded), options
+        )
+        pool = HashingPool()
+        with override_settings(
+            SHOP_PASSWORD_HASHING={
+                "WORKERS": options["workers"],
+                "MAX_PENDING": options["concurrency"],
+            }
+        ):
+            pooled = self.measure(
+                lambda: pool.run(verify, "correct horse battery staple", encoded)[0],
+                options,
+            )
+        pool.shutdown()
+        self.stdout.write(
+            f"{name:<7} inline {inline:8.1f}/s ({inline / cores:.1f}/s/core)  "
+            f"pool {pooled:8.1f}/s ({pooled / cores:.1f}/s/core)"
+        )
+
+    def measure(self, login, options):
+        count = options["logins"]
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            started = time.perf_counter()
+            results = list(executor.map(lambda _: login(), range(count)))
+            elapsed = time.perf_counter() - started
+        if not all(results):
+            raise CommandError("A verification failed")
+        return count / elapsed
@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Product
+from shop.search import LikeSearchBackend, get_search_backend
+from shop.seed import WORDS, rare_words, seed_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large catalog inside a transaction that is rolled back, and "
+        "compare product search latency of the LIKE scan and the full-text index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--page-size", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            seed_products(options["products"])
+            self.stdout.write(
+                f"Seeded {options['products']} products in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+
+            rng = random.Random(1)
+            rare = rare_words()
+            workloads = {
+                "rare terms": [rng.choice(rare) for _ in range(options["queries"])],
+                "common terms": [rng.choice(WORDS) for _ in range(options["queries"])],
+            }
+            backends = [("like", LikeSearchBackend()), ("index", get_search_backend())]
+            for workload, terms in workloads.items():
+                self.stdout.write(f"{workload} (first page + count):")
+                for name, backend in backends:
+                    timings = self.run(backend, terms, options["page_size"])
+                    self.stdout.write(
+                        f"  {name:>5} ({type(backend).__name__}): "
+                        f"p50={statistics.median(timings):.2f}ms "
+                        f"p95={self.percentile(timings, 95):.2f}ms "
+                        f"max={max(timings):.2f}ms"
+                    )
+            transaction.set_rollback(True)
+
+    def run(self, backend, terms, page_size):
+        # Mirrors what GET /products/?search= does: a COUNT and the first page.
+        timings = []
+        for term in terms:
+            queryset = backend.search(Product.objects.all(), [term])
+            if not queryset.query.order_by:
+                queryset = queryset.order_by("-created_at", "-id")
+            started = time.perf_counter()
+            queryset.count()
+            list(queryset[:page_size])
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = max(0, round(percent / 100 * len(ordered)) - 1)
+        return ordered[index]
@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from shop.seed import seed_orders, seed_products
+from shop.views import OrderListCreateView, ProductListCreateView
+
+ALL_PRODUCT_FIELDS = {
+    "fields": "id,name,description,price,stock,created_at,updated_at"
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed products and orders inside a transaction that is rolled back, and "
+        "compare list response times of the serializer path and the values() "
+        "path. Fails if the two ever render different bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20_000)
+        parser.add_argument("--orders", type=int, default=5_000)
+        parser.add_argument("--repeat", type=int, default=30)
+        parser.add_argument(
+            "--page-size", type=int, action="append", help="Default: 10 and 100"
+        )
+
+    def handle(self, *args, **options):
+        page_sizes = options["page_size"] or [10, 100]
+        with transaction.atomic(), override_settings(
+            SHOP_CATALOG_CACHE={"ENABLED": False}
+        ):
+            admin = User.objects.create(
+                username="benchmark-serialization", is_staff=True, is_superuser=True
+            )
+            seed_products(options["products"])
+            seed_orders([admin], options["orders"])
+
+            endpoints = [
+                ("products", ProductListCreateView, {}),
+                ("products (all fields)", ProductListCreateView, ALL_PRODUCT_FIELDS),
+                ("orders", OrderListCreateView, {}),
+            ]
+            for name, view_class, params in endpoints:
+                for page_size in page_sizes:
+                    query = params | {"page_size": page_size}
+                    self.compare(name, view_class, query, admin, options["repeat"])
+            transaction.set_rollback(True)
+
+    def compare(self, name, view_class, query, user, repeat):
+        timings, bodies = {}, {}
+        for label, values in (("serializer", False), ("values", True)):
+            view = view_class.as_view(values_serialization=values)
+            timings[label], bodies[label] = self.run(view, query, user, repeat)
+        if bodies["serializer"] != bodies["values"]:
+            raise CommandError(f"{name}: the two paths rendered different JSON")
+
+        slow = statistics.median(timings["serializer"])
+        fast = statistics.median(timings["values"])
+        self.stdout.write(
+            f"{name:<22} page_size={query['page_size']:<4} "
+            f"serializer p50={slow:.2f}ms  values p50={fast:.2f}ms  "
+            f"speedup={slow / fast:.2f}x  ({len(bodies['values'])} bytes)"
+        )
+
+    def run(self, view, query, user, repeat):
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(repeat):
+            request = factory.get("/", query, HTTP_ACCEPT="application/json")
+            force_authenticate(request, user)
+            started = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, response.content
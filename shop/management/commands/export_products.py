@@ -0,0 +1,58 @@
+import csv
+import json
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from shop.models import Product
+
+FIELDS = ["id", "name", "description", "price", "stock", "created_at", "updated_at"]
+
+
+class Command(BaseCommand):
+    help = "Stream every product to a CSV or JSON Lines file in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to write, or - for stdout")
+        parser.add_argument("--format", choices=["csv", "jsonl"])
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+        rows = (
+            Product.objects.order_by("id")
+            .values_list(*FIELDS)
+            .iterator(chunk_size=options["batch_size"])
+        )
+
+        started = time.perf_counter()
+        if path == "-":
+            target = nullcontext(sys.stdout)
+        else:
+            target = Path(path).open("w", newline="", encoding="utf-8")
+        with target as stream:
+            count = self.write(stream, fmt, rows)
+
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        self.stderr.write(
+            f"Exported {count} products in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        )
+
+    def write(self, stream, fmt, rows):
+        count = 0
+        if fmt == "csv":
+            writer = csv.writer(stream)
+            writer.writerow(FIELDS)
+            for count, row in enumerate(rows, start=1):
+                writer.writerow(row[:-2] + (row[-2].isoformat(), row[-1].isoformat()))
+        else:
+            for count, row in enumerate(rows, start=1):
+                stream.write(json.dumps(dict(zip(FIELDS, row)), cls=DjangoJSONEncoder))
+                stream.write("\n")
+        return count
@@ -0,0 +1,118 @@
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from shop.cache import catalog_cache
+from shop.models import Product
+from shop.serializers import ProductSerializer
+
+UPDATE_FIELDS = ["name", "description", "price", "stock", "updated_at"]
+
+
+def read_rows(stream, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise CommandError("Cannot tell the file format; pass --format csv|jsonl")
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from a CSV or JSON Lines file and upsert them in "
+        "batches. Rows with an id update that product; rows without one are "
+        "inserted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or - for stdin")
+        parser.add_argument("--format", choices=["csv", "jsonl"])
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = detect_format(path, options["format"])
+        self.validator = ProductSerializer()
+        self.explicit_ids = False
+        self.imported = self.skipped = 0
+
+        started = time.perf_counter()
+        if path == "-":
+            self.load(sys.stdin, fmt, options["batch_size"])
+        else:
+            with Path(path).open(newline="", encoding="utf-8") as stream:
+                self.load(stream, fmt, options["batch_size"])
+
+        if self.explicit_ids:
+            # Explicit ids do not advance PostgreSQL sequences.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Product]):
+                    cursor.execute(sql)
+        catalog_cache.invalidate()
+
+        elapsed = time.perf_counter() - started
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(
+            f"Imported {self.imported} products, skipped {self.skipped} invalid "
+            f"rows in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        )
+
+    def load(self, stream, fmt, batch_size):
+        batch = []
+        for number, row in enumerate(read_rows(stream, fmt), start=1):
+            product = self.build(number, row)
+            if product is not None:
+                batch.append(product)
+            if len(batch) >= batch_size:
+                self.save(batch)
+                batch = []
+        if batch:
+            self.save(batch)
+
+    def build(self, number, row):
+        try:
+            data = self.validator.run_validation(row)
+            product = Product(**data)
+            if row.get("id") not in (None, ""):
+                product.id = int(row["id"])
+        except (ValidationError, ValueError, TypeError) as exc:
+            detail = getattr(exc, "detail", str(exc))
+            self.stderr.write(f"Row {number}: {detail}")
+            self.skipped += 1
+            return None
+        return product
+
+    def save(self, batch):
+        # The last row wins when a feed repeats an id within one batch.
+        updates = list({p.id: p for p in batch if p.id is not None}.values())
+        inserts = [product for product in batch if product.id is None]
+        with transaction.atomic():
+            if updates:
+                Product.objects.bulk_create(
+                    updates,
+                    update_conflicts=True,
+                    unique_fields=["id"],
+                    update_fields=UPDATE_FIELDS,
+                )
+                self.explicit_ids = True
+            if inserts:
+                Product.objects.bulk_create(inserts)
+        self.imported += len(batch)
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.services import reconcile_order_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every order's total_amount and item_count from its items and "
+        "fix the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        fixed = reconcile_order_totals(options["batch_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Fixed {fixed} orders in {elapsed:.2f}s")
@@ -0,0 +1,58 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.images import ImagePool, generate_renditions
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the image renditions of every product with an image, on a "
+        "process per core. Run it after changing SHOP_IMAGES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Products whose images are rendered in parallel at a time",
+        )
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="Only products whose renditions were never generated",
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image="").order_by("pk")
+        if options["missing"]:
+            products = products.filter(image_renditions={})
+        pool = ImagePool(options["workers"])
+        started = time.perf_counter()
+        done = failed = 0
+        last_pk = 0
+        try:
+            while True:
+                batch = list(
+                    products.filter(pk__gt=last_pk).values_list("pk", flat=True)[
+                        : options["batch_size"]
+                    ]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                batch_done, batch_failed = generate_renditions(batch, pool)
+                done += batch_done
+                failed += batch_failed
+        finally:
+            pool.shutdown()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Rendered {done} product images in {elapsed:.2f}s "
+            f"({done / elapsed if elapsed else 0:.1f}/s, {options['workers']} "
+            f"workers), {failed} failed"
+        )
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.outbox import OutboxWorker, queue_depth
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the outbox jobs queued by order changes (confirmation emails and "
+        "other post-commit work) until interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, help="Default: SHOP_OUTBOX")
+        parser.add_argument("--batch-size", type=int, help="Default: SHOP_OUTBOX")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(options["threads"], options["batch_size"])
+        try:
+            while True:
+                started = time.perf_counter()
+                processed = worker.run_until_empty()
+                elapsed = time.perf_counter() - started
+                if processed or options["once"]:
+                    queued, _ = queue_depth().get("queued", (0, None))
+                    self.stdout.write(
+                        f"Ran {processed} jobs in {elapsed:.2f}s "
+                        f"({processed / elapsed if elapsed else 0:.1f}/s), "
+                        f"{queued} queued"
+                    )
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+        finally:
+            worker.shutdown()
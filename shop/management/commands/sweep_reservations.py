@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.services import expire_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Cancel the pending orders whose stock reservations have expired and "
+        "put the stock back. Run it from cron, or with --loop as a worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--loop", action="store_true", help="Keep sweeping until interrupted"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=30,
+            help="Seconds between sweeps with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            cancelled = expire_reservations(options["batch_size"])
+            elapsed = time.perf_counter() - started
+            if cancelled or not options["loop"]:
+                self.stdout.write(
+                    f"Cancelled {cancelled} expired orders in {elapsed:.2f}s"
+                )
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
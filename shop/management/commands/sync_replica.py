@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shop.routers import replicas
+
+
+def copy_sqlite(source, target):
+    """Copy the SQLite database at ``source`` over the one at ``target``."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the local stand-in replicas "
+        "(SQLITE_REPLICA_PATH), to try out replica routing without PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            type=float,
+            metavar="SECONDS",
+            help="Copy again every SECONDS, like a lagging replica",
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict
+        aliases = replicas.aliases
+        if not aliases:
+            raise CommandError("No replicas configured; set SQLITE_REPLICA_PATH.")
+        for alias in [DEFAULT_DB_ALIAS, *aliases]:
+            if connections[alias].vendor != "sqlite":
+                raise CommandError(f"{alias} is not SQLite; replicate it natively.")
+        while True:
+            for alias in aliases:
+                copy_sqlite(primary["NAME"], connections[alias].settings_dict["NAME"])
+                self.stdout.write(f"Copied {primary['NAME']} to {alias}")
+            if not options["loop"]:
+                return
+            time.sleep(options["loop"])
@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop.analytics import reset_sales_rollups, rolled_up_until, update_sales_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold the orders completed since the last run into the sales rollups "
+        "behind the analytics endpoints. Run it from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--lag",
+            type=int,
+            default=60,
+            help="Leave orders completed less than this many seconds ago",
+        )
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Start over from the first order"
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options["rebuild"]:
+            reset_sales_rollups()
+        processed = update_sales_rollups(
+            options["batch_size"], timedelta(seconds=options["lag"])
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Rolled up {processed} orders in {elapsed:.2f}s "
+            f"(up to {rolled_up_until()})"
+        )
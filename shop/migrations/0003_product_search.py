@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 17:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from shop.search import install_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    install_search_index(schema_editor.connection, Product, schema_editor, rebuild=True)
+
+
+def drop_search_index(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    uninstall_search_index(schema_editor.connection, Product, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='shop.product')),
+            ],
+            options={
+                'db_table': 'shop_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
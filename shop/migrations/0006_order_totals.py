@@ -0,0 +1,56 @@
+# Generated by Django 5.1 on 2026-10-18 17:45
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    # Existing items get the product's current price: the best snapshot left.
+    Product = apps.get_model("shop", "Product")
+    Order = apps.get_model("shop", "Order")
+    OrderItem = apps.get_model("shop", "OrderItem")
+
+    price = Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+    OrderItem.objects.update(unit_price=Subquery(price))
+
+    items = OrderItem.objects.filter(order=OuterRef("pk")).values("order")
+    subtotal = ExpressionWrapper(
+        F("quantity") * F("unit_price"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    Order.objects.update(
+        total_amount=Coalesce(
+            Subquery(items.annotate(total=Sum(subtotal)).values("total")), 0,
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        item_count=Coalesce(
+            Subquery(items.annotate(count=Sum("quantity")).values("count")), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
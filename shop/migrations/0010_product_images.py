@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='products/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
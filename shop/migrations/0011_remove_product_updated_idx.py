@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_images'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_updated_idx',
+        ),
+    ]
@@ -7,21 +7,212 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField()
+    # Stored under a content hash by shop/images.py, which also fills in
+    # image_renditions ({name: path}) in the background.
+    image = models.ImageField(upload_to="products/", blank=True)
+    image_renditions = models.JSONField(default=dict, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="product_created_id_idx"),
+            models.Index(fields=["price"], name="product_price_idx"),
+            models.Index(fields=["stock", "id"], name="product_stock_idx"),
+        ]
+
+    @property
+    def last_modified(self):
+        return self.updated_at
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        # Load every item and the product columns OrderItemSerializer reads
+        # in one extra query, instead of one query per item.
+        items = (
+            OrderItem.objects.select_related("product")
+            .only(
+                "id",
+                "quantity",
+                "unit_price",
+                "order_id",
+                "product_id",
+                "product__name",
+            )
+            .order_by("id")
+        )
+        return self.prefetch_related(models.Prefetch("items", queryset=items))
+
 
 class Order(models.Model):
     user = models.ForeignKey(User, related_name="orders", on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=10, 
-        choices=[("Pending", "Pending"), ("Completed", "Completed")], default="Pending"
+        choices=[
+            ("Pending", "Pending"),
+            ("Completed", "Completed"),
+            # Its stock reservations expired before it was completed.
+            ("Cancelled", "Cancelled"),
+        ],
+        default="Pending",
     )
+    # Kept in step with the items by shop/signals.py (and place_order for bulk
+    # inserts); `manage.py reconcile_order_totals` rebuilds them.
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    # Set once when the order becomes Completed; the analytics watermark.
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="order_created_id_idx"),
+            models.Index(
+                fields=["user", "created_at", "id"], name="order_user_created_id_idx"
+            ),
+            models.Index(
+                fields=["user", "status", "created_at", "id"],
+                name="order_user_status_idx",
+            ),
+            models.Index(
+                fields=["completed_at", "id"], name="order_completed_id_idx"
+            ),
+        ]
+
+    @property
+    def last_modified(self):
+        # Not the products' updated_at: every sale bumps that, which would
+        # fail other customers' If-Match on their own orders.
+        return self.updated_at
 
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name="items", on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name="order_items", on_delete=models.CASCADE)
     quantity = models.IntegerField()
+    # The product's price at checkout; later price changes leave orders alone.
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the order totals currently include, so a save can apply the
+        # difference.
+        instance._counted = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def subtotal(self):
+        return self.quantity * self.unit_price
+
+
+class StockReservation(models.Model):
+    """
+    Stock taken out of ``Product.stock`` for a Pending order. Completing the
+    order drops the reservation; letting it expire puts the stock back (see
+    shop/services.py and `manage.py sweep_reservations`).
+    """
+
+    order = models.ForeignKey(
+        Order, related_name="reservations", on_delete=models.CASCADE
+    )
+    product = models.ForeignKey(
+        Product, related_name="reservations", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # The sweeper's scan, oldest first.
+            models.Index(fields=["expires_at", "id"], name="reservation_expires_idx"),
+        ]
+
+
+class OutboxJob(models.Model):
+    """
+    Work to run after a transaction commits, written in that transaction and
+    run by `manage.py run_worker`; see shop/outbox.py.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10,
+        choices=[(QUEUED, "Queued"), (RUNNING, "Running"), (FAILED, "Failed")],
+        default=QUEUED,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    # When a queued job may next run; for a running job, when its claim lapses
+    # and another worker may take it over.
+    available_at = models.DateTimeField()
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The workers' claim query, oldest first.
+            models.Index(
+                fields=["status", "available_at", "id"], name="outbox_due_idx"
+            ),
+        ]
+
+
+class DailySales(models.Model):
+    """Completed orders rolled up per day by shop/analytics.py."""
+
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+
+class ProductDailySales(models.Model):
+    """Items of completed orders rolled up per product and day."""
+
+    date = models.DateField()
+    product = models.ForeignKey(
+        Product, related_name="daily_sales", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "product"], name="product_daily_sales_uniq"
+            ),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """The last order (by completed_at, id) a rollup has taken in."""
+
+    name = models.CharField(max_length=50, unique=True)
+    completed_at = models.DateTimeField(null=True)
+    order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductSearchIndex(models.Model):
+    # The SQLite FTS5 table from shop/search.py; only ever joined, never written.
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search_index",
+        on_delete=models.DO_NOTHING,
+    )
+
+    class Meta:
+        managed = False
+        db_table = "shop_product_fts"
@@ -0,0 +1,235 @@
+"""
+A transactional outbox for the work that follows an order change.
+
+``enqueue`` writes an ``OutboxJob`` row in the caller's transaction, so a job
+exists if and only if the change it follows was committed, and the request
+returns without waiting for emails or other slow side effects. Workers
+(`manage.py run_worker`) claim due jobs in batches, run them on a thread
+pool and retry failures with exponential backoff.
+
+Jobs run at least once: a worker that dies mid-batch leaves its jobs to be
+claimed again once their lease runs out, so tasks must be idempotent.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .instrumentation import registry
+from .models import OutboxJob
+
+logger = logging.getLogger(__name__)
+
+tasks = {}
+
+
+def get_options():
+    return getattr(settings, "SHOP_OUTBOX", {})
+
+
+def task(name):
+    """Register the decorated function as the handler for ``name`` jobs."""
+
+    def register(fn):
+        tasks[name] = fn
+        return fn
+
+    return register
+
+
+def enqueue(name, payloads, delay=0):
+    """
+    Queue one ``name`` job per payload. Call inside the transaction that makes
+    the change the jobs follow.
+    """
+    available_at = timezone.now() + timedelta(seconds=delay)
+    return OutboxJob.objects.bulk_create(
+        OutboxJob(task=name, payload=payload, available_at=available_at)
+        for payload in payloads
+    )
+
+
+def due_jobs(now):
+    # Queued jobs whose backoff is over, and running jobs whose worker's
+    # lease ran out.
+    return OutboxJob.objects.filter(
+        status__in=[OutboxJob.QUEUED, OutboxJob.RUNNING], available_at__lte=now
+    ).order_by("available_at", "pk")
+
+
+def claim_jobs(batch_size, lease):
+    """
+    Take up to ``batch_size`` due jobs for this worker for ``lease`` seconds.
+
+    PostgreSQL skips rows other workers have locked, so concurrent workers
+    claim disjoint batches without waiting on each other. Backends without
+    ``SKIP LOCKED`` (SQLite) claim with a conditional UPDATE instead: a job
+    another worker took in the meantime is no longer due and is left out.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    claim = {
+        "status": OutboxJob.RUNNING,
+        "claimed_by": token,
+        "available_at": now + timedelta(seconds=lease),
+    }
+    with transaction.atomic():
+        due = due_jobs(now)
+        if connection.features.has_select_for_update_skip_locked:
+            locked = due.select_for_update(skip_locked=True)
+            ids = list(locked.values_list("pk", flat=True)[:batch_size])
+            OutboxJob.objects.filter(pk__in=ids).update(**claim)
+        else:
+            ids = list(due.values_list("pk", flat=True)[:batch_size])
+            due.filter(pk__in=ids).update(**claim)
+    return list(OutboxJob.objects.filter(claimed_by=token, status=OutboxJob.RUNNING))
+
+
+def backoff(attempts):
+    options = get_options()
+    delay = options.get("BACKOFF", 10) * 2 ** (attempts - 1)
+    return min(delay, options.get("MAX_BACKOFF", 3600))
+
+
+class OutboxStats:
+    """Jobs run by this process, by task and outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def record(self, name, outcome):
+        with self._lock:
+            self.counts[name, outcome] += 1
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+
+stats = OutboxStats()
+
+
+def run_job(job):
+    """Run one claimed job; returns the error message, or None on success."""
+    try:
+        handler = tasks.get(job.task)
+        if handler is None:
+            raise LookupError(f"No task named {job.task!r}")
+        handler(job.payload)
+        return None
+    except Exception as exc:
+        logger.exception("Outbox job %s (%s) failed", job.pk, job.task)
+        return f"{type(exc).__name__}: {exc}"
+
+
+def finish_jobs(jobs, errors):
+    """
+    Delete the jobs that ran and reschedule (or give up on) the rest. Rows
+    are matched on the batch's claim too, so a job another worker took over
+    after this worker's lease ran out is left to that worker.
+    """
+    now = timezone.now()
+    token = jobs[0].claimed_by
+    max_attempts = get_options().get("MAX_ATTEMPTS", 5)
+    done = []
+    for job, error in zip(jobs, errors):
+        if error is None:
+            done.append(job.pk)
+            stats.record(job.task, "done")
+            continue
+        attempts = job.attempts + 1
+        gave_up = attempts >= max_attempts
+        stats.record(job.task, "failed" if gave_up else "retried")
+        OutboxJob.objects.filter(pk=job.pk, claimed_by=token).update(
+            status=OutboxJob.FAILED if gave_up else OutboxJob.QUEUED,
+            attempts=attempts,
+            available_at=now + timedelta(seconds=backoff(attempts)),
+            last_error=error,
+        )
+    if done:
+        OutboxJob.objects.filter(pk__in=done, claimed_by=token).delete()
+
+
+class OutboxWorker:
+    def __init__(self, threads=None, batch_size=None, lease=None):
+        options = get_options()
+        self.threads = threads or options.get("THREADS", 4)
+        self.batch_size = batch_size or options.get("BATCH_SIZE", 50)
+        self.lease = lease or options.get("LEASE", 300)
+        self.executor = ThreadPoolExecutor(
+            self.threads, thread_name_prefix="outbox-worker"
+        )
+
+    @staticmethod
+    def run_job(job):
+        try:
+            return run_job(job)
+        finally:
+            # Each pool thread keeps its own connection, recycled like a
+            # request's would be.
+            close_old_connections()
+
+    def run_batch(self):
+        """Claim and run one batch; returns the number of jobs claimed."""
+        jobs = claim_jobs(self.batch_size, self.lease)
+        if jobs:
+            errors = list(self.executor.map(self.run_job, jobs))
+            finish_jobs(jobs, errors)
+        return len(jobs)
+
+    def run_until_empty(self):
+        total = 0
+        while processed := self.run_batch():
+            total += processed
+        return total
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def queue_depth():
+    """``{status: (jobs, oldest available_at)}`` for the jobs still in the table."""
+    rows = (
+        OutboxJob.objects.values("status")
+        .annotate(jobs=Count("pk"), oldest=Min("available_at"))
+        .order_by()
+    )
+    return {row["status"]: (row["jobs"], row["oldest"]) for row in rows}
+
+
+def outbox_collector():
+    lines = [
+        "# HELP shop_outbox_jobs Jobs in the outbox table",
+        "# TYPE shop_outbox_jobs gauge",
+    ]
+    depth = queue_depth()
+    for status, _ in OutboxJob._meta.get_field("status").choices:
+        jobs, _ = depth.get(status, (0, None))
+        lines.append(f'shop_outbox_jobs{{status="{status}"}} {jobs}')
+    queued = depth.get(OutboxJob.QUEUED)
+    lag = time.time() - queued[1].timestamp() if queued else 0
+    lines.append("# HELP shop_outbox_lag_seconds Age of the oldest queued job")
+    lines.append("# TYPE shop_outbox_lag_seconds gauge")
+    lines.append(f"shop_outbox_lag_seconds {max(lag, 0):.3f}")
+    lines.append("# HELP shop_outbox_jobs_total Jobs run by this process")
+    lines.append("# TYPE shop_outbox_jobs_total counter")
+    with stats._lock:
+        counts = sorted(stats.counts.items())
+    for (name, outcome), count in counts:
+        lines.append(
+            f'shop_outbox_jobs_total{{task="{name}",outcome="{outcome}"}} {count}'
+        )
+    return lines
+
+
+registry.collectors.append(outbox_collector)
@@ -0,0 +1,172 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on a unique composite ordering.
+
+    Every page is fetched with ``WHERE (created_at, id) < (...) LIMIT n``
+    instead of an ``OFFSET``, so deep pages cost the same as the first one.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 10
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    include_count = True
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if self.get_include_count(request):
+            self.count = queryset.count()
+        return self.paginate_rows(list(page_queryset))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        The sliced queryset for the requested page, without evaluating it,
+        so async callers can iterate it with ``async for``.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.position, self.reverse = self.decode_cursor(request)
+        self.count = None
+
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(self.get_seek_filter(self.position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self.flip(field) for field in ordering]
+        return queryset.order_by(*ordering)[: self.page_size + 1]
+
+    def paginate_rows(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {}
+        if self.count is not None:
+            payload["count"] = self.count
+        payload["next"] = self.get_next_link()
+        payload["previous"] = self.get_previous_link()
+        payload["results"] = data
+        return Response(payload)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count
+        return value.lower() not in ("0", "false", "no")
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_ordering(self, queryset):
+        # Filters that rank their results (full-text search) order the
+        # queryset themselves; seek on that ordering instead of the default.
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return self.ordering
+
+    def get_seek_filter(self, position):
+        """
+        Expand ``(a, b) < (x, y)`` into ``a < x OR (a = x AND b < y)``, which
+        every backend can answer from a composite index.
+        """
+        seek = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip("-")
+            descending = field.startswith("-") != self.reverse
+            lookup = f"{name}__lt" if descending else f"{name}__gt"
+            seek |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return seek
+
+    def get_position(self, row):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        return values
+
+    def encode_cursor(self, row, reverse):
+        data = {"p": self.get_position(row)}
+        if reverse:
+            data["r"] = 1
+        raw = json.dumps(data, separators=(",", ":")).encode("ascii")
+        cursor = base64.urlsafe_b64encode(raw).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            position = data["p"]
+            reverse = bool(data.get("r"))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+
+class ProductPagination(KeysetPagination):
+    page_size = 3
+
+
+class OrderPagination(KeysetPagination):
+    page_size = 10
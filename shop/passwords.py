@@ -0,0 +1,125 @@
+"""
+Password hashing off the request thread.
+
+Hashing and verification are deliberately slow (PBKDF2, scrypt, Argon2), so
+they run on a bounded thread pool: the hashers release the GIL, async views
+can await the work without blocking the event loop, and a burst of logins
+queues at most ``MAX_PENDING`` jobs before new ones are turned away with a
+503 instead of starving every other request of CPU.
+
+Logins go through ``django.contrib.auth.authenticate()`` as usual;
+``HashingPoolBackend`` is ModelBackend with its password check moved onto
+the pool. Only the hashing runs there; database reads and writes stay on
+the caller's thread (and connection).
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import User
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+INVALID_CREDENTIALS = _("Unable to log in with provided credentials.")
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Too many logins in progress, try again shortly.")
+    default_code = "hashing_busy"
+
+
+class HashingPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    @property
+    def options(self):
+        return getattr(settings, "SHOP_PASSWORD_HASHING", {})
+
+    def get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.options.get("WORKERS", 1),
+                    thread_name_prefix="password-hashing",
+                )
+                self._slots = threading.BoundedSemaphore(
+                    self.options.get("MAX_PENDING", 64)
+                )
+            return self._executor
+
+    def submit(self, fn, *args):
+        executor = self.get_executor()
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        future = executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    async def arun(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        """Stop the workers; the next job starts a pool with current settings."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+
+
+hashing_pool = HashingPool()
+
+
+def verify(password, encoded):
+    """
+    ``(valid, upgraded)``: whether ``password`` matches ``encoded`` and, if
+    it does but was hashed with an outdated hasher or work factor, a fresh
+    hash to store in its place.
+    """
+    if encoded is None:
+        # Unknown user: hash anyway so the response time does not tell.
+        make_password(password)
+        return False, None
+    outdated = []
+    valid = check_password(password, encoded, setter=outdated.append)
+    return valid, make_password(password) if outdated else None
+
+
+def hash_password(password):
+    return hashing_pool.run(make_password, password)
+
+
+async def ahash_password(password):
+    return await hashing_pool.arun(make_password, password)
+
+
+class HashingPoolBackend(ModelBackend):
+    """
+    ``ModelBackend`` with the password verified on ``hashing_pool``, and an
+    outdated hash replaced by a current one on a successful login.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = User._default_manager.filter(**{User.USERNAME_FIELD: username}).first()
+        valid, upgraded = hashing_pool.run(verify, password, user and user.password)
+        if user is None or not valid or not self.user_can_authenticate(user):
+            return None
+        if upgraded:
+            user.password = upgraded
+            user.save(update_fields=["password"])
+        return user
@@ -0,0 +1,126 @@
+import json
+import re
+from dataclasses import dataclass, field
+
+from django.db import connections
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .models import Order, OrderItem, Product
+from . import views
+
+SQLITE_FULL_SCAN = re.compile(r"\bSCAN (\w+)(?: AS \w+)?$")
+
+
+@dataclass
+class PlanAudit:
+    name: str
+    plan: str
+    full_scans: list = field(default_factory=list)
+
+
+def build_view(view_class, user, params=None, **kwargs):
+    request = Request(APIRequestFactory().get("/", params or {}))
+    request.user = user
+    view = view_class(request=request, kwargs=kwargs, format_kwarg=None)
+    return view, request
+
+
+def list_queryset(view_class, user, params=None):
+    """
+    The page query a list endpoint runs: its filtered queryset, sought and
+    limited by the view's paginator.
+    """
+    view, request = build_view(view_class, user, params)
+    queryset = view.filter_queryset(view.get_queryset())
+    return view.paginator.get_page_queryset(queryset, request, view)
+
+
+def count_queryset(view_class, user, params=None):
+    """
+    The rows a list endpoint counts when the client does not opt out with
+    ``?count=false``; EXPLAIN cannot take the COUNT itself, so this selects
+    their keys through the same filters.
+    """
+    view, _ = build_view(view_class, user, params)
+    return view.filter_queryset(view.get_queryset()).order_by().values("pk")
+
+
+def detail_queryset(view_class, user, pk):
+    view, _ = build_view(view_class, user, pk=pk)
+    return view.get_queryset().filter(pk=pk)
+
+
+def endpoint_querysets(user, admin):
+    """
+    Yield ``(name, queryset)`` for the queries behind each list/detail route
+    in ``shop/urls.py``, as seen by ``user`` and ``admin``.
+    """
+    product = Product.objects.only("id").order_by("id").first()
+    order = Order.objects.only("id").filter(user=user).order_by("id").first()
+
+    yield "products: first page", list_queryset(views.ProductListCreateView, user)
+    yield "products: price range", list_queryset(
+        views.ProductListCreateView, user, {"price__gte": "10", "price__lte": "20"}
+    )
+    yield "products: search", list_queryset(
+        views.ProductListCreateView, user, {"search": "lamp"}
+    )
+    yield "products: detail", detail_queryset(
+        views.ProductRetrieveUpdateDestroyView, admin, product.pk
+    )
+    yield "orders: user first page", list_queryset(views.OrderListCreateView, user)
+    yield "orders: user by status", list_queryset(
+        views.OrderListCreateView, user, {"status": "Completed"}
+    )
+    yield "orders: user count", count_queryset(views.OrderListCreateView, user)
+    yield "orders: admin first page", list_queryset(views.OrderListCreateView, admin)
+    yield "orders: detail", detail_queryset(
+        views.OrderRetrieveUpdateDestroyView, user, order.pk
+    )
+    # The prefetch query that loads items for a page of orders.
+    order_ids = list(Order.objects.filter(user=user).values_list("id", flat=True)[:10])
+    prefetch = Order.objects.with_items()._prefetch_related_lookups[0].queryset
+    yield "orders: items prefetch", prefetch.filter(order_id__in=order_ids)
+
+
+def find_full_scans(vendor, plan):
+    if vendor == "sqlite":
+        scans = []
+        for line in plan.splitlines():
+            detail = line.split(maxsplit=3)[-1]
+            match = SQLITE_FULL_SCAN.search(detail)
+            if match:
+                scans.append(match.group(1))
+        return scans
+    if vendor == "postgresql":
+        scans = []
+        nodes = [node["Plan"] for node in json.loads(plan)]
+        while nodes:
+            node = nodes.pop()
+            if node["Node Type"] == "Seq Scan":
+                scans.append(node["Relation Name"])
+            nodes.extend(node.get("Plans", []))
+        return scans
+    return []
+
+
+def audit_query_plans(user, admin, using="default"):
+    vendor = connections[using].vendor
+    options = {"format": "json"} if vendor == "postgresql" else {}
+    audits = []
+    for name, queryset in endpoint_querysets(user, admin):
+        plan = queryset.using(using).explain(**options)
+        audits.append(PlanAudit(name, plan, find_full_scans(vendor, plan)))
+    return audits
+
+
+def analyze_tables(using="default"):
+    """Refresh planner statistics so plans reflect the seeded volumes."""
+    connection = connections[using]
+    tables = [model._meta.db_table for model in (Product, Order, OrderItem)]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"ANALYZE {', '.join(tables)}")
+        elif connection.vendor == "sqlite":
+            cursor.execute("ANALYZE")
@@ -0,0 +1,36 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib json is used instead
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` that hands responses built by the ``values()`` list path
+    (marked ``response.plain_json``) to orjson when it is installed.
+
+    Those responses hold only str, int, bool, None, list and dict, for which
+    orjson's compact UTF-8 output is byte-identical to DRF's once U+2028 and
+    U+2029 are escaped the same way. Everything else, including floats whose
+    exponent formatting differs, goes through the stdlib encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get("response")
+        if (
+            orjson is None
+            or data is None
+            or not getattr(response, "plain_json", False)
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context)
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return (
+            orjson.dumps(data)
+            .replace(b"\xe2\x80\xa8", b"\\u2028")
+            .replace(b"\xe2\x80\xa9", b"\\u2029")
+        )
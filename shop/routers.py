@@ -0,0 +1,245 @@
+"""
+Read replicas for the catalog and order reads.
+
+Views that opt in (``ReplicaReadMixin`` in shop/views.py) run their GET
+queries on one of the ``SHOP_REPLICAS["ALIASES"]`` databases; everything
+else, and every write, goes to ``default``. A user who writes is pinned to
+``default`` for ``PIN_SECONDS`` afterwards, through the shared cache so every
+worker sees it, and reads their own writes despite replication lag.
+Responses the catalog cache keeps for everyone are built from ``default``
+(``primary_reads``), so the lag never outlives a cache write.
+
+Locally, ``SQLITE_REPLICA_PATH`` adds a second SQLite file as the replica;
+`manage.py sync_replica` copies the primary into it.
+"""
+
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .instrumentation import registry
+
+_routing = contextvars.ContextVar("shop_db_routing", default=None)
+
+# With "least_latency", one read in this many still goes round-robin, so a
+# replica that was slow once gets measured again.
+PROBE_EVERY = 20
+
+
+def get_options():
+    return getattr(settings, "SHOP_REPLICAS", {})
+
+
+class Routing:
+    """Where the current request's reads go."""
+
+    def __init__(self):
+        self.replica = False
+        self.alias = None
+        self.wrote = False
+
+
+@contextmanager
+def routing():
+    state = Routing()
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+class ReplicaPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.latency = {}
+
+    @property
+    def aliases(self):
+        return get_options().get("ALIASES", [])
+
+    def choose(self):
+        aliases = self.aliases
+        if not aliases:
+            return DEFAULT_DB_ALIAS
+        n = next(self._counter)
+        if get_options().get("STRATEGY") == "least_latency" and n % PROBE_EVERY:
+            # Replicas not measured yet count as fastest, so each gets tried.
+            return min(aliases, key=lambda alias: self.latency.get(alias, 0.0))
+        return aliases[n % len(aliases)]
+
+    def record(self, alias, seconds):
+        """Fold one query's time into the alias's moving average."""
+        with self._lock:
+            previous = self.latency.get(alias)
+            self.latency[alias] = (
+                seconds if previous is None else previous * 0.8 + seconds * 0.2
+            )
+
+    def timer(self, alias):
+        def execute_wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.record(alias, time.perf_counter() - started)
+
+        return execute_wrapper
+
+
+replicas = ReplicaPool()
+
+
+@receiver(connection_created)
+def time_replica_queries(sender, connection, **kwargs):
+    if connection.alias in replicas.aliases and not getattr(
+        connection, "replica_timer", None
+    ):
+        connection.replica_timer = replicas.timer(connection.alias)
+        connection.execute_wrappers.append(connection.replica_timer)
+
+
+def pin_key(user_id):
+    return f"shop:db:pinned:{user_id}"
+
+
+def get_pin_cache():
+    return caches[get_options().get("CACHE_ALIAS", "default")]
+
+
+def pin_to_primary(user_id):
+    get_pin_cache().set(pin_key(user_id), 1, get_options().get("PIN_SECONDS", 5))
+
+
+def is_pinned(user_id):
+    return bool(get_pin_cache().get(pin_key(user_id)))
+
+
+async def ais_pinned(user_id):
+    return bool(await get_pin_cache().aget(pin_key(user_id)))
+
+
+def read_from_replica(request):
+    """Send the rest of this request's reads to a replica, if the user may."""
+    state = _routing.get()
+    if state is None or not replicas.aliases:
+        return
+    user = request.user
+    if user is not None and user.is_authenticated and is_pinned(user.pk):
+        return
+    state.replica = True
+
+
+async def aread_from_replica(request):
+    """``read_from_replica`` for async views, without blocking the event loop."""
+    state = _routing.get()
+    if state is None or not replicas.aliases:
+        return
+    user = request.user
+    if user is not None and user.is_authenticated and await ais_pinned(user.pk):
+        return
+    state.replica = True
+
+
+@contextmanager
+def primary_reads():
+    """
+    Run the enclosed reads on ``default`` even in a replica request: results
+    shared with other users, like catalog cache entries, must not carry a
+    lagging replica's rows.
+    """
+    state = _routing.get()
+    replica = state is not None and state.replica
+    if replica:
+        state.replica = False
+    try:
+        yield
+    finally:
+        if replica:
+            state.replica = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or not state.replica or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if state.alias is None:
+            # One replica per request, so its queries see one snapshot.
+            state.alias = replicas.choose()
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """
+    Tracks each request's writes for ``ReplicaRouter`` and pins the user to
+    the primary after one. Not installed when there are no replicas.
+
+    Runs natively under ASGI as well, so it never makes Django move async
+    views onto a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas.aliases:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routing() as state:
+            response = self.get_response(request)
+        if state.wrote:
+            self.pin_writer(request)
+        return response
+
+    async def __acall__(self, request):
+        # Sync views run in a copy of this context, so they share ``state``.
+        with routing() as state:
+            response = await self.get_response(request)
+        if state.wrote:
+            await sync_to_async(self.pin_writer)(request)
+        return response
+
+    @staticmethod
+    def pin_writer(request):
+        # DRF copies the user it authenticated onto the Django request.
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
+
+
+def replica_latency_collector():
+    name = "shop_db_replica_latency_seconds"
+    lines = [
+        f"# HELP {name} Moving average of query time per replica",
+        f"# TYPE {name} gauge",
+    ]
+    for alias, seconds in sorted(replicas.latency.items()):
+        lines.append(f'{name}{{alias="{alias}"}} {seconds:.6f}')
+    return lines
+
+
+registry.collectors.append(replica_latency_collector)
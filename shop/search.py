@@ -0,0 +1,186 @@
+from asgiref.sync import sync_to_async
+from django.db import OperationalError, connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+FTS_TABLE = "shop_product_fts"
+PG_INDEX = "shop_product_search_idx"
+PG_CONFIG = "english"
+
+SQLITE_FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='shop_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shop_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shop_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF name, description ON shop_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+def product_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector("name", weight="A", config=PG_CONFIG) + SearchVector(
+        "description", weight="B", config=PG_CONFIG
+    )
+
+
+def install_search_index(connection, model, schema_editor=None, rebuild=False):
+    """
+    Create the full-text index for ``model`` (the Product table) on
+    ``connection``. Safe to call repeatedly: SQLite drops triggers whenever a
+    migration rebuilds the table, so this also runs after every migrate.
+    """
+    if connection.vendor == "sqlite":
+        try:
+            with connection.cursor() as cursor:
+                for statement in SQLITE_FTS_SQL:
+                    cursor.execute(statement)
+                if rebuild:
+                    cursor.execute(
+                        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+                    )
+        except OperationalError:
+            pass  # SQLite built without FTS5; searches fall back to LIKE
+    elif connection.vendor == "postgresql" and schema_editor is not None:
+        from django.contrib.postgres.indexes import GinIndex
+
+        schema_editor.add_index(
+            model, GinIndex(product_search_vector(), name=PG_INDEX)
+        )
+
+
+def uninstall_search_index(connection, model, schema_editor=None):
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == "postgresql" and schema_editor is not None:
+        from django.contrib.postgres.indexes import GinIndex
+
+        schema_editor.remove_index(
+            model, GinIndex(product_search_vector(), name=PG_INDEX)
+        )
+
+
+class LikeSearchBackend:
+    """
+    ``icontains`` over name and description; the fallback for databases
+    without a full-text index.
+    """
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(description__icontains=term)
+            )
+        return queryset
+
+
+class SQLiteSearchBackend:
+    """
+    FTS5 ``MATCH`` joined back to the product table, ranked by BM25 with
+    name matches weighted above description matches.
+    """
+
+    rank_sql = f'-bm25("{FTS_TABLE}", 10.0, 1.0)'
+
+    @staticmethod
+    def build_query(terms):
+        # Quote every term so user input is never parsed as FTS5 syntax, and
+        # prefix-match it so partial words still find products.
+        return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    def search(self, queryset, terms):
+        match = RawSQL(
+            f'"{FTS_TABLE}" MATCH %s',
+            (self.build_query(terms),),
+            output_field=BooleanField(),
+        )
+        return (
+            queryset.filter(search_index__isnull=False)
+            .filter(match)
+            .annotate(search_rank=RawSQL(self.rank_sql, (), output_field=FloatField()))
+            .order_by("-search_rank", "-id")
+        )
+
+
+class PostgresSearchBackend:
+    """
+    ``tsvector @@ websearch_to_tsquery`` served by the GIN expression index,
+    ranked with ``ts_rank``.
+    """
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        vector = product_search_vector()
+        query = SearchQuery(" ".join(terms), config=PG_CONFIG, search_type="websearch")
+        return (
+            queryset.annotate(search_vector=vector)
+            .filter(search_vector=query)
+            .annotate(search_rank=SearchRank(vector, query))
+            .order_by("-search_rank", "-id")
+        )
+
+
+_sqlite_fts_available = {}
+
+
+def get_search_backend(alias="default"):
+    connection = connections[alias]
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    if connection.vendor == "sqlite":
+        if alias not in _sqlite_fts_available:
+            tables = connection.introspection.table_names()
+            _sqlite_fts_available[alias] = FTS_TABLE in tables
+        if _sqlite_fts_available[alias]:
+            return SQLiteSearchBackend()
+    return LikeSearchBackend()
+
+
+async def aprepare_search_backend(alias="default"):
+    """
+    Run the one-off FTS table check off the event loop so async views can
+    call ``get_search_backend`` without touching the database.
+    """
+    if alias not in _sqlite_fts_available:
+        await sync_to_async(get_search_backend)(alias)
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    ``?search=`` for products, answered by the database's full-text index
+    and ordered by relevance.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_search_backend(queryset.db).search(queryset, terms)
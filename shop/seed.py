@@ -0,0 +1,99 @@
+import random
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .cache import catalog_cache
+from .models import Order, OrderItem, Product
+
+WORDS = (
+    "acoustic adjustable aluminium ambient backpack bamboo blender bottle "
+    "cable canvas ceramic chair charger classic compact cordless cotton "
+    "desk digital durable ergonomic espresso folding glass headphones "
+    "heated kettle keyboard lamp leather lightweight linen marble mirror "
+    "modular monitor mug organic outdoor pillow portable premium rechargeable "
+    "recycled rug shelf silicone sleeve smart speaker stainless standing "
+    "steel storage table thermal travel vintage wall waterproof wireless wooden"
+).split()
+
+SYLLABLES = "ba ko ri mu ze ta lo vi na pe su gra tor lin dex mo".split()
+
+
+def rare_words(count=20000, seed=0):
+    # Pseudo-words (model names, materials, brands) that each appear in only
+    # a handful of products, like most real search terms.
+    rng = random.Random(seed)
+    return ["".join(rng.choice(SYLLABLES) for _ in range(4)) for _ in range(count)]
+
+
+def random_text(rng, words, vocabulary=WORDS):
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def seed_products(count, batch_size=5000, seed=0):
+    """
+    Bulk insert ``count`` products with random names and descriptions drawn
+    from a small vocabulary, for benchmarks and query-plan checks.
+    """
+    rng = random.Random(seed)
+    rare = rare_words(seed=seed)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        Product.objects.bulk_create(
+            Product(
+                name=random_text(rng, 3).title(),
+                description=f"{random_text(rng, 20)} {random_text(rng, 5, rare)}",
+                price=Decimal(rng.randrange(100, 100000)) / 100,
+                stock=rng.randrange(0, 500),
+            )
+            for _ in range(size)
+        )
+        created += size
+    catalog_cache.invalidate()
+    return created
+
+
+def seed_orders(users, count, items_per_order=3, batch_size=2000, seed=0):
+    """
+    Bulk insert ``count`` orders spread over ``users``, each with
+    ``items_per_order`` items for random existing products, with their totals
+    filled in.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    prices = dict(Product.objects.values_list("id", "price"))
+    product_ids = list(prices)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        baskets = [
+            [
+                (product_id, rng.randrange(1, 5))
+                for product_id in rng.sample(product_ids, items_per_order)
+            ]
+            for _ in range(size)
+        ]
+        statuses = [rng.choice(["Pending", "Completed"]) for _ in range(size)]
+        orders = Order.objects.bulk_create(
+            Order(
+                user=rng.choice(users),
+                status=status,
+                completed_at=now if status == "Completed" else None,
+                total_amount=sum(prices[pk] * quantity for pk, quantity in basket),
+                item_count=sum(quantity for _, quantity in basket),
+            )
+            for basket, status in zip(baskets, statuses)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=prices[product_id],
+            )
+            for order, basket in zip(orders, baskets)
+            for product_id, quantity in basket
+        )
+        created += size
+    return created
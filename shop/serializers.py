@@ -1,19 +1,210 @@
-from rest_framework import serializers
-from .models import Product, Order, OrderItem
+from collections import defaultdict
+from datetime import datetime
+from functools import cached_property
 
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from rest_framework.settings import api_settings
+from .instrumentation import (
+    TimedListSerializer,
+    TimedSerializerMixin,
+    timed_serialization,
+)
+from .models import DailySales, Product, Order, OrderItem
+from .services import place_order, update_order_statuses
+
+
+class SparseFieldsMixin:
+    """
+    ``fields=[...]`` keeps only the named fields; the views fill it in from
+    ``?fields=`` / ``?omit=``.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def get_converter(field):
+    """How ``field`` turns a ``values()`` cell into output; None for as-is."""
+    if type(field) in (
+        serializers.IntegerField,
+        serializers.CharField,
+        serializers.BooleanField,
+    ):
+        return None
+    if type(field) is serializers.DateTimeField:
+        return get_datetime_converter(field)
+    return field.to_representation
+
+
+def get_datetime_converter(field):
+    # DateTimeField.to_representation looks the current timezone up for every
+    # value; resolve it once per serializer instead. Anything but aware
+    # datetimes rendered as ISO 8601 goes through the field itself.
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    zone = getattr(field, "timezone", None) or field.default_timezone()
+    if zone is None or not output_format or output_format.lower() != ISO_8601:
+        return field.to_representation
+
+    def convert(value):
+        if not isinstance(value, datetime) or timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(zone).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return convert
+
+
+class ValuesSerializerMixin:
+    """
+    A read-only path producing the same output as ``many=True`` ``.data``
+    from ``queryset.values()`` rows: each field's conversion is looked up
+    once per page rather than walked per row and attribute.
+
+    ``values_lookups`` maps fields whose source is not a column (method
+    fields) to the ``values()`` lookup that holds their value. Serializers
+    with other non-column fields have no ``values_plan`` and must use
+    ``.data``.
+    """
+
+    values_lookups = {}
+
+    @cached_property
+    def values_plan(self):
+        plan = []
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                if getattr(field.child, "values_plan", None) is None:
+                    return None
+                plan.append((name, None, field))
+            elif name in self.values_lookups:
+                # A method field's lookup already holds its final value.
+                convert = None
+                if not isinstance(field, serializers.SerializerMethodField):
+                    convert = get_converter(field)
+                plan.append((name, self.values_lookups[name], convert))
+            elif isinstance(field, serializers.SerializerMethodField):
+                return None
+            elif field.source == "*" or "." in field.source:
+                return None
+            else:
+                plan.append((name, field.source, get_converter(field)))
+        return plan
+
+    def get_values_lookups(self):
+        lookups = {self.Meta.model._meta.pk.attname}
+        lookups.update(lookup for _, lookup, _ in self.values_plan if lookup)
+        return sorted(lookups)
+
+    def get_related_values(self, field, keys):
+        """The nested rows of ``field`` for each parent key, in pk order."""
+        relation = self.Meta.model._meta.get_field(field.source)
+        remote = relation.field.attname
+        child = field.child
+        lookups = child.get_values_lookups()
+        if remote not in lookups:
+            lookups.append(remote)
+        rows = list(
+            relation.related_model._default_manager.filter(
+                **{f"{relation.field.name}__in": keys}
+            )
+            .order_by("pk")
+            .values(*lookups)
+        )
+        grouped = defaultdict(list)
+        for row, item in zip(rows, child.represent_values(rows)):
+            grouped[row[remote]].append(item)
+        return grouped
+
+    def represent_values(self, rows):
+        with timed_serialization():
+            pk = self.Meta.model._meta.pk.attname
+            keys = [row[pk] for row in rows]
+            related = {
+                name: self.get_related_values(field, keys)
+                for name, lookup, field in self.values_plan
+                if lookup is None and keys
+            }
+            results = []
+            for row in rows:
+                item = {}
+                for name, lookup, convert in self.values_plan:
+                    if lookup is None:
+                        item[name] = related[name].get(row[pk], [])
+                        continue
+                    value = row[lookup]
+                    if value is not None and convert is not None:
+                        value = convert(value)
+                    item[name] = value
+                results.append(item)
+            return results
+
+
+def media_url(name):
+    return default_storage.url(name) if name else None
+
+
+class MediaURLField(serializers.Field):
+    """
+    The URL of a stored file, read-only. Takes the model's ``FieldFile`` or,
+    on the ``values()`` path, the bare name.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return media_url(getattr(value, "name", value))
+
+
+class RenditionURLsField(MediaURLField):
+    def to_representation(self, value):
+        return {name: media_url(path) for name, path in value.items()}
+
+
+class ProductSerializer(
+    SparseFieldsMixin,
+    ValuesSerializerMixin,
+    TimedSerializerMixin,
+    serializers.ModelSerializer,
+):
+    # Uploaded through products/<pk>/image; see shop/images.py.
+    image = MediaURLField()
+    image_renditions = RenditionURLsField()
 
-class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
+        list_serializer_class = TimedListSerializer
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
     product_name = serializers.SerializerMethodField()
+    product_id = serializers.IntegerField()
+    order_id = serializers.IntegerField(read_only=True)
+    values_lookups = {"product_name": "product__name"}
 
     class Meta:
         model = OrderItem
-        fields = ["id", "product_name", "quantity", "order_id", "product_id"]
+        fields = [
+            "id",
+            "product_name",
+            "quantity",
+            "unit_price",
+            "order_id",
+            "product_id",
+        ]
+        extra_kwargs = {"quantity": {"min_value": 1}, "unit_price": {"read_only": True}}
 
     def get_product_name(self, obj):
         return obj.product.name
@@ -25,14 +216,71 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.order.id
 
 
-class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True, read_only=True)
+class OrderSerializer(
+    SparseFieldsMixin,
+    ValuesSerializerMixin,
+    TimedSerializerMixin,
+    serializers.ModelSerializer,
+):
+    items = OrderItemSerializer(many=True, required=False)
 
     class Meta:
         model = Order
-        fields = ["id", "status", "created_at", "updated_at", "items"]
+        fields = [
+            "id",
+            "status",
+            "total_amount",
+            "item_count",
+            "created_at",
+            "updated_at",
+            "completed_at",
+            "items",
+        ]
+        read_only_fields = ["total_amount", "item_count", "completed_at"]
+        list_serializer_class = TimedListSerializer
 
     def create(self, validated_data):
         user = self.context["request"].user
-        validated_data["user"] = user
-        return super().create(validated_data)
+        items = validated_data.pop("items", [])
+        return place_order(user, items, **validated_data)
+
+    def update(self, instance, validated_data):
+        if "items" in validated_data:
+            raise serializers.ValidationError(
+                {"items": "Items cannot be changed after checkout."}
+            )
+        if "status" in validated_data:
+            # Through the service, which keeps or releases the reserved stock.
+            instance.status = validated_data["status"]
+            return update_order_statuses([instance])[0]
+        return super().update(instance, validated_data)
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ["date", "orders", "items", "revenue"]
+
+
+class TopProductSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source="product_id")
+    name = serializers.CharField(source="product__name")
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class LoginSerializer(AuthTokenSerializer):
+    """
+    Logs in through ``authenticate()``, so AUTHENTICATION_BACKENDS (by default
+    shop.passwords.HashingPoolBackend) and ``user_login_failed`` apply.
+    """
+
+
+class ProductImageSerializer(serializers.Serializer):
+    # Checked against Pillow by shop.images.read_upload.
+    image = serializers.FileField()
+
+
+class CartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=10000)
@@ -0,0 +1,273 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import catalog_cache
+from .jobs import ORDER_COMPLETED
+from .models import Order, OrderItem, Product, StockReservation
+from .outbox import enqueue
+
+
+def reservation_ttl():
+    """How long a Pending order holds its stock before it is cancelled."""
+    return timedelta(
+        seconds=getattr(settings, "SHOP_RESERVATIONS", {}).get("TTL", 15 * 60)
+    )
+
+
+def place_order(user, items, **fields):
+    """
+    Create an order for ``user`` from ``[{"product_id": ..., "quantity": ...}]``
+    and take the quantities out of stock, all or nothing.
+
+    Stock is decremented with one conditional ``UPDATE ... WHERE stock >= n``
+    per product, in primary key order, so concurrent checkouts serialize on
+    the product rows without deadlocking and stock can never go negative.
+    A Pending order records what it took as reservations, which go back into
+    stock if the order is not completed within ``reservation_ttl()``.
+    """
+    if fields.get("status") == "Cancelled":
+        raise ValidationError({"status": "An order cannot be placed cancelled."})
+    quantities = Counter()
+    for item in items:
+        quantities[item["product_id"]] += item["quantity"]
+
+    # Checked before the transaction opens so SQLite never holds a read lock
+    # while it waits for the write lock.
+    prices = dict(Product.objects.filter(pk__in=quantities).values_list("pk", "price"))
+    missing = sorted(set(quantities) - set(prices))
+    if missing:
+        raise ValidationError(
+            {"items": [f"Product {pk} does not exist." for pk in missing]}
+        )
+
+    with transaction.atomic():
+        now = timezone.now()
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            updated = Product.objects.filter(
+                pk=product_id, stock__gte=quantity
+            ).update(stock=F("stock") - quantity, updated_at=now)
+            if not updated:
+                raise ValidationError(
+                    {"items": [f"Insufficient stock for product {product_id}."]}
+                )
+
+        # bulk_create skips the item signals, so the totals are set up front.
+        order = Order.objects.create(
+            user=user,
+            total_amount=sum(
+                prices[product_id] * quantity
+                for product_id, quantity in quantities.items()
+            ),
+            item_count=sum(quantities.values()),
+            **fields,
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=prices[product_id],
+            )
+            for product_id, quantity in quantities.items()
+        )
+        if order.status == "Pending":
+            expires_at = now + reservation_ttl()
+            StockReservation.objects.bulk_create(
+                StockReservation(
+                    order=order,
+                    product_id=product_id,
+                    quantity=quantity,
+                    expires_at=expires_at,
+                )
+                for product_id, quantity in quantities.items()
+            )
+        elif order.status == "Completed":
+            order_completed([order.pk])
+        if quantities:
+            catalog_cache.invalidate()
+
+    return Order.objects.with_items().get(pk=order.pk)
+
+
+def order_completed(order_ids):
+    """Queue the shop/jobs.py work that follows orders being completed."""
+    for name in ORDER_COMPLETED:
+        enqueue(name, [{"order_id": pk} for pk in order_ids])
+
+
+def release_stock(order_ids, now=None):
+    """
+    Put the stock reserved by ``order_ids`` back and drop the reservations.
+    Call inside a transaction. Returns the number of units restocked.
+    """
+    now = now or timezone.now()
+    reserved = dict(
+        StockReservation.objects.filter(order__in=order_ids)
+        .values("product_id")
+        .annotate(total=Sum("quantity"))
+        .order_by()
+        .values_list("product_id", "total")
+    )
+    # Primary key order, like place_order, so the two never deadlock.
+    for product_id in sorted(reserved):
+        Product.objects.filter(pk=product_id).update(
+            stock=F("stock") + reserved[product_id], updated_at=now
+        )
+    StockReservation.objects.filter(order__in=order_ids).delete()
+    if reserved:
+        catalog_cache.invalidate()
+    return sum(reserved.values())
+
+
+def delete_orders(order_ids):
+    """
+    Delete ``order_ids``, putting back the stock they still reserve. A
+    completed order's stock was sold and stays out.
+    """
+    with transaction.atomic():
+        # Locked so the reservation sweeper cannot cancel them meanwhile.
+        statuses = dict(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids)
+            .values_list("pk", "status")
+        )
+        release_stock([pk for pk, status in statuses.items() if status != "Completed"])
+        Order.objects.filter(pk__in=statuses).delete()
+
+
+def update_order_statuses(orders):
+    """
+    Persist the ``status`` already set on each order in ``orders`` with one
+    bulk UPDATE. Completing an order keeps the stock it reserved; cancelling
+    it puts the stock back. Only Pending orders can change.
+    """
+    now = timezone.now()
+    for order in orders:
+        order.updated_at = now
+        if order.status == "Completed" and order.completed_at is None:
+            order.completed_at = now
+    order_ids = [order.pk for order in orders]
+    with transaction.atomic():
+        # Locked so the reservation sweeper cannot cancel them meanwhile.
+        pending = set(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids, status="Pending")
+            .values_list("pk", flat=True)
+        )
+        if pending != set(order_ids):
+            raise ValidationError("Only pending orders can be updated.")
+        Order.objects.bulk_update(orders, ["status", "updated_at", "completed_at"])
+        completed = [order.pk for order in orders if order.status == "Completed"]
+        cancelled = [order.pk for order in orders if order.status == "Cancelled"]
+        if completed:
+            StockReservation.objects.filter(order__in=completed).delete()
+            order_completed(completed)
+        if cancelled:
+            release_stock(cancelled, now)
+    return orders
+
+
+def expire_reservations(batch_size=500):
+    """
+    Cancel the Pending orders whose reservations have expired and put their
+    stock back, ``batch_size`` reservations per transaction, oldest first.
+    Returns the number of orders cancelled.
+    """
+    cancelled = 0
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            order_ids = set(
+                StockReservation.objects.filter(expires_at__lte=now)
+                .order_by("expires_at", "pk")
+                .values_list("order_id", flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return cancelled
+            statuses = dict(
+                Order.objects.select_for_update()
+                .filter(pk__in=order_ids)
+                .values_list("pk", "status")
+            )
+            expired = [pk for pk, status in statuses.items() if status == "Pending"]
+            Order.objects.filter(pk__in=expired).update(
+                status="Cancelled", updated_at=now
+            )
+            # Reservations left over from orders that changed status some
+            # other way: a cancelled order's stock goes back, a completed
+            # order's stock was sold.
+            release_stock(
+                [pk for pk, status in statuses.items() if status != "Completed"], now
+            )
+            StockReservation.objects.filter(order__in=order_ids).delete()
+        cancelled += len(expired)
+
+
+def order_totals():
+    """
+    ``(total_amount, item_count)`` subquery expressions that aggregate an
+    order's items, for ``Order`` querysets.
+    """
+    items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+    subtotal = ExpressionWrapper(
+        F("quantity") * F("unit_price"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    total_amount = Coalesce(
+        Subquery(items.annotate(total=Sum(subtotal)).values("total")),
+        0,
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    item_count = Coalesce(
+        Subquery(items.annotate(count=Sum("quantity")).values("count")), 0
+    )
+    return total_amount, item_count
+
+
+def refresh_order_totals(order_ids):
+    """Recompute the totals of the given orders from their items."""
+    total_amount, item_count = order_totals()
+    return Order.objects.filter(pk__in=order_ids).update(
+        total_amount=total_amount, item_count=item_count, updated_at=timezone.now()
+    )
+
+
+def reconcile_order_totals(batch_size=1000):
+    """
+    Compare every order's stored totals against its items, a batch at a time,
+    and rewrite the ones that drifted (after raw SQL or bulk item writes).
+    Returns the number of orders fixed.
+    """
+    total_amount, item_count = order_totals()
+    queryset = Order.objects.order_by("pk").annotate(
+        expected_total=total_amount, expected_count=item_count
+    )
+    fixed, last_pk = 0, 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).values(
+                "pk", "total_amount", "item_count", "expected_total", "expected_count"
+            )[:batch_size]
+        )
+        if not rows:
+            return fixed
+        last_pk = rows[-1]["pk"]
+        # Compared in Python: SQLite sums decimals as floats, which only
+        # compare equal to the stored amounts once converted to Decimal.
+        drifted = [
+            row["pk"]
+            for row in rows
+            if row["total_amount"] != row["expected_total"]
+            or row["item_count"] != row["expected_count"]
+        ]
+        if drifted:
+            with transaction.atomic():
+                fixed += refresh_order_totals(drifted)
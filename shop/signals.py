@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .cache import catalog_cache
+from .models import Order, OrderItem, Product
+from .search import FTS_TABLE, install_search_index
+from .services import refresh_order_totals
+
+COUNTED_FIELDS = ("order_id", "quantity", "unit_price")
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    catalog_cache.invalidate()
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    # Covers password changes, deactivation and permission changes.
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(pre_save, sender=Order)
+def stamp_completed_at(sender, instance, raw=False, **kwargs):
+    if not raw and instance.status == "Completed" and instance.completed_at is None:
+        instance.completed_at = timezone.now()
+
+
+def adjust_order_totals(order_id, quantity, unit_price, sign=1):
+    # A freshly created item may still hold the price as a string.
+    amount = sign * quantity * Decimal(unit_price)
+    Order.objects.filter(pk=order_id).update(
+        total_amount=F("total_amount") + amount,
+        item_count=F("item_count") + sign * quantity,
+        updated_at=timezone.now(),
+    )
+
+
+def get_counted(instance):
+    """The item's values the order totals include, or None if not all known."""
+    counted = getattr(instance, "_counted", {})
+    if all(field in counted for field in COUNTED_FIELDS):
+        return counted
+    return None
+
+
+@receiver(post_save, sender=OrderItem)
+def count_order_item(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    counted = get_counted(instance)
+    if created:
+        adjust_order_totals(instance.order_id, instance.quantity, instance.unit_price)
+    elif counted is None:
+        # Loaded with deferred fields, so the previous values are unknown.
+        refresh_order_totals({instance.order_id})
+    else:
+        adjust_order_totals(
+            counted["order_id"], counted["quantity"], counted["unit_price"], -1
+        )
+        adjust_order_totals(instance.order_id, instance.quantity, instance.unit_price)
+    instance._counted = {field: getattr(instance, field) for field in COUNTED_FIELDS}
+
+
+@receiver(post_delete, sender=OrderItem)
+def uncount_order_item(sender, instance, origin=None, **kwargs):
+    # Items deleted along with their order leave nothing to update.
+    if isinstance(origin, Order) or (
+        isinstance(origin, QuerySet) and origin.model is Order
+    ):
+        return
+    counted = get_counted(instance)
+    if counted is None:
+        refresh_order_totals({instance.order_id})
+    else:
+        adjust_order_totals(
+            counted["order_id"], counted["quantity"], counted["unit_price"], -1
+        )
+
+
+def ensure_search_index(sender, using="default", **kwargs):
+    # Table rebuilds during later migrations drop the SQLite sync triggers.
+    connection = connections[using]
+    if FTS_TABLE in connection.introspection.table_names():
+        install_search_index(connection, Product)
@@ -1,14 +1,91 @@
-from django.test import TestCase
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.conf import settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
 from django.contrib.auth.hashers import make_password
 
+from PIL import Image
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
-from .models import Product, Order, OrderItem
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from . import urls, views
+from .analytics import update_sales_rollups
+from .authentication import token_cache
+from .throttling import SlidingWindowThrottle, local_counter
+from .passwords import HashingPool, verify
+from . import passwords
+from .instrumentation import PerformanceMiddleware, registry
+from . import outbox
+from .images import generate_renditions, image_pool
+from .outbox import OutboxWorker, claim_jobs, enqueue, finish_jobs, run_job
+from .cache import catalog_cache
+from . import cart
+from .cart import cart_store
+from .models import (
+    DailySales,
+    OutboxJob,
+    Product,
+    Order,
+    OrderItem,
+    StockReservation,
+)
+from .routers import (
+    ReplicaMiddleware,
+    ReplicaRouter,
+    is_pinned,
+    pin_to_primary,
+    replicas,
+    routing,
+)
+from .query_audit import analyze_tables, audit_query_plans, find_full_scans
+from .search import SQLiteSearchBackend, get_search_backend
+from .management.commands.benchmark_endpoints import percentile, scenarios
+from .management.commands.sync_replica import copy_sqlite
+from .seed import seed_orders, seed_products
+from .services import (
+    expire_reservations,
+    place_order,
+    reconcile_order_totals,
+    update_order_statuses,
+)
 
 
 class TestRegisterAPIs(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()  # throttle counters
+
     def test_register(self) -> None:
         url = reverse("register-user")
         data = {
@@ -89,6 +166,7 @@ class TestRegisterAPIs(APITestCase):
 
 class TestLoginAPIs(APITestCase):
     def setUp(self) -> None:
+        cache.clear()  # throttle counters
         self.data = {
             "username": "omar",
             "password": "testing12345",
@@ -136,6 +214,289 @@ class TestLoginAPIs(APITestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class TestPasswordHashing(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()  # throttle counters
+        self.user = User.objects.create_user(username="omar", password="secret123")
+        self.login_url = reverse("login")
+
+    def test_register_hashes_on_the_pool(self):
+        threads = []
+        make_password = passwords.make_password
+
+        def record(password):
+            threads.append(threading.current_thread().name)
+            return make_password(password)
+
+        data = {"username": "new", "password": "secret123", "email": "a@b.cd"}
+        with mock.patch("shop.passwords.make_password", record):
+            response = self.client.post(reverse("register-user"), data)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("password-hashing"))
+        self.assertTrue(User.objects.get(username="new").check_password("secret123"))
+
+    def test_login_rehashes_outdated_passwords(self):
+        self.user.password = make_password("secret123", hasher="pbkdf2_sha1")
+        self.user.save()
+        data = {"username": "omar", "password": "secret123"}
+        response = self.client.post(self.login_url, data)
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(self.user.check_password("secret123"))
+
+    def test_current_hashes_are_left_alone(self):
+        before = self.user.password
+        self.client.post(self.login_url, {"username": "omar", "password": "secret123"})
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, before)
+
+    def test_rejected_logins(self):
+        User.objects.create_user(username="gone", password="secret123", is_active=False)
+        for data in [
+            {"username": "omar", "password": "wrong"},
+            {"username": "gone", "password": "secret123"},
+            {"username": "nobody", "password": "secret123"},
+        ]:
+            response = self.client.post(self.login_url, data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.data["non_field_errors"],
+                ["Unable to log in with provided credentials."],
+            )
+
+    def test_login_checks_the_password_on_the_pool(self):
+        threads = []
+
+        def record(password, encoded):
+            threads.append(threading.current_thread().name)
+            return verify(password, encoded)
+
+        with mock.patch("shop.passwords.verify", record):
+            response = self.client.post(
+                self.login_url, {"username": "omar", "password": "secret123"}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("password-hashing"))
+
+    def test_failed_logins_send_the_signal(self):
+        failures = []
+
+        def receiver(sender, credentials, request, **kwargs):
+            failures.append(credentials["username"])
+
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+        self.client.post(self.login_url, {"username": "omar", "password": "wrong"})
+
+        self.assertEqual(failures, ["omar"])
+
+    @override_settings(
+        AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.RemoteUserBackend"]
+    )
+    def test_login_uses_the_configured_backends(self):
+        response = self.client.post(
+            self.login_url, {"username": "omar", "password": "secret123"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_user_still_hashes(self):
+        with mock.patch("shop.passwords.make_password") as make_password:
+            self.assertEqual(verify("secret123", None), (False, None))
+        make_password.assert_called_once_with("secret123")
+
+    def test_full_pool_turns_requests_away(self):
+        with override_settings(SHOP_PASSWORD_HASHING={"MAX_PENDING": 0}), (
+            mock.patch("shop.passwords.hashing_pool", HashingPool())
+        ):
+            data = {"username": "omar", "password": "secret123"}
+            response = self.client.post(self.login_url, data)
+
+        self.assertEqual(response.status_code, 503)
+
+    async def test_async_register_and_login(self):
+        data = {"username": "async", "password": "secret123", "email": "a@b.cd"}
+        response = await self.async_client.post(
+            reverse("async-register-user"), data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        url = reverse("async-login")
+        credentials = {"username": "async", "password": "secret123"}
+        response = await self.async_client.post(
+            url, credentials, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.aget(username="async")
+        token = await Token.objects.aget(user=user)
+        self.assertEqual(response.json(), {"token": token.key})
+
+        response = await self.async_client.post(
+            url, {"username": "async"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", response.json())
+
+        response = await self.async_client.post(
+            url, credentials | {"password": "wrong"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_async_login_rehashes(self):
+        self.user.password = make_password("secret123", hasher="pbkdf2_sha1")
+        await self.user.asave()
+        response = await self.async_client.post(
+            reverse("async-login"),
+            {"username": "omar", "password": "secret123"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        await self.user.arefresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$"))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_password_hashing",
+            "--hasher=scrypt",
+            "--logins=2",
+            "--concurrency=2",
+            stdout=out,
+        )
+        self.assertIn("scrypt  inline", out.getvalue())
+
+
+def throttle_rates(**rates):
+    return override_settings(
+        REST_FRAMEWORK=settings.REST_FRAMEWORK | {"DEFAULT_THROTTLE_RATES": rates}
+    )
+
+
+class TestThrottling(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        local_counter.clear()
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+
+    def register(self, n, **extra):
+        data = {"username": f"user{n}", "password": "secret", "email": "a@b.cd"}
+        return self.client.post(reverse("register-user"), data, **extra)
+
+    def login(self, username, **extra):
+        data = {"username": username, "password": "wrong"}
+        return self.client.post(reverse("login"), data, **extra)
+
+    @throttle_rates(register="2/hour")
+    def test_register_is_limited_per_ip(self):
+        self.assertEqual(self.register(1).status_code, 201)
+        self.assertEqual(self.register(2).status_code, 201)
+        response = self.register(3)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertFalse(User.objects.filter(username="user3").exists())
+
+        response = self.register(3, REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(response.status_code, 201)
+
+    @throttle_rates(login="100/min", login_username="3/min")
+    def test_login_is_limited_per_account_across_ips(self):
+        for n in range(3):
+            response = self.login("User", REMOTE_ADDR=f"10.0.0.{n}")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.login("user", REMOTE_ADDR="10.0.1.1").status_code, 429)
+        self.assertEqual(self.login("someone").status_code, 400)
+
+    @throttle_rates(products="2/min")
+    def test_product_list_is_limited_per_user(self):
+        other = User.objects.create_user(username="other", password="other")
+        other_token = Token.objects.create(user=other)
+        url = reverse("list-create-products")
+        for _ in range(2):
+            self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 429)
+        response = self.client.get(reverse("async-list-products"))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + other_token.key)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @throttle_rates()
+    def test_scopes_without_a_rate_are_unlimited(self):
+        for n in range(15):
+            self.assertEqual(self.register(n).status_code, 201)
+
+    @throttle_rates(products="10/min")
+    def test_previous_window_is_weighted(self):
+        request = self.get_request()
+        throttle = SlidingWindowThrottle()
+        view = views.ProductListCreateView()
+        with mock.patch.object(SlidingWindowThrottle, "timer", return_value=60.0):
+            results = [throttle.allow_request(request, view) for _ in range(10)]
+        self.assertTrue(all(results))
+
+        # Halfway through the next window half of the previous count remains.
+        with mock.patch.object(SlidingWindowThrottle, "timer", return_value=150.0):
+            results = [throttle.allow_request(request, view) for _ in range(6)]
+        self.assertEqual(results, [True] * 5 + [False])
+        self.assertAlmostEqual(throttle.wait(), 6.0)
+
+        with mock.patch.object(SlidingWindowThrottle, "timer", return_value=240.0):
+            self.assertTrue(throttle.allow_request(request, view))
+
+    @throttle_rates(products="3/min")
+    def test_in_process_counters(self):
+        request = self.get_request()
+        view = views.ProductListCreateView()
+        with override_settings(SHOP_THROTTLE={"ALIAS": None}):
+            results = [
+                SlidingWindowThrottle().allow_request(request, view) for _ in range(4)
+            ]
+        self.assertEqual(results, [True, True, True, False])
+
+    @throttle_rates(products="3/min")
+    def test_failing_cache_falls_back_to_in_process_counters(self):
+        request = self.get_request()
+        view = views.ProductListCreateView()
+        with mock.patch.object(cache, "incr", side_effect=ConnectionError), (
+            self.assertLogs("shop.throttling", "WARNING")
+        ):
+            results = [
+                SlidingWindowThrottle().allow_request(request, view) for _ in range(4)
+            ]
+        self.assertEqual(results, [True, True, True, False])
+
+    @throttle_rates(products="1000000/min")
+    def test_overhead_is_microseconds(self):
+        request = self.get_request()
+        view = views.ProductListCreateView()
+        throttle = SlidingWindowThrottle()
+        started = time.perf_counter()
+        for _ in range(2000):
+            throttle.allow_request(request, view)
+        per_request = (time.perf_counter() - started) / 2000
+        self.assertLess(per_request, 100e-6)
+
+    def get_request(self):
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, self.user)
+        request = views.ProductListCreateView().initialize_request(request)
+        request.user  # authenticate
+        return request
+
+
 class TestProductAPIs(APITestCase):
     def setUp(self) -> None:
         # admin user
@@ -223,3 +584,2416 @@ class TestProductAPIs(APITestCase):
 
         self.assertEqual(response.status_code, 403)
         self.assertEqual(Product.objects.count(), 1)
+
+
+class TestOrderListQueries(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse("list-create-orders")
+        self.products = [
+            Product.objects.create(
+                name=f"Product {i}", description="description", price="10.00", stock=100
+            )
+            for i in range(3)
+        ]
+
+    def create_orders(self, count, items_per_order):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user)
+            for product in self.products[:items_per_order]:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+
+    def count_list_queries(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        token_cache.clear()  # count the token lookup on every run
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_order_list_queries_do_not_grow(self):
+        self.create_orders(1, 1)
+        baseline, _ = self.count_list_queries()
+
+        self.create_orders(10, 3)
+        queries, _ = self.count_list_queries()
+
+        self.assertEqual(queries, baseline)
+        self.assertLessEqual(queries, 4)  # token, count, orders, items + products
+
+    def test_order_list_includes_product_names(self):
+        self.create_orders(1, 2)
+        _, response = self.count_list_queries()
+
+        items = response.data["results"][0]["items"]
+        names = [item["product_name"] for item in items]
+        self.assertEqual(names, ["Product 0", "Product 1"])
+
+
+class TestKeysetPagination(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.url = reverse("list-create-products")
+
+        Product.objects.bulk_create(
+            Product(name=f"Product {i}", description="d", price="1.00", stock=1)
+            for i in range(10)
+        )
+        # Force ties on created_at so the id tiebreaker is exercised. Queryset
+        # updates skip the catalog cache signals, so start from a clean cache.
+        cache.clear()
+        now = timezone.now()
+        for i, product in enumerate(Product.objects.order_by("id")):
+            Product.objects.filter(pk=product.pk).update(
+                created_at=now - timedelta(seconds=i // 4)
+            )
+        self.expected = list(
+            Product.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+
+    def walk(self, url):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            ids.extend(row["id"] for row in response.data["results"])
+            url = response.data["next"]
+        return ids, pages
+
+    def test_pages_cover_catalog_in_order(self):
+        ids, pages = self.walk(self.url)
+
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(pages[0]["count"], 10)
+        self.assertIsNone(pages[0]["previous"])
+
+    def test_previous_link_returns_previous_page(self):
+        _, pages = self.walk(self.url + "?page_size=4")
+        response = self.client.get(pages[2]["previous"])
+
+        self.assertEqual(response.data["results"], pages[1]["results"])
+        self.assertIsNotNone(response.data["previous"])
+        self.assertIsNotNone(response.data["next"])
+
+    def test_page_size_is_configurable_and_capped(self):
+        response = self.client.get(self.url, {"page_size": 7})
+        self.assertEqual(len(response.data["results"]), 7)
+
+        response = self.client.get(self.url, {"page_size": 1000})
+        self.assertEqual(len(response.data["results"]), 10)
+
+    def test_count_opt_out(self):
+        response = self.client.get(self.url, {"count": "false"})
+
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_orders_are_paginated(self):
+        for _ in range(12):
+            Order.objects.create(user=self.user)
+        ids, pages = self.walk(reverse("list-create-orders"))
+
+        self.assertEqual(len(pages), 2)
+        expected = Order.objects.order_by("-created_at", "-id")
+        self.assertEqual(ids, list(expected.values_list("id", flat=True)))
+
+
+class TestCatalogCache(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        catalog_cache.reset_stats()
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        self.product = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.list_url = reverse("list-create-products")
+        self.detail_url = reverse(
+            "update-delete-retrieve-products", args=[self.product.id]
+        )
+
+    def test_list_is_served_from_cache(self):
+        first = self.client.get(self.list_url, {"price__gte": "10"})
+        with self.assertNumQueries(0):  # token and response both cached
+            second = self.client.get(self.list_url, {"price__gte": "10.00"})
+
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(catalog_cache.stats()["hits"], 1)
+        self.assertEqual(catalog_cache.stats()["misses"], 1)
+
+    def test_distinct_queries_do_not_share_entries(self):
+        self.client.get(self.list_url, {"search": "lamp"})
+        response = self.client.get(self.list_url, {"search": "chair"})
+
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"], [])
+
+    def test_update_invalidates_list_and_detail(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+
+        self.client.patch(self.detail_url, {"price": "25.00"}, format="json")
+        listed = self.client.get(self.list_url)
+        detail = self.client.get(self.detail_url)
+
+        self.assertEqual(listed["X-Cache"], "MISS")
+        self.assertEqual(listed.data["results"][0]["price"], "25.00")
+        self.assertEqual(detail["X-Cache"], "MISS")
+        self.assertEqual(detail.data["price"], "25.00")
+
+    def test_delete_invalidates(self):
+        self.client.get(self.list_url)
+        Product.objects.filter(pk=self.product.pk).get().delete()
+
+        response = self.client.get(self.list_url)
+
+        self.assertEqual(response.data["results"], [])
+
+    def test_missing_product_is_not_cached(self):
+        url = reverse("update-delete-retrieve-products", args=[self.product.id + 1])
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(catalog_cache.stats()["hits"], 0)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": "/tmp/shop-test-catalog-cache",
+            }
+        }
+    )
+    def test_file_based_backend(self):
+        cache.clear()
+        self.client.get(self.list_url)
+        response = self.client.get(self.list_url)
+        self.product.save()
+        after_write = self.client.get(self.list_url)
+
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(after_write["X-Cache"], "MISS")
+        cache.clear()
+
+
+class TestCheckout(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.url = reverse("list-create-orders")
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.chair = Product.objects.create(
+            name="Chair", description="Office chair", price="90.00", stock=2
+        )
+
+    def test_checkout_creates_items_and_decrements_stock(self):
+        data = {
+            "items": [
+                {"product_id": self.lamp.id, "quantity": 2},
+                {"product_id": self.chair.id, "quantity": 1},
+                {"product_id": self.lamp.id, "quantity": 1},
+            ]
+        }
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["items"]), 2)
+        self.assertEqual(OrderItem.objects.get(product=self.lamp).quantity, 3)
+        self.lamp.refresh_from_db()
+        self.chair.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 2)
+        self.assertEqual(self.chair.stock, 1)
+
+    def test_insufficient_stock_rolls_back(self):
+        data = {
+            "items": [
+                {"product_id": self.lamp.id, "quantity": 1},
+                {"product_id": self.chair.id, "quantity": 3},
+            ]
+        }
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 5)
+
+    def test_unknown_product(self):
+        data = {"items": [{"product_id": self.chair.id + 100, "quantity": 1}]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_quantity_must_be_positive(self):
+        data = {"items": [{"product_id": self.lamp.id, "quantity": 0}]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_items_cannot_be_updated(self):
+        order = place_order(self.user, [{"product_id": self.lamp.id, "quantity": 1}])
+        url = reverse("update-delete-retrieve-orders", args=[order.id])
+        data = {"items": [{"product_id": self.lamp.id, "quantity": 5}]}
+        response = self.client.patch(url, data, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(order.items.get().quantity, 1)
+
+
+class TestStockReservations(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="user")
+        self.admin = User.objects.create_superuser(username="admin", password="admin")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.order = place_order(
+            self.user, [{"product_id": self.lamp.id, "quantity": 2}]
+        )
+        self.url = reverse("update-delete-retrieve-orders", args=[self.order.id])
+
+    def expire(self):
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def assertStock(self, stock):
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, stock)
+
+    def test_pending_order_reserves_stock(self):
+        reservation = StockReservation.objects.get()
+
+        self.assertEqual(reservation.order_id, self.order.id)
+        self.assertEqual(reservation.quantity, 2)
+        self.assertGreater(reservation.expires_at, timezone.now())
+        self.assertStock(3)
+
+    @override_settings(SHOP_RESERVATIONS={"TTL": 60})
+    def test_reservation_ttl_setting(self):
+        order = place_order(self.user, [{"product_id": self.lamp.id, "quantity": 1}])
+        reservation = StockReservation.objects.get(order=order)
+
+        self.assertLessEqual(
+            reservation.expires_at, timezone.now() + timedelta(seconds=60)
+        )
+
+    def test_completed_order_keeps_stock(self):
+        response = self.client.patch(self.url, {"status": "Completed"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertStock(3)
+
+        self.expire()
+        self.assertEqual(expire_reservations(), 0)
+        self.assertStock(3)
+
+    def test_expired_order_is_cancelled_and_restocked(self):
+        self.expire()
+
+        self.assertEqual(expire_reservations(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "Cancelled")
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertStock(5)
+
+    def test_unexpired_reservations_are_kept(self):
+        self.assertEqual(expire_reservations(), 0)
+        self.assertEqual(StockReservation.objects.count(), 1)
+        self.assertStock(3)
+
+    def test_sweep_in_batches(self):
+        for _ in range(2):
+            place_order(self.user, [{"product_id": self.lamp.id, "quantity": 1}])
+        self.expire()
+
+        self.assertEqual(expire_reservations(batch_size=1), 3)
+        self.assertStock(5)
+
+    def test_cancelled_order_cannot_be_completed(self):
+        self.expire()
+        expire_reservations()
+        response = self.client.patch(self.url, {"status": "Completed"}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "Cancelled")
+
+    def test_bulk_cancel_restocks(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.patch(
+            reverse("bulk-order-status"),
+            [{"id": self.order.id, "status": "Cancelled"}],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertStock(5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_deleting_pending_order_restocks(self):
+        response = self.client.delete(self.url)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertStock(5)
+
+    def test_sweeper_restocks_leftovers_of_cancelled_orders(self):
+        # Cancelled without going through the services.
+        Order.objects.filter(pk=self.order.pk).update(status="Cancelled")
+        self.expire()
+
+        self.assertEqual(expire_reservations(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertStock(5)
+
+    def change_in_admin(self, **data):
+        self.client.force_login(self.admin)
+        data = {"user": self.user.pk, "status": "Pending", **data}
+        return self.client.post(
+            reverse("admin:shop_order_change", args=[self.order.pk]), data
+        )
+
+    def test_admin_cancel_restocks(self):
+        response = self.change_in_admin(status="Cancelled")
+
+        self.assertEqual(response.status_code, 302)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "Cancelled")
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertStock(5)
+
+    def test_admin_cannot_reopen_a_cancelled_order(self):
+        self.change_in_admin(status="Cancelled")
+        response = self.change_in_admin(status="Pending")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Only pending orders can be updated.")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "Cancelled")
+        self.assertStock(5)
+
+    def test_admin_delete_restocks(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            reverse("admin:shop_order_delete", args=[self.order.pk]), {"post": "yes"}
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Order.objects.exists())
+        self.assertStock(5)
+
+    def test_admin_bulk_delete_restocks(self):
+        place_order(self.user, [{"product_id": self.lamp.id, "quantity": 1}])
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            reverse("admin:shop_order_changelist"),
+            {
+                "action": "delete_selected",
+                "_selected_action": list(Order.objects.values_list("pk", flat=True)),
+                "post": "yes",
+            },
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Order.objects.exists())
+        self.assertStock(5)
+
+    def test_order_cannot_be_placed_cancelled(self):
+        data = {
+            "status": "Cancelled",
+            "items": [{"product_id": self.lamp.id, "quantity": 1}],
+        }
+        response = self.client.post(
+            reverse("list-create-orders"), data, format="json"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertStock(3)
+
+    def test_sweep_command(self):
+        self.expire()
+        out = StringIO()
+        call_command("sweep_reservations", stdout=out)
+
+        self.assertIn("Cancelled 1 expired orders", out.getvalue())
+        self.assertStock(5)
+
+
+class TestOutbox(APITestCase):
+    def setUp(self) -> None:
+        outbox.stats.reset()
+        self.user = User.objects.create_user(
+            username="user", password="user", email="user@example.com"
+        )
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.order = place_order(
+            self.user, [{"product_id": self.lamp.id, "quantity": 2}]
+        )
+        outbox.tasks["test_task"] = lambda payload: None
+        self.addCleanup(outbox.tasks.pop, "test_task")
+
+    def run_claimed(self):
+        jobs = claim_jobs(10, lease=60)
+        if jobs:
+            finish_jobs(jobs, [run_job(job) for job in jobs])
+        return jobs
+
+    def test_completing_an_order_queues_its_jobs(self):
+        self.assertFalse(OutboxJob.objects.exists())
+        self.client.force_authenticate(self.user)
+        url = reverse("update-delete-retrieve-orders", args=[self.order.id])
+        response = self.client.patch(url, {"status": "Completed"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        job = OutboxJob.objects.get()
+        self.assertEqual(job.task, "send_order_confirmation")
+        self.assertEqual(job.payload, {"order_id": self.order.id})
+        self.assertEqual(len(mail.outbox), 0)  # not sent inline
+
+        self.run_claimed()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["user@example.com"])
+        self.assertFalse(OutboxJob.objects.exists())
+
+    def test_completing_in_the_admin_queues_its_jobs(self):
+        admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse("admin:shop_order_change", args=[self.order.id]),
+            {"user": self.user.pk, "status": "Completed"},
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.order.refresh_from_db()
+        self.assertIsNotNone(self.order.completed_at)
+        job = OutboxJob.objects.get()
+        self.assertEqual(job.task, "send_order_confirmation")
+        self.assertEqual(job.payload, {"order_id": self.order.id})
+
+    def test_admin_cannot_add_orders_or_edit_items(self):
+        admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(admin)
+        item = self.order.items.get()
+
+        response = self.client.get(reverse("admin:shop_order_add"))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            reverse("admin:shop_orderitem_change", args=[item.pk]),
+            {"order": self.order.pk, "product": self.lamp.pk, "quantity": 5},
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            reverse("admin:shop_orderitem_delete", args=[item.pk]), {"post": "yes"}
+        )
+        self.assertEqual(response.status_code, 403)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 2)
+
+    def test_failed_status_change_queues_nothing(self):
+        self.order.status = "Completed"
+        update_order_statuses([self.order])
+        self.order.status = "Cancelled"
+        with self.assertRaises(ValidationError):
+            update_order_statuses([self.order])
+
+        self.assertEqual(OutboxJob.objects.count(), 1)
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        enqueue("test_task", [{"n": 1}, {"n": 2}])
+
+        self.assertEqual(len(claim_jobs(1, lease=60)), 1)
+        self.assertEqual(len(claim_jobs(10, lease=60)), 1)
+        self.assertEqual(claim_jobs(10, lease=60), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        enqueue("test_task", [{"n": 1}])
+        first = claim_jobs(10, lease=60)
+        OutboxJob.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        second = claim_jobs(10, lease=60)
+
+        self.assertEqual([job.pk for job in second], [first[0].pk])
+        # The first worker finishing late leaves the job to the second.
+        finish_jobs(first, [None])
+        self.assertTrue(OutboxJob.objects.exists())
+
+    @override_settings(SHOP_OUTBOX={"MAX_ATTEMPTS": 2, "BACKOFF": 10})
+    def test_failures_back_off_then_give_up(self):
+        outbox.tasks["test_task"] = mock.Mock(side_effect=RuntimeError("boom"))
+        enqueue("test_task", [{"n": 1}])
+
+        with self.assertLogs("shop.outbox", "ERROR"):
+            self.assertEqual(len(self.run_claimed()), 1)
+        job = OutboxJob.objects.get()
+        self.assertEqual(job.status, OutboxJob.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("RuntimeError: boom", job.last_error)
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=5))
+        self.assertEqual(self.run_claimed(), [])  # still backing off
+
+        OutboxJob.objects.update(available_at=timezone.now())
+        with self.assertLogs("shop.outbox", "ERROR"):
+            self.run_claimed()
+        job.refresh_from_db()
+        self.assertEqual(job.status, OutboxJob.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(
+            outbox.stats.counts,
+            {("test_task", "retried"): 1, ("test_task", "failed"): 1},
+        )
+
+    def test_unknown_task_fails(self):
+        enqueue("no_such_task", [{}])
+        with self.assertLogs("shop.outbox", "ERROR"):
+            self.run_claimed()
+
+        self.assertIn("LookupError", OutboxJob.objects.get().last_error)
+
+    def test_metrics(self):
+        enqueue("test_task", [{"n": 1}, {"n": 2}])
+        self.run_claimed()
+        enqueue("test_task", [{"n": 3}])
+        body = registry.render()
+
+        self.assertIn('shop_outbox_jobs{status="queued"} 1', body)
+        self.assertIn('shop_outbox_jobs{status="failed"} 0', body)
+        self.assertIn("shop_outbox_lag_seconds ", body)
+        self.assertIn(
+            'shop_outbox_jobs_total{task="test_task",outcome="done"} 2', body
+        )
+
+
+class TestOutboxWorker(TransactionTestCase):
+    def test_run_worker_once(self):
+        done = []
+        outbox.tasks["test_task"] = lambda payload: done.append(payload["n"])
+        self.addCleanup(outbox.tasks.pop, "test_task")
+        enqueue("test_task", [{"n": n} for n in range(25)])
+        out = StringIO()
+        call_command(
+            "run_worker", "--once", "--threads=4", "--batch-size=10", stdout=out
+        )
+
+        self.assertEqual(sorted(done), list(range(25)))
+        self.assertFalse(OutboxJob.objects.exists())
+        self.assertIn("Ran 25 jobs", out.getvalue())
+
+    def test_worker_threads_see_committed_orders(self):
+        user = User.objects.create_user(
+            username="user", password="user", email="user@example.com"
+        )
+        order = Order.objects.create(user=user)
+        order.status = "Completed"
+        update_order_statuses([order])
+        worker = OutboxWorker(threads=2)
+        self.addCleanup(worker.shutdown)
+
+        self.assertEqual(worker.run_until_empty(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class TestCart(APITestCase):
+    def setUp(self) -> None:
+        cart_store.cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.chair = Product.objects.create(
+            name="Chair", description="Office chair", price="90.50", stock=2
+        )
+
+    def add(self, product, quantity):
+        data = {"product_id": product.id, "quantity": quantity}
+        return self.client.post(reverse("cart-items"), data, format="json")
+
+    def test_concurrent_adds_are_both_kept(self):
+        first_read, resume = threading.Event(), threading.Event()
+        checks = []
+
+        def check_stock(product_id, quantity):
+            # Holds the first add between its read and its write.
+            checks.append(quantity)
+            if len(checks) == 1:
+                first_read.set()
+                resume.wait(5)
+
+        with mock.patch("shop.cart.check_stock", check_stock):
+            first = threading.Thread(
+                target=cart.add_item, args=(self.user.pk, self.lamp.id, 1)
+            )
+            second = threading.Thread(
+                target=cart.add_item, args=(self.user.pk, self.lamp.id, 2)
+            )
+            first.start()
+            first_read.wait(5)
+            second.start()
+            time.sleep(0.05)  # the second add is now waiting for the cart
+            resume.set()
+            first.join()
+            second.join()
+
+        self.assertEqual(checks, [1, 3])
+        self.assertEqual(cart_store.get(self.user.pk), {self.lamp.id: 3})
+
+    def test_busy_cart_is_a_conflict(self):
+        with cart_store.update_lock(self.user.pk), mock.patch.object(
+            cart_store, "lock_wait", 0
+        ):
+            response = self.add(self.lamp, 1)
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_add_update_and_remove(self):
+        self.add(self.lamp, 1)
+        self.add(self.lamp, 2)
+        response = self.add(self.chair, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["item_count"], 4)
+        self.assertEqual(response.data["total_amount"], "150.50")
+
+        url = reverse("cart-item", args=[self.chair.id])
+        response = self.client.put(url, {"quantity": 2}, format="json")
+        self.assertEqual(response.data["total_amount"], "241.00")
+
+        url = reverse("cart-item", args=[self.lamp.id])
+        response = self.client.delete(url)
+        self.assertEqual(
+            response.data["items"],
+            [
+                {
+                    "product_id": self.chair.id,
+                    "name": "Chair",
+                    "unit_price": "90.50",
+                    "quantity": 2,
+                    "subtotal": "181.00",
+                    "in_stock": True,
+                }
+            ],
+        )
+
+        self.assertEqual(self.client.delete(reverse("cart")).status_code, 204)
+        self.assertEqual(self.client.get(reverse("cart")).data["items"], [])
+
+    def test_reading_the_cart_is_one_query(self):
+        self.add(self.lamp, 1)
+        self.add(self.chair, 1)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("cart"))
+        self.assertEqual(len(response.data["items"]), 2)
+
+    def test_prices_and_stock_are_live(self):
+        self.add(self.lamp, 3)
+        Product.objects.filter(pk=self.lamp.pk).update(price="25.00", stock=1)
+        item = self.client.get(reverse("cart")).data["items"][0]
+
+        self.assertEqual(item["unit_price"], "25.00")
+        self.assertFalse(item["in_stock"])
+
+    def test_invalid_items(self):
+        self.assertEqual(self.add(self.lamp, 6).status_code, 400)
+        self.assertEqual(self.add(self.lamp, 0).status_code, 400)
+        response = self.client.post(
+            reverse("cart-items"), {"product_id": 999, "quantity": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        with override_settings(SHOP_CART={"ALIAS": "carts", "MAX_LINES": 1}):
+            self.add(self.lamp, 1)
+            self.assertEqual(self.add(self.chair, 1).status_code, 400)
+
+    def test_deleted_products_drop_out(self):
+        self.add(self.lamp, 1)
+        self.add(self.chair, 1)
+        self.chair.delete()
+
+        response = self.client.get(reverse("cart"))
+        self.assertEqual(len(response.data["items"]), 1)
+        self.assertEqual(list(cart_store.get(self.user.pk)), [self.lamp.id])
+
+    def test_carts_are_per_user(self):
+        self.add(self.lamp, 1)
+        other = User.objects.create_user(username="other", password="other")
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.client.get(reverse("cart")).data["items"], [])
+
+    def test_checkout(self):
+        self.add(self.lamp, 2)
+        self.add(self.chair, 1)
+        response = self.client.post(reverse("cart-checkout"))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["total_amount"], "130.50")
+        order = Order.objects.get()
+        self.assertEqual(order.item_count, 3)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 3)
+        self.assertEqual(cart_store.get(self.user.pk), {})
+
+    def test_failed_checkout_keeps_the_cart(self):
+        self.add(self.chair, 2)
+        Product.objects.filter(pk=self.chair.pk).update(stock=1)
+        response = self.client.post(reverse("cart-checkout"))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(cart_store.get(self.user.pk), {self.chair.id: 2})
+
+        response = self.client.post(reverse("cart-checkout"))
+        self.assertEqual(response.status_code, 400)  # the lock was released
+
+    def test_empty_cart_checkout(self):
+        response = self.client.post(reverse("cart-checkout"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_checkout_is_refused(self):
+        self.add(self.lamp, 1)
+        with cart_store.checkout_lock(self.user.pk):
+            response = self.client.post(reverse("cart-checkout"))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class TestOrderTotals(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="user")
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=50
+        )
+        self.chair = Product.objects.create(
+            name="Chair", description="Office chair", price="90.50", stock=50
+        )
+        self.order = place_order(
+            self.user,
+            [
+                {"product_id": self.lamp.id, "quantity": 2},
+                {"product_id": self.chair.id, "quantity": 1},
+            ],
+        )
+
+    def assertTotals(self, order, total_amount, item_count):
+        order.refresh_from_db()
+        self.assertEqual(str(order.total_amount), total_amount)
+        self.assertEqual(order.item_count, item_count)
+
+    def test_checkout_snapshots_prices(self):
+        self.assertTotals(self.order, "130.50", 3)
+        self.lamp.price = "25.00"
+        self.lamp.save()
+
+        self.assertTotals(self.order, "130.50", 3)
+        item = self.order.items.get(product=self.lamp)
+        self.assertEqual(str(item.unit_price), "20.00")
+        self.assertEqual(str(item.subtotal), "40.00")
+
+    def test_item_changes_are_applied_incrementally(self):
+        item = OrderItem.objects.create(
+            order=self.order, product=self.lamp, quantity=1, unit_price="20.00"
+        )
+        self.assertTotals(self.order, "150.50", 4)
+
+        item.quantity = 3
+        item.save()
+        self.assertTotals(self.order, "190.50", 6)
+
+        item = OrderItem.objects.get(pk=item.pk)
+        item.quantity = 2
+        item.save()
+        self.assertTotals(self.order, "170.50", 5)
+
+        item.delete()
+        self.assertTotals(self.order, "130.50", 3)
+
+    def test_moving_an_item_between_orders(self):
+        other = place_order(self.user, [{"product_id": self.lamp.id, "quantity": 1}])
+        item = self.order.items.get(product=self.chair)
+        item.order = other
+        item.save()
+
+        self.assertTotals(self.order, "40.00", 2)
+        self.assertTotals(other, "110.50", 2)
+
+    def test_deferred_item_save_recomputes(self):
+        item = OrderItem.objects.only("id", "quantity").get(product=self.chair)
+        item.quantity = 2
+        item.save()
+
+        self.assertTotals(self.order, "221.00", 4)
+
+    def test_item_change_bumps_order_updated_at(self):
+        before = self.order.updated_at
+        item = self.order.items.get(product=self.lamp)
+        item.delete()
+
+        self.order.refresh_from_db()
+        self.assertGreater(self.order.updated_at, before)
+
+    def test_order_delete_skips_item_signals(self):
+        # items, delete reservations, delete items, delete order
+        with self.assertNumQueries(4):
+            self.order.delete()
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+    def test_totals_in_api(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        response = self.client.get(reverse("list-create-orders"))
+
+        order = response.data["results"][0]
+        self.assertEqual(order["total_amount"], "130.50")
+        self.assertEqual(order["item_count"], 3)
+        self.assertEqual(
+            sorted(item["unit_price"] for item in order["items"]), ["20.00", "90.50"]
+        )
+
+    def test_reconcile_fixes_drift(self):
+        clean = place_order(self.user, [{"product_id": self.lamp.id, "quantity": 1}])
+        OrderItem.objects.filter(order=self.order).update(quantity=5)
+
+        self.assertEqual(reconcile_order_totals(batch_size=1), 1)
+        self.assertTotals(self.order, "552.50", 10)
+        self.assertTotals(clean, "20.00", 1)
+        self.assertEqual(reconcile_order_totals(), 0)
+
+    def test_reconcile_command(self):
+        Order.objects.filter(pk=self.order.pk).update(total_amount=0, item_count=0)
+        out = StringIO()
+        call_command("reconcile_order_totals", stdout=out)
+
+        self.assertIn("Fixed 1 orders", out.getvalue())
+        self.assertTotals(self.order, "130.50", 3)
+
+
+class TestAnalytics(APITestCase):
+    def setUp(self) -> None:
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=50
+        )
+        self.chair = Product.objects.create(
+            name="Chair", description="Office chair", price="90.50", stock=3
+        )
+        self.today = timezone.localdate().isoformat()
+
+    def complete(self, *items, days_ago=0):
+        order = place_order(
+            self.admin_user,
+            [{"product_id": product.id, "quantity": n} for product, n in items],
+        )
+        order.status = "Completed"
+        order.save()
+        if days_ago:
+            Order.objects.filter(pk=order.pk).update(
+                completed_at=order.completed_at - timedelta(days=days_ago)
+            )
+        return order
+
+    def rollup(self):
+        return update_sales_rollups(batch_size=2, lag=timedelta(0))
+
+    def test_completing_an_order_stamps_completed_at(self):
+        order = place_order(
+            self.admin_user, [{"product_id": self.lamp.id, "quantity": 1}]
+        )
+        self.assertIsNone(order.completed_at)
+        url = reverse("bulk-order-status")
+        self.client.patch(url, [{"id": order.id, "status": "Completed"}], format="json")
+
+        order.refresh_from_db()
+        self.assertIsNotNone(order.completed_at)
+
+    def test_revenue_by_day(self):
+        self.complete((self.lamp, 2), (self.chair, 1))
+        self.complete((self.lamp, 1))
+        self.complete((self.chair, 2), days_ago=1)
+        place_order(self.admin_user, [{"product_id": self.lamp.id, "quantity": 1}])
+        self.assertEqual(self.rollup(), 3)
+
+        response = self.client.get(reverse("analytics-revenue"))
+        self.assertEqual(response.status_code, 200)
+        days = {day["date"]: day for day in response.json()["days"]}
+        today = days[self.today]
+        self.assertEqual((today["orders"], today["items"]), (2, 4))
+        self.assertEqual(today["revenue"], "150.50")
+        self.assertEqual(len(days), 2)
+
+        response = self.client.get(
+            reverse("analytics-revenue"), {"start": self.today}
+        )
+        self.assertEqual(len(response.json()["days"]), 1)
+
+    def test_rollups_are_incremental(self):
+        self.complete((self.lamp, 1))
+        self.assertEqual(self.rollup(), 1)
+        self.assertEqual(self.rollup(), 0)
+        self.complete((self.lamp, 2))
+        self.complete((self.chair, 1))
+        self.complete((self.lamp, 1))
+
+        self.assertEqual(self.rollup(), 3)
+        day = DailySales.objects.get()
+        self.assertEqual((day.orders, day.items, str(day.revenue)), (4, 5, "170.50"))
+
+    def test_recent_orders_wait_for_the_lag(self):
+        self.complete((self.lamp, 1))
+        self.assertEqual(update_sales_rollups(lag=timedelta(minutes=5)), 0)
+        self.assertEqual(self.rollup(), 1)
+
+    def test_top_products(self):
+        self.complete((self.lamp, 5), (self.chair, 1))
+        self.complete((self.chair, 1), days_ago=2)
+        self.rollup()
+
+        response = self.client.get(reverse("analytics-top-products"))
+        products = response.json()["products"]
+        self.assertEqual([p["name"] for p in products], ["Chair", "Lamp"])
+        self.assertEqual(products[0]["quantity"], 2)
+        self.assertEqual(products[0]["revenue"], "181.00")
+
+        response = self.client.get(
+            reverse("analytics-top-products"), {"start": self.today, "limit": 1}
+        )
+        products = response.json()["products"]
+        self.assertEqual([p["name"] for p in products], ["Lamp"])
+
+    def test_rebuild_command(self):
+        self.complete((self.lamp, 1))
+        self.rollup()
+        out = StringIO()
+        call_command("update_analytics", "--rebuild", "--lag", "0", stdout=out)
+
+        self.assertIn("Rolled up 1 orders", out.getvalue())
+        self.assertEqual(DailySales.objects.get().orders, 1)
+
+    def test_low_stock(self):
+        response = self.client.get(reverse("analytics-low-stock"), {"threshold": 3})
+        self.assertEqual(
+            response.json()["products"],
+            [{"id": self.chair.id, "name": "Chair", "stock": 3}],
+        )
+
+    def test_invalid_params(self):
+        for url, params in [
+            ("analytics-revenue", {"start": "yesterday"}),
+            ("analytics-revenue", {"start": "2024-02-30"}),
+            ("analytics-revenue", {"start": "2024-02-02", "end": "2024-02-01"}),
+            ("analytics-top-products", {"limit": 0}),
+            ("analytics-low-stock", {"threshold": "x"}),
+        ]:
+            response = self.client.get(reverse(url), params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_admin_only(self):
+        user = User.objects.create_user(username="user", password="user")
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        response = self.client.get(reverse("analytics-revenue"))
+
+        self.assertEqual(response.status_code, 403)
+
+
+class TestConcurrentCheckout(TransactionTestCase):
+    def test_stock_never_goes_negative(self):
+        users = [
+            User.objects.create_user(username=f"user{i}", password="user")
+            for i in range(8)
+        ]
+        product = Product.objects.create(
+            name="Limited", description="Flash sale", price="5.00", stock=20
+        )
+        errors = []
+
+        def buy(user):
+            try:
+                for _ in range(5):
+                    try:
+                        place_order(user, [{"product_id": product.id, "quantity": 1}])
+                    except (ValidationError, OperationalError):
+                        pass  # sold out, or SQLite refused the write lock
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        sold = sum(OrderItem.objects.values_list("quantity", flat=True))
+        self.assertEqual(errors, [])
+        self.assertGreaterEqual(product.stock, 0)
+        self.assertGreater(sold, 0)
+        self.assertEqual(product.stock + sold, 20)
+        reserved = sum(StockReservation.objects.values_list("quantity", flat=True))
+        self.assertEqual(reserved, sold)
+
+
+class TestProductSearch(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.url = reverse("list-create-products")
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.lamp = Product.objects.create(
+            name="Brass Lamp", description="Warm light", price="40.00", stock=3
+        )
+        self.desk = Product.objects.create(
+            name="Standing desk",
+            description="Comes with a clip-on lamp",
+            price="300.00",
+            stock=2,
+        )
+        self.chair = Product.objects.create(
+            name="Chair", description="Oak frame", price="80.00", stock=9
+        )
+
+    def search(self, term, **params):
+        response = self.client.get(self.url, {"search": term, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def names(self, response):
+        return [row["name"] for row in response.data["results"]]
+
+    def test_uses_full_text_index_on_sqlite(self):
+        self.assertIsInstance(get_search_backend(), SQLiteSearchBackend)
+
+    def test_name_matches_rank_first(self):
+        response = self.search("lamp")
+
+        self.assertEqual(self.names(response), ["Brass Lamp", "Standing desk"])
+        self.assertEqual(response.data["count"], 2)
+
+    def test_prefix_and_multiple_terms(self):
+        prefix = self.search("lam")
+        both = self.search("lamp clip")
+
+        self.assertEqual(self.names(prefix), ["Brass Lamp", "Standing desk"])
+        self.assertEqual(self.names(both), ["Standing desk"])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.chair.description = "Oak frame with reading lamp"
+        self.chair.save()
+        self.lamp.delete()
+
+        self.assertEqual(self.names(self.search("lamp")), ["Chair", "Standing desk"])
+
+    def test_search_syntax_is_escaped(self):
+        for term in ['"lamp', "lamp OR", "NEAR(", "desc*ription", "-oak"]:
+            self.search(term)
+
+    def test_combines_with_price_filter(self):
+        response = self.search("lamp", price__lte="100")
+
+        self.assertEqual(self.names(response), ["Brass Lamp"])
+
+    def test_cursor_pages_follow_rank(self):
+        first = self.search("lamp", page_size=1)
+        second = self.client.get(first.data["next"])
+
+        self.assertEqual(self.names(first), ["Brass Lamp"])
+        self.assertEqual(self.names(second), ["Standing desk"])
+        self.assertIsNone(second.data["next"])
+
+
+REPLICAS = {"ALIASES": ["replica_a", "replica_b"], "PIN_SECONDS": 5}
+
+
+class TestReplicaRouting(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_authenticate(self.admin)
+        self.url = reverse("list-create-products")
+
+    @override_settings(SHOP_REPLICAS=REPLICAS)
+    def test_reads_default_outside_replica_views(self):
+        self.assertEqual(Product.objects.all().db, "default")
+        with routing():
+            self.assertEqual(Product.objects.all().db, "default")
+
+    @override_settings(SHOP_REPLICAS=REPLICAS)
+    def test_round_robin_one_replica_per_request(self):
+        seen = []
+        for _ in range(4):
+            with routing() as state:
+                state.replica = True
+                seen.append(Product.objects.all().db)
+                self.assertEqual(Order.objects.all().db, seen[-1])
+
+        self.assertEqual(sorted(seen), ["replica_a"] * 2 + ["replica_b"] * 2)
+
+    @override_settings(SHOP_REPLICAS=REPLICAS)
+    def test_reads_after_a_write_go_to_primary(self):
+        with routing() as state:
+            state.replica = True
+            self.assertEqual(ReplicaRouter().db_for_write(Product), "default")
+            self.assertEqual(Product.objects.all().db, "default")
+
+    @override_settings(SHOP_REPLICAS={**REPLICAS, "STRATEGY": "least_latency"})
+    def test_least_latency(self):
+        self.addCleanup(replicas.latency.clear)
+        replicas.record("replica_a", 0.050)
+        replicas.record("replica_b", 0.002)
+
+        chosen = [replicas.choose() for _ in range(40)]
+        self.assertGreater(chosen.count("replica_b"), 30)
+        self.assertIn("replica_a", chosen)  # still probed now and then
+
+    @override_settings(SHOP_REPLICAS=REPLICAS)
+    async def test_middleware_pins_writers_under_asgi(self):
+        def view(request):
+            # A sync view, run on a thread as under ASGI.
+            ReplicaRouter().db_for_write(Product)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(sync_to_async(view))
+        request = AsyncRequestFactory().post("/")
+        request.user = self.admin
+
+        self.assertTrue(iscoroutinefunction(middleware))
+        await middleware(request)
+        self.assertTrue(await sync_to_async(is_pinned)(self.admin.pk))
+
+    def test_no_replicas_configured(self):
+        self.client.get(self.url)
+        self.assertEqual(Product.objects.all().db, "default")
+
+    def test_copy_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            primary, replica = Path(tmp, "primary.db"), Path(tmp, "replica.db")
+            db = sqlite3.connect(primary)
+            db.executescript("CREATE TABLE t (x); INSERT INTO t VALUES (1);")
+            db.close()
+            copy_sqlite(primary, replica)
+            db = sqlite3.connect(replica)
+            rows = db.execute("SELECT x FROM t").fetchall()
+            db.close()
+
+        self.assertEqual(rows, [(1,)])
+
+
+@override_settings(SHOP_REPLICAS={"ALIASES": ["replica"], "PIN_SECONDS": 5})
+class TestReplicaDatabase(TransactionTestCase):
+    """Routing against a real second SQLite database as the replica."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        primary = connections["default"]
+        settings_dict = {
+            **primary.settings_dict,
+            "NAME": str(Path(tmp.name, "replica.sqlite3")),
+        }
+        # Registered for this thread only, outside DATABASES, so the test
+        # runner neither creates nor checks it.
+        connections["replica"] = primary.__class__(settings_dict, "replica")
+        cls.addClassCleanup(cls.drop_replica)
+
+    @classmethod
+    def drop_replica(cls):
+        connections["replica"].close()
+        del connections["replica"]
+
+    def setUp(self) -> None:
+        cache.clear()
+        token_cache.clear()
+        self.admin = User.objects.create_superuser(username="admin", password="admin")
+        self.token = Token.objects.create(user=self.admin)
+        Product.objects.create(name="Lamp", description="d", price="20.00", stock=5)
+        self.sync_replica()
+        # Committed on the primary only: the replica lags behind it.
+        Product.objects.create(name="Desk", description="d", price="90.00", stock=1)
+        self.url = reverse("list-create-products")
+
+    def sync_replica(self):
+        primary = connections["default"]
+        primary.ensure_connection()
+        connections["replica"].close()
+        replica = sqlite3.connect(connections["replica"].settings_dict["NAME"])
+        try:
+            primary.connection.backup(replica)
+        finally:
+            replica.close()
+
+    def names(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return sorted(product["name"] for product in response.json()["results"])
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": False})
+    def test_reads_go_to_the_replica_until_the_user_writes(self):
+        auth = {"Authorization": f"Token {self.token.key}"}
+        self.assertEqual(self.names(), ["Lamp"])
+        self.assertEqual(self.names(**auth), ["Lamp"])
+
+        data = {"name": "Chair", "description": "d", "price": "30.00", "stock": 2}
+        response = self.client.post(self.url, data, headers=auth)
+        self.assertEqual(response.status_code, 201)
+
+        self.assertTrue(is_pinned(self.admin.pk))
+        self.assertEqual(self.names(**auth), ["Chair", "Desk", "Lamp"])
+        self.assertEqual(self.names(), ["Lamp"])
+
+        cache.clear()  # the pin expires
+        self.assertEqual(self.names(**auth), ["Lamp"])
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": True})
+    def test_catalog_cache_is_filled_from_the_primary(self):
+        self.assertEqual(self.names(), ["Desk", "Lamp"])
+        self.assertEqual(self.names(), ["Desk", "Lamp"])  # the cached copy
+
+
+    async def async_names(self, **headers):
+        response = await self.async_client.get(
+            reverse("async-list-products"), headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        return sorted(product["name"] for product in response.json()["results"])
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": False})
+    async def test_async_views_read_from_the_replica_unless_pinned(self):
+        auth = {"Authorization": f"Token {self.token.key}"}
+        self.assertEqual(await self.async_names(**auth), ["Lamp"])
+
+        await sync_to_async(pin_to_primary)(self.admin.pk)
+        self.assertEqual(await self.async_names(**auth), ["Desk", "Lamp"])
+        self.assertEqual(await self.async_names(), ["Lamp"])
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": True})
+    async def test_async_catalog_cache_is_filled_from_the_primary(self):
+        self.assertEqual(await self.async_names(), ["Desk", "Lamp"])
+        self.assertEqual(await self.async_names(), ["Desk", "Lamp"])
+
+class TestCachedTokenAuthentication(APITestCase):
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.user = User.objects.create_user(username="user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.url = reverse("list-create-orders")
+
+    def test_second_request_skips_token_query(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any("authtoken_token" in query["sql"] for query in ctx.captured_queries)
+        )
+        self.assertEqual(token_cache.stats()["hits"], 1)
+        self.assertEqual(token_cache.stats()["misses"], 1)
+
+    def test_logout_revokes_token(self):
+        self.client.get(self.url)
+        response = self.client.post(reverse("logout"))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation_invalidates(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_password_change_invalidates(self):
+        self.client.get(self.url)
+        self.user.set_password("new-password")
+        self.user.save()
+
+        self.assertEqual(token_cache.stats()["size"], 0)
+
+    def test_token_rotation_invalidates(self):
+        self.client.get(self.url)
+        self.token.delete()
+        Token.objects.create(user=self.user)
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    @override_settings(SHOP_TOKEN_CACHE={"TTL": 30, "MAX_SIZE": 1})
+    def test_cache_is_bounded(self):
+        other = User.objects.create_user(username="other", password="other")
+        other_token = Token.objects.create(user=other)
+        self.client.get(self.url)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + other_token.key)
+        self.client.get(self.url)
+
+        self.assertEqual(token_cache.stats()["size"], 1)
+
+    @override_settings(SHOP_TOKEN_CACHE={"TTL": 0, "MAX_SIZE": 10})
+    def test_entries_expire(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+
+        self.assertEqual(token_cache.stats()["hits"], 0)
+
+
+def make_image(size=(1200, 600), color="orange", image_format="PNG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class TestProductImages(APITestCase):
+    def setUp(self) -> None:
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.addCleanup(image_pool.shutdown)
+        self.admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_authenticate(self.admin)
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.url = reverse("product-image", args=[self.lamp.id])
+
+    def upload(self, data=None, name="lamp.png"):
+        upload = SimpleUploadedFile(name, data or make_image(), "image/png")
+        return self.client.put(self.url, {"image": upload}, format="multipart")
+
+    def test_upload_stores_by_content_hash_and_queues_renditions(self):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, 202)
+        self.lamp.refresh_from_db()
+        self.assertRegex(self.lamp.image.name, r"^products/[0-9a-f]{32}\.png$")
+        self.assertTrue(default_storage.exists(self.lamp.image.name))
+        self.assertEqual(response.data["image"], "/media/" + self.lamp.image.name)
+        self.assertEqual(response.data["image_renditions"], {})
+        job = OutboxJob.objects.get()
+        self.assertEqual(job.task, "generate_product_renditions")
+        self.assertEqual(job.payload, {"product_id": self.lamp.id})
+
+    def test_same_content_same_file(self):
+        self.upload(name="a.png")
+        first = Product.objects.get(pk=self.lamp.id).image.name
+        self.upload(name="b.png")
+
+        self.assertEqual(Product.objects.get(pk=self.lamp.id).image.name, first)
+
+    def test_rejects_non_images(self):
+        response = self.upload(b"not an image", name="lamp.png")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OutboxJob.objects.exists())
+
+    @override_settings(SHOP_IMAGES={"MAX_UPLOAD_SIZE": 100})
+    def test_rejects_large_uploads(self):
+        self.assertEqual(self.upload().status_code, 400)
+
+    def test_admin_only(self):
+        user = User.objects.create_user(username="user", password="user")
+        self.client.force_authenticate(user)
+
+        self.assertEqual(self.upload().status_code, 403)
+
+    @override_settings(
+        SHOP_IMAGES={
+            "RENDITIONS": {"thumb": 100, "large": 2000},
+            "FORMAT": "WEBP",
+            "QUALITY": 70,
+        }
+    )
+    def test_renditions_in_serializer_output(self):
+        self.upload()
+        jobs = claim_jobs(10, lease=60)
+        self.assertIsNone(run_job(jobs[0]))
+
+        self.lamp.refresh_from_db()
+        self.assertEqual(sorted(self.lamp.image_renditions), ["large", "thumb"])
+        thumb = self.lamp.image_renditions["thumb"]
+        self.assertTrue(thumb.startswith("products/renditions/"))
+        self.assertTrue(thumb.endswith("-thumb-100-q70.webp"))
+        with default_storage.open(thumb) as stream, Image.open(stream) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (100, 50)))
+        large = self.lamp.image_renditions["large"]
+        with default_storage.open(large) as stream, Image.open(stream) as image:
+            self.assertEqual(image.size, (1200, 600))  # never scaled up
+
+        response = self.client.get(reverse("list-create-products"))
+        self.assertEqual(
+            response.data["results"][0]["image_renditions"]["thumb"], "/media/" + thumb
+        )
+        detail = reverse("update-delete-retrieve-products", args=[self.lamp.id])
+        self.assertEqual(
+            self.client.get(detail).data["image"], "/media/" + self.lamp.image.name
+        )
+
+    def test_renditions_of_a_replaced_image_are_dropped(self):
+        self.upload()
+        lamp_id = self.lamp.id
+
+        class ReplacingPool:
+            # A new image is uploaded while the old one renders.
+            def submit(self, fn, *args):
+                Product.objects.filter(pk=lamp_id).update(image="products/new.png")
+                return image_pool.submit(fn, *args)
+
+        self.assertEqual(generate_renditions([lamp_id], ReplacingPool()), (0, 0))
+        self.assertEqual(Product.objects.get(pk=lamp_id).image_renditions, {})
+
+    def test_pool_does_not_fork(self):
+        executor = image_pool.get_executor()
+
+        self.assertIn(executor._mp_context.get_start_method(), {"forkserver", "spawn"})
+
+    def test_clear_image(self):
+        self.upload()
+        response = self.client.delete(self.url)
+
+        self.assertEqual(response.status_code, 204)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.image.name, "")
+        detail = reverse("update-delete-retrieve-products", args=[self.lamp.id])
+        self.assertIsNone(self.client.get(detail).data["image"])
+
+    def test_regenerate_command(self):
+        self.upload()
+        OutboxJob.objects.all().delete()
+        out = StringIO()
+        call_command("regenerate_renditions", "--workers=2", "--missing", stdout=out)
+
+        self.assertIn("Rendered 1 product images", out.getvalue())
+        self.lamp.refresh_from_db()
+        renditions = settings.SHOP_IMAGES["RENDITIONS"]
+        self.assertEqual(sorted(self.lamp.image_renditions), sorted(renditions))
+
+
+class TestProductImportExport(TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.existing = Product.objects.create(
+            name="Old name", description="Old", price="1.00", stock=1
+        )
+
+    def path(self, name, content=None):
+        path = Path(self.tmp.name) / name
+        if content is not None:
+            path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    def run_import(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command("import_products", path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_upserts_in_batches(self):
+        path = self.path(
+            "feed.csv",
+            "id,name,description,price,stock\n"
+            f"{self.existing.id},New name,Updated,2.50,7\n"
+            ",Kettle,Steel kettle,30.00,4\n"
+            ",Mug,Ceramic mug,8.00,40\n",
+        )
+        out, _ = self.run_import(path, batch_size=2)
+
+        self.assertIn("Imported 3 products", out)
+        self.assertEqual(Product.objects.count(), 3)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.name, "New name")
+        self.assertEqual(self.existing.stock, 7)
+        self.assertTrue(Product.objects.filter(name="Mug", stock=40).exists())
+
+    def test_invalid_rows_are_skipped(self):
+        rows = [
+            {"name": "Kettle", "description": "Steel", "price": "30.00", "stock": 4},
+            {"name": "Broken", "description": "No price", "stock": 4},
+            {"name": "Lamp", "description": "Desk", "price": "abc", "stock": 1},
+        ]
+        path = self.path("feed.jsonl", "\n".join(json.dumps(row) for row in rows))
+        out, err = self.run_import(path)
+
+        self.assertIn("Imported 1 products, skipped 2", out)
+        self.assertIn("Row 2", err)
+        self.assertIn("Row 3", err)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_export_round_trips(self):
+        Product.objects.create(
+            name="Kettle, steel", description='Says "hi"\nTwice', price="30.00", stock=4
+        )
+        for fmt in ("csv", "jsonl"):
+            path = self.path(f"export.{fmt}")
+            call_command("export_products", path, stderr=StringIO())
+            before = list(Product.objects.order_by("id").values())
+            Product.objects.update(name="changed", stock=0)
+
+            self.run_import(path)
+
+            after = list(Product.objects.order_by("id").values())
+            for row in before + after:
+                row.pop("updated_at")
+            self.assertEqual(after, before)
+
+
+class TestBulkEndpoints(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        self.products_url = reverse("bulk-products")
+        self.status_url = reverse("bulk-order-status")
+        self.lamp = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.mug = Product.objects.create(
+            name="Mug", description="Ceramic", price="8.00", stock=50
+        )
+
+    def test_bulk_create(self):
+        rows = [
+            {"name": f"Item {i}", "description": "d", "price": "1.00", "stock": i}
+            for i in range(300)
+        ]
+        # token, savepoint, three batched INSERTs on SQLite, release
+        with self.assertNumQueries(6):
+            response = self.client.post(self.products_url, rows, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["results"]), 300)
+        self.assertEqual(Product.objects.count(), 302)
+        created = Product.objects.get(pk=response.data["results"][7]["id"])
+        self.assertEqual(created.name, "Item 7")
+
+    def test_bulk_create_is_all_or_nothing(self):
+        rows = [
+            {"name": "Kettle", "description": "d", "price": "1.00", "stock": 1},
+            {"name": "Broken", "description": "d", "stock": 1},
+        ]
+        response = self.client.post(self.products_url, rows, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["results"][0]["status"], "valid")
+        self.assertIn("price", response.data["results"][1]["errors"])
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_bulk_update(self):
+        rows = [
+            {"id": self.lamp.id, "price": "18.50"},
+            {"id": self.mug.id, "stock": 45, "name": "Big mug"},
+        ]
+        response = self.client.patch(self.products_url, rows, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.lamp.refresh_from_db()
+        self.mug.refresh_from_db()
+        self.assertEqual(str(self.lamp.price), "18.50")
+        self.assertEqual(self.lamp.stock, 5)
+        self.assertEqual((self.mug.name, self.mug.stock), ("Big mug", 45))
+
+    def test_bulk_update_reports_row_errors(self):
+        rows = [
+            {"id": self.lamp.id, "price": "18.50"},
+            {"id": self.mug.id, "stock": "many"},
+            {"id": 999, "stock": 1},
+        ]
+        response = self.client.patch(self.products_url, rows, format="json")
+
+        statuses = [row["status"] for row in response.data["results"]]
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(statuses, ["updated", "error", "error"])
+        self.lamp.refresh_from_db()
+        self.assertEqual(str(self.lamp.price), "20.00")
+
+    def test_bulk_requires_admin(self):
+        user = User.objects.create_user(username="user", password="user")
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        response = self.client.patch(self.status_url, [], format="json")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_rejects_non_lists(self):
+        response = self.client.post(self.products_url, {"name": "x"}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_order_status(self):
+        orders = [Order.objects.create(user=self.admin_user) for _ in range(3)]
+        rows = [{"id": order.id, "status": "Completed"} for order in orders]
+        # token, select, savepoint, lock, one UPDATE, drop reservations,
+        # queue jobs, release
+        with self.assertNumQueries(8):
+            response = self.client.patch(self.status_url, rows, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.filter(status="Completed").count(), 3)
+
+    def test_bulk_order_status_rejects_completed_orders(self):
+        pending = Order.objects.create(user=self.admin_user)
+        done = Order.objects.create(user=self.admin_user, status="Completed")
+        rows = [
+            {"id": pending.id, "status": "Completed"},
+            {"id": done.id, "status": "Pending"},
+            {"id": pending.id, "status": "Shipped"},
+        ]
+        response = self.client.patch(self.status_url, rows, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["results"][1]["status"], "error")
+        self.assertEqual(response.data["results"][2]["status"], "error")
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, "Pending")
+
+
+class TestQueryPlans(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f"user{i}") for i in range(20)]
+        cls.admin = User.objects.create(
+            username="admin", is_staff=True, is_superuser=True
+        )
+        seed_products(3000)
+        seed_orders(cls.users, 1000)
+        analyze_tables()
+
+    def test_no_endpoint_query_scans_a_full_table(self):
+        audits = audit_query_plans(self.users[0], self.admin)
+
+        self.assertEqual(len(audits), 10)
+        for audit in audits:
+            with self.subTest(audit.name):
+                self.assertEqual(audit.full_scans, [], audit.plan)
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": False})
+    def test_list_queries_do_not_depend_on_depth(self):
+        token = Token.objects.create(user=self.users[0])
+        headers = {"Authorization": f"Token {token.key}"}
+        for route in ("list-create-products", "list-create-orders"):
+            with self.subTest(route):
+                url = reverse(route) + "?count=false&page_size=5"
+                self.client.get(url, headers=headers)  # caches the token
+                with CaptureQueriesContext(connection) as first:
+                    next_url = self.client.get(url, headers=headers).json()["next"]
+                with CaptureQueriesContext(connection) as deep:
+                    self.client.get(next_url, headers=headers)
+
+                self.assertEqual(
+                    len(deep.captured_queries), len(first.captured_queries)
+                )
+                # The ETag comes from the page, not an aggregate over the list.
+                for query in first.captured_queries + deep.captured_queries:
+                    self.assertNotIn("COUNT(", query["sql"])
+                    self.assertNotIn("MAX(", query["sql"])
+
+    def test_detects_sqlite_full_scans(self):
+        plan = "3 0 0 SCAN shop_product\n5 0 0 SCAN shop_order USING INDEX x"
+
+        self.assertEqual(find_full_scans("sqlite", plan), ["shop_product"])
+
+    def test_detects_postgresql_full_scans(self):
+        plan = json.dumps(
+            [
+                {
+                    "Plan": {
+                        "Node Type": "Limit",
+                        "Plans": [
+                            {"Node Type": "Seq Scan", "Relation Name": "shop_order"},
+                            {"Node Type": "Index Scan", "Relation Name": "shop_product"},
+                        ],
+                    }
+                }
+            ]
+        )
+
+        self.assertEqual(find_full_scans("postgresql", plan), ["shop_order"])
+
+
+class TestEndpointBenchmark(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # STATIC_ROOT is built at release, not committed; the static scenario
+        # needs its manifest.
+        static_root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(static_root.cleanup)
+        cls.static_root = static_root.name
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.static_root))
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def test_every_route_has_a_scenario(self):
+        routes = {pattern.name for pattern in urls.urlpatterns}
+        covered = {scenario.route for scenario in scenarios()}
+
+        self.assertEqual(routes - covered, set())
+
+    def test_static_scenario_is_served(self):
+        scenario = next(s for s in scenarios() if s.asset)
+        response = self.client.get(scenario.path({}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age", response["Cache-Control"])
+
+    def test_command_runs_every_scenario(self):
+        # In a subprocess: the command creates and drops its own test database.
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "report.json"
+            subprocess.run(
+                [
+                    sys.executable,
+                    str(settings.BASE_DIR / "manage.py"),
+                    "benchmark_endpoints",
+                    "--server=client",
+                    "--users=3",
+                    "--products=30",
+                    "--orders=5",
+                    "--requests=2",
+                    f"--output={output}",
+                ],
+                check=True,
+                capture_output=True,
+                env={**os.environ, "STATIC_ROOT": self.static_root},
+            )
+            report = json.loads(output.read_text())
+
+        self.assertEqual(len(report["results"]), len(scenarios()))
+        self.assertEqual(
+            [r["endpoint"] for r in report["results"] if r["errors"]], []
+        )
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+
+PERFORMANCE_ON = {"ENABLED": True, "SERVER_TIMING": True, "DUPLICATE_QUERY_THRESHOLD": 3}
+
+
+@override_settings(SHOP_PERFORMANCE=PERFORMANCE_ON)
+class TestPerformanceMiddleware(APITestCase):
+    def setUp(self) -> None:
+        registry.reset()
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        product = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        place_order(self.admin_user, [{"product_id": product.id, "quantity": 1}])
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("list-create-orders"))
+        timing = response["Server-Timing"]
+
+        self.assertIn("total;dur=", timing)
+        self.assertRegex(timing, r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+        self.assertIn("serialize;dur=", timing)
+        self.assertNotIn("X-Duplicate-Queries", response)
+
+    def test_prometheus_export(self):
+        self.client.get(reverse("list-create-orders"))
+        response = self.client.get(reverse("metrics"))
+        body = response.content.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            'shop_request_duration_seconds_count{route="api/orders",method="GET"} 1',
+            body,
+        )
+        self.assertIn('shop_request_db_queries_bucket{route="api/orders"', body)
+        self.assertIn("shop_catalog_cache_hits_total", body)
+
+    def test_metrics_require_admin(self):
+        user = User.objects.create_user(username="user", password="user")
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+    def test_flags_repeated_queries(self):
+        def n_plus_one(request):
+            for order in Order.objects.all():
+                list(order.items.all())
+                list(order.items.all())
+                list(order.items.all())
+            return HttpResponse("ok")
+
+        request = RequestFactory().get("/")
+        request.resolver_match = None
+        with self.assertLogs("shop.performance", level="WARNING"):
+            response = PerformanceMiddleware(n_plus_one)(request)
+
+        self.assertEqual(response["X-Duplicate-Queries"], "1")
+        body = registry.render()
+        self.assertIn(
+            "shop_requests_with_duplicate_queries_total"
+            '{route="unmatched",method="GET"} 1',
+            body,
+        )
+
+    async def test_server_timing_under_asgi(self):
+        response = await self.async_client.get(
+            reverse("list-create-orders"),
+            headers={"Authorization": "Token " + self.admin_token.key},
+        )
+
+        self.assertRegex(
+            response["Server-Timing"], r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"'
+        )
+
+    @override_settings(SHOP_PERFORMANCE={"ENABLED": False})
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse("list-create-orders"))
+
+        self.assertNotIn("Server-Timing", response)
+
+
+class TestAsyncViews(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user(username="user", password="user")
+        self.user_token = Token.objects.create(user=self.user)
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.products = [
+            Product.objects.create(
+                name=f"Lamp {i}", description="Desk lamp", price="20.00", stock=5
+            )
+            for i in range(5)
+        ]
+        place_order(self.user, [{"product_id": self.products[0].id, "quantity": 1}])
+        place_order(
+            self.admin_user, [{"product_id": self.products[1].id, "quantity": 2}]
+        )
+
+    def auth(self, token):
+        return {"Authorization": "Token " + token.key}
+
+    @override_settings(
+        DEBUG=True,
+        SHOP_PERFORMANCE={"ENABLED": True},
+        SHOP_REPLICAS={"ALIASES": ["default"]},
+        # The middleware gunicorn.conf.py's Uvicorn workers run (SERVE_STATIC=0).
+        MIDDLEWARE=[
+            name for name in settings.MIDDLEWARE if not name.startswith("whitenoise.")
+        ],
+    )
+    def test_asgi_middleware_is_not_adapted_to_threads(self):
+        # With DEBUG on, Django logs each middleware it has to run on a thread.
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    def database_settings(self, module, **env):
+        # Settings are read once per process: load them fresh in a subprocess.
+        script = (
+            f"import json, {module}; from django.conf import settings; "
+            "print(json.dumps(settings.DATABASES['default'], default=str))"
+        )
+        env = {**os.environ, "SERVE_ASGI": None, "DB_POOL_MAX_SIZE": None, **env}
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            check=True,
+            capture_output=True,
+            cwd=settings.BASE_DIR,
+            env={name: value for name, value in env.items() if value is not None},
+            text=True,
+        )
+        return json.loads(result.stdout)
+
+    def test_asgi_connections_are_not_persistent(self):
+        # Each request's sync code runs on a new thread under ASGI, so a
+        # persistent connection would never be reused.
+        wsgi = self.database_settings("ECommercePlatform.wsgi")
+        asgi = self.database_settings("ECommercePlatform.asgi")
+
+        self.assertEqual(wsgi["CONN_MAX_AGE"], 60)
+        self.assertTrue(wsgi["CONN_HEALTH_CHECKS"])
+        self.assertEqual(asgi["CONN_MAX_AGE"], 0)
+        self.assertFalse(asgi["CONN_HEALTH_CHECKS"])
+
+    def test_postgres_uses_the_pool_by_default(self):
+        database = self.database_settings("ECommercePlatform.asgi", POSTGRES_DB="shop")
+
+        self.assertEqual(database["OPTIONS"]["pool"]["max_size"], 10)
+        self.assertEqual(database.get("CONN_MAX_AGE", 0), 0)
+
+    async def test_product_list_matches_sync_view(self):
+        response = await self.async_client.get(
+            reverse("async-list-products") + "?page_size=2"
+        )
+        expected = await self.async_client.get(
+            reverse("list-create-products") + "?page_size=2"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Cache"], "MISS")
+        body, expected = response.json(), expected.json()
+        self.assertEqual(body["count"], 5)
+        self.assertEqual(body["results"], expected["results"])
+
+        next_page = await self.async_client.get(body["next"])
+        self.assertEqual(len(next_page.json()["results"]), 2)
+        cached = await self.async_client.get(
+            reverse("async-list-products") + "?page_size=2"
+        )
+        self.assertEqual(cached["X-Cache"], "HIT")
+
+    async def test_product_list_etag(self):
+        url = reverse("async-list-products") + "?page_size=2"
+        response = await self.async_client.get(url)
+        etag = response["ETag"]
+
+        response = await self.async_client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response["X-Cache"], "HIT")
+
+        await Product.objects.aupdate(updated_at=timezone.now())
+        await sync_to_async(catalog_cache.invalidate)()
+        response = await self.async_client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    async def test_product_detail_etag(self):
+        url = reverse("async-retrieve-products", args=[self.products[0].id])
+        auth = self.auth(self.admin_token)
+        response = await self.async_client.get(url, headers=auth)
+        expected = await self.async_client.get(
+            reverse("update-delete-retrieve-products", args=[self.products[0].id]),
+            headers=auth,
+        )
+
+        self.assertEqual(response["ETag"], expected["ETag"])
+        self.assertEqual(response["Last-Modified"], expected["Last-Modified"])
+        response = await self.async_client.get(
+            url, headers={**auth, "If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_order_list_etag(self):
+        url = reverse("async-list-orders")
+        auth = self.auth(self.user_token)
+        response = await self.async_client.get(url, headers=auth)
+
+        response = await self.async_client.get(
+            url, headers={**auth, "If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    @throttle_rates(products="600/min")
+    @override_settings(SHOP_REPLICAS={"ALIASES": ["default"], "PIN_SECONDS": 5})
+    async def test_cache_is_not_called_on_the_event_loop(self):
+        loop_thread = threading.current_thread()
+        blocking = []
+
+        def watch(method):
+            def wrapper(*args, **kwargs):
+                if threading.current_thread() is loop_thread:
+                    blocking.append(method.__name__)
+                return method(*args, **kwargs)
+
+            return wrapper
+
+        backend = type(caches["default"])
+        names = ["get", "set", "add", "incr", "delete", "get_many", "has_key"]
+        with mock.patch.multiple(
+            backend, **{name: watch(getattr(backend, name)) for name in names}
+        ):
+            for url in (
+                reverse("async-list-products"),
+                reverse("async-list-products"),
+                reverse("async-retrieve-products", args=[self.products[0].id]),
+                reverse("async-list-orders"),
+            ):
+                response = await self.async_client.get(
+                    url, headers=self.auth(self.admin_token)
+                )
+                self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(blocking, [])
+
+    async def test_product_list_search_and_bad_cursor(self):
+        response = await self.async_client.get(
+            reverse("async-list-products") + "?search=Lamp%203"
+        )
+        self.assertEqual(response.json()["results"][0]["name"], "Lamp 3")
+
+        response = await self.async_client.get(
+            reverse("async-list-products") + "?cursor=garbage"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+    async def test_product_detail_permissions(self):
+        url = reverse("async-retrieve-products", args=[self.products[0].id])
+
+        response = await self.async_client.get(url, headers=self.auth(self.admin_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["name"], "Lamp 0")
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+        response = await self.async_client.get(url, headers=self.auth(self.user_token))
+        self.assertEqual(response.status_code, 403)
+
+        response = await self.async_client.get(
+            url, headers={"Authorization": "Token not-a-token"}
+        )
+        self.assertEqual(response.json(), {"detail": "Invalid token."})
+
+        response = await self.async_client.get(
+            reverse("async-retrieve-products", args=[0]),
+            headers=self.auth(self.admin_token),
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_order_list_is_scoped_to_the_user(self):
+        url = reverse("async-list-orders")
+        response = await self.async_client.get(url, headers=self.auth(self.user_token))
+        expected = await self.async_client.get(
+            reverse("list-create-orders"), headers=self.auth(self.user_token)
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], expected.json()["results"])
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(response.json()["results"][0]["items"][0]["quantity"], 1)
+
+        response = await self.async_client.get(url, headers=self.auth(self.admin_token))
+        self.assertEqual(response.json()["count"], 2)
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_only_get_is_allowed(self):
+        response = await self.async_client.post(
+            reverse("async-list-orders"), headers=self.auth(self.user_token)
+        )
+        self.assertEqual(response.status_code, 405)
+
+
+class TestConditionalRequests(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        token_cache.clear()
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        self.product = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        self.list_url = reverse("list-create-products")
+        self.detail_url = reverse(
+            "update-delete-retrieve-products", args=[self.product.id]
+        )
+
+    def test_product_list_not_modified(self):
+        etag = self.client.get(self.list_url)["ETag"]
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": False})
+    def test_list_etag_comes_from_the_page_rows(self):
+        url = self.list_url + "?count=false"
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        # Only the page itself: no COUNT, no aggregate over the whole list.
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn("LIMIT", ctx.captured_queries[0]["sql"])
+
+    @override_settings(SHOP_CATALOG_CACHE={"ENABLED": False})
+    def test_list_etag_changes_with_the_rows(self):
+        etags = {self.client.get(self.list_url)["ETag"]}
+        Product.objects.create(name="Desk", description="Oak", price="90.00", stock=1)
+        etags.add(self.client.get(self.list_url)["ETag"])
+        self.product.delete()
+        etags.add(self.client.get(self.list_url)["ETag"])
+        etags.add(self.client.get(self.list_url, {"page_size": 1})["ETag"])
+
+        self.assertEqual(len(etags), 4)
+
+    def test_product_detail_validators(self):
+        response = self.client.get(self.detail_url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        self.assertEqual(
+            self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        self.assertEqual(
+            self.client.get(
+                self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified
+            ).status_code,
+            304,
+        )
+
+    def test_update_requires_matching_etag(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        Product.objects.filter(pk=self.product.pk).update(
+            stock=1, updated_at=timezone.now()
+        )
+        catalog_cache.invalidate()  # queryset.update() skips the signals
+
+        stale = self.client.patch(
+            self.detail_url, {"stock": 3}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(stale.status_code, 412)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.patch(
+            self.detail_url, {"stock": 3}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_delete_requires_matching_etag(self):
+        response = self.client.delete(self.detail_url, HTTP_IF_MATCH='"stale"')
+
+        self.assertEqual(response.status_code, 412)
+        self.assertTrue(Product.objects.filter(pk=self.product.pk).exists())
+
+    def test_order_etags_ignore_other_orders_of_the_product(self):
+        order = place_order(
+            self.admin_user, [{"product_id": self.product.id, "quantity": 1}]
+        )
+        detail_url = reverse("update-delete-retrieve-orders", args=[order.id])
+        detail_etag = self.client.get(detail_url)["ETag"]
+
+        # Another customer's purchase bumps the product's updated_at.
+        other = User.objects.create_user(username="other", password="other")
+        place_order(other, [{"product_id": self.product.id, "quantity": 1}])
+
+        self.assertEqual(
+            self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag).status_code,
+            304,
+        )
+        response = self.client.patch(
+            detail_url,
+            {"status": "Completed"},
+            format="json",
+            HTTP_IF_MATCH=detail_etag,
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_update_returns_new_etag(self):
+        order = place_order(
+            self.admin_user, [{"product_id": self.product.id, "quantity": 1}]
+        )
+        detail_url = reverse("update-delete-retrieve-orders", args=[order.id])
+        etag = self.client.get(detail_url)["ETag"]
+
+        response = self.client.patch(
+            detail_url, {"status": "Completed"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(detail_url)["ETag"], response["ETag"])
+
+
+class TestSparseFieldsets(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        self.product = Product.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock=5
+        )
+        place_order(self.admin_user, [{"product_id": self.product.id, "quantity": 1}])
+        self.list_url = reverse("list-create-products")
+
+    def test_product_list_is_compact_by_default(self):
+        listed = self.client.get(self.list_url).data["results"][0]
+        detail = self.client.get(
+            reverse("update-delete-retrieve-products", args=[self.product.id])
+        ).data
+
+        self.assertNotIn("description", listed)
+        self.assertEqual(listed["name"], "Lamp")
+        self.assertEqual(detail["description"], "Desk lamp")
+
+    def test_fields_narrow_response_and_sql(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.list_url, {"fields": "name,price"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], [{"name": "Lamp", "price": "20.00"}])
+        page_query = ctx.captured_queries[-1]["sql"]
+        self.assertIn('"name"', page_query)
+        self.assertNotIn('"description"', page_query)
+        self.assertNotIn('"stock"', page_query)
+
+    def test_fields_can_ask_for_description(self):
+        response = self.client.get(self.list_url, {"fields": "id,description"})
+
+        self.assertEqual(
+            response.data["results"],
+            [{"id": self.product.id, "description": "Desk lamp"}],
+        )
+
+    def test_omit_skips_order_items_prefetch(self):
+        url = reverse("list-create-orders")
+        self.client.get(url)  # cache the token
+        with CaptureQueriesContext(connection) as full:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as sparse:
+            response = self.client.get(url, {"omit": "items"})
+
+        self.assertEqual(len(sparse), len(full) - 1)
+        self.assertNotIn("items", response.data["results"][0])
+        self.assertEqual(response.data["results"][0]["status"], "Pending")
+
+    def test_sparse_detail_has_its_own_etag(self):
+        url = reverse("update-delete-retrieve-products", args=[self.product.id])
+        full = self.client.get(url)
+        sparse = self.client.get(url, {"fields": "name,price"})
+        omitted = self.client.get(url, {"omit": "description"})
+        every_field = self.client.get(url, {"fields": ",".join(full.data)})
+
+        self.assertNotEqual(sparse["ETag"], full["ETag"])
+        self.assertNotEqual(omitted["ETag"], full["ETag"])
+        self.assertNotEqual(omitted["ETag"], sparse["ETag"])
+        self.assertEqual(every_field["ETag"], full["ETag"])
+
+        response = self.client.get(
+            url, {"fields": "price,name"}, headers={"If-None-Match": sparse["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, headers={"If-None-Match": sparse["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("description", response.data)
+
+        # Writes carry the full representation, so its ETag is the one to match.
+        response = self.client.patch(
+            url, {"stock": 6}, headers={"If-Match": full["ETag"]}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(self.list_url, {"fields": "name,secret"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["fields"], "Unknown field(s): secret.")
+
+
+@override_settings(SHOP_CATALOG_CACHE={"ENABLED": False})
+class TestValuesSerialization(APITestCase):
+    def setUp(self) -> None:
+        self.admin_user = User.objects.create_superuser(
+            username="admin", password="admin"
+        )
+        self.admin_token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        products = [
+            Product.objects.create(
+                name=name, description=f"{name} description", price=price, stock=10
+            )
+            for name, price in [
+                ("Café ☕", "4.50"),
+                ("Line\u2028separator", "10"),
+                ('Quote "lamp"', "0.99"),
+            ]
+        ]
+        for product in products:
+            place_order(
+                self.admin_user,
+                [
+                    {"product_id": product.id, "quantity": 1},
+                    {"product_id": products[0].id, "quantity": 2},
+                ],
+            )
+
+    def get_both(self, view_class, url, params=None):
+        bodies = []
+        for values in (False, True):
+            with mock.patch.object(view_class, "values_serialization", values):
+                response = self.client.get(url, params or {})
+            self.assertEqual(response.status_code, 200)
+            bodies.append(response.content)
+        return bodies
+
+    def test_product_list_bytes_match(self):
+        url = reverse("list-create-products")
+        slow, fast = self.get_both(views.ProductListCreateView, url)
+        self.assertEqual(slow, fast)
+        self.assertIn("Café ☕".encode(), fast)
+        self.assertIn(b"Line\\u2028separator", fast)
+        for params in [{"fields": "id,name,description"}, {"search": "lamp"}]:
+            slow, fast = self.get_both(views.ProductListCreateView, url, params)
+            self.assertEqual(slow, fast)
+
+    def test_order_list_bytes_match(self):
+        url = reverse("list-create-orders")
+        for params in [{}, {"omit": "items"}, {"status": "Pending"}]:
+            slow, fast = self.get_both(views.OrderListCreateView, url, params)
+            self.assertEqual(slow, fast)
+
+    def test_stdlib_fallback_matches(self):
+        url = reverse("list-create-orders")
+        slow, fast = self.get_both(views.OrderListCreateView, url)
+        with mock.patch("shop.renderers.orjson", None):
+            fallback = self.client.get(url).content
+
+        self.assertEqual(fallback, fast)
+
+    def test_order_list_query_count(self):
+        url = reverse("list-create-orders")
+        self.client.get(url)  # cache the token
+        with self.assertNumQueries(3):  # aggregate, page, items
+            self.client.get(url)
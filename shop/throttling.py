@@ -0,0 +1,218 @@
+"""
+Sliding-window rate limits on atomic counters.
+
+Each client gets one counter per fixed window. A request is allowed while
+``previous_window * (1 - elapsed_fraction) + current_window`` stays within
+the rate, which smooths out the burst a plain fixed window allows at its
+boundary and costs an increment and a read per request, unlike DRF's
+throttles that store and rewrite a list of timestamps.
+
+Counters live in the cache named by ``SHOP_THROTTLE["ALIAS"]`` so all
+workers share them; with no alias, or while that cache is failing, each
+process counts on its own.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+DURATIONS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def get_options():
+    return getattr(settings, "SHOP_THROTTLE", {})
+
+
+def parse_rate(rate):
+    """``"10/min"`` -> ``(10, 60)``, in the format of DRF's throttle rates."""
+    num, period = rate.split("/")
+    return int(num), DURATIONS[period[0]]
+
+
+class LocalCounter:
+    """In-process counters for when there is no shared cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._next_sweep = 0
+
+    def incr(self, key, timeout):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._counts = {
+                    k: entry for k, entry in self._counts.items() if entry[1] > now
+                }
+                self._next_sweep = now + 60
+            count, expires = self._counts.get(key, (0, now + timeout))
+            self._counts[key] = (count + 1, expires)
+            return count + 1
+
+    def get(self, key):
+        entry = self._counts.get(key)
+        return entry[0] if entry and entry[1] > time.monotonic() else 0
+
+    # Nothing to wait for in-process.
+    async def aincr(self, key, timeout):
+        return self.incr(key, timeout)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class CacheCounter:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def incr(self, key, timeout):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # First hit in this window; add() loses to a concurrent add.
+            if self.cache.add(key, 1, timeout):
+                return 1
+            return self.cache.incr(key)
+
+    def get(self, key):
+        return self.cache.get(key, 0)
+
+    async def aincr(self, key, timeout):
+        try:
+            return await self.cache.aincr(key)
+        except ValueError:
+            if await self.cache.aadd(key, 1, timeout):
+                return 1
+            return await self.cache.aincr(key)
+
+    async def aget(self, key):
+        return await self.cache.aget(key, 0)
+
+
+local_counter = LocalCounter()
+
+
+def get_counter():
+    alias = get_options().get("ALIAS", "default")
+    return CacheCounter(caches[alias]) if alias else local_counter
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Limits each client to the ``DEFAULT_THROTTLE_RATES`` entry for the
+    throttle's ``scope`` (or the view's ``throttle_scope``). Scopes without a
+    rate are not limited.
+    """
+
+    scope = None
+    timer = time.time
+
+    def get_scope(self, view):
+        return self.scope or getattr(view, "throttle_scope", None)
+
+    def get_ident_key(self, request, view):
+        """Who is counted: the user when authenticated, else the client IP."""
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"ip:{self.get_ident(request)}"
+
+    def get_window_keys(self, request, view):
+        """
+        The counter keys of the current and previous windows, or None when the
+        request is not limited. Sets the rate and window position for
+        ``is_allowed`` and ``wait``.
+        """
+        if not get_options().get("ENABLED", True):
+            return None
+        scope = self.get_scope(view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return None
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return None
+
+        self.limit, self.duration = parse_rate(rate)
+        now = self.timer()
+        window, elapsed = divmod(now, self.duration)
+        self.fraction = elapsed / self.duration
+        key = f"shop:throttle:{scope}:{ident}"
+        return f"{key}:{int(window)}", f"{key}:{int(window) - 1}"
+
+    def is_allowed(self):
+        return self.previous * (1 - self.fraction) + self.current <= self.limit
+
+    def allow_request(self, request, view):
+        keys = self.get_window_keys(request, view)
+        if keys is None:
+            return True
+        current_key, previous_key = keys
+        try:
+            counter = get_counter()
+            self.current = counter.incr(current_key, self.duration * 2)
+            self.previous = counter.get(previous_key)
+        except Exception:
+            logger.warning("Throttle cache unavailable, counting in-process")
+            self.current = local_counter.incr(current_key, self.duration * 2)
+            self.previous = local_counter.get(previous_key)
+        return self.is_allowed()
+
+    async def aallow_request(self, request, view):
+        """``allow_request`` for async views, without blocking the event loop."""
+        keys = self.get_window_keys(request, view)
+        if keys is None:
+            return True
+        current_key, previous_key = keys
+        try:
+            counter = get_counter()
+            self.current = await counter.aincr(current_key, self.duration * 2)
+            self.previous = await counter.aget(previous_key)
+        except Exception:
+            logger.warning("Throttle cache unavailable, counting in-process")
+            self.current = local_counter.incr(current_key, self.duration * 2)
+            self.previous = local_counter.get(previous_key)
+        return self.is_allowed()
+
+    def wait(self):
+        """Seconds until the weighted count is back within the limit."""
+        if self.current > self.limit or not self.previous:
+            return self.duration * (1 - self.fraction)
+        needed = 1 - (self.limit - self.current) / self.previous
+        return max(needed - self.fraction, 0) * self.duration
+
+
+class RegisterThrottle(SlidingWindowThrottle):
+    scope = "register"
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    scope = "login"
+
+
+class LoginUsernameThrottle(SlidingWindowThrottle):
+    """
+    Counts login attempts per account, so credential stuffing spread over
+    many addresses is still held to the ``login_username`` rate.
+    """
+
+    scope = "login_username"
+
+    def get_ident_key(self, request, view):
+        data = request.data
+        username = data.get("username") if hasattr(data, "get") else None
+        if not isinstance(username, str) or not username:
+            return None
+        digest = hashlib.sha256(username.lower().encode("utf-8")).hexdigest()
+        return f"username:{digest[:32]}"
@@ -1,21 +1,55 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path("register", views.register_user, name="register-user"),
     path("login", views.CustomLogin.as_view(), name="login"),
+    path("logout", views.logout_user, name="logout"),
+    path("metrics", views.metrics, name="metrics"),
+    path("analytics/revenue", views.analytics_revenue, name="analytics-revenue"),
+    path(
+        "analytics/top-products",
+        views.analytics_top_products,
+        name="analytics-top-products",
+    ),
+    path("analytics/low-stock", views.analytics_low_stock, name="analytics-low-stock"),
     path(
         "products/", views.ProductListCreateView.as_view(), name="list-create-products"
     ),
+    path("products/bulk", views.ProductBulkView.as_view(), name="bulk-products"),
+    path(
+        "products/<int:pk>/image",
+        views.ProductImageView.as_view(),
+        name="product-image",
+    ),
     path(
         "products/<int:pk>",
         views.ProductRetrieveUpdateDestroyView.as_view(),
         name="update-delete-retrieve-products",
     ),
     path("orders", views.OrderListCreateView.as_view(), name="list-create-orders"),
+    path(
+        "orders/status", views.OrderBulkStatusView.as_view(), name="bulk-order-status"
+    ),
     path(
         "orders/<int:pk>",
         views.OrderRetrieveUpdateDestroyView.as_view(),
         name="update-delete-retrieve-orders",
     ),
+    path("cart", views.CartView.as_view(), name="cart"),
+    path("cart/items", views.CartItemListView.as_view(), name="cart-items"),
+    path(
+        "cart/items/<int:product_id>", views.CartItemView.as_view(), name="cart-item"
+    ),
+    path("cart/checkout", views.CartCheckoutView.as_view(), name="cart-checkout"),
+    # Async variants of the read endpoints, for ASGI deployments.
+    path("async/products/", async_views.product_list, name="async-list-products"),
+    path(
+        "async/products/<int:pk>",
+        async_views.product_detail,
+        name="async-retrieve-products",
+    ),
+    path("async/orders", async_views.order_list, name="async-list-orders"),
+    path("async/register", async_views.register, name="async-register-user"),
+    path("async/login", async_views.login, name="async-login"),
 ]
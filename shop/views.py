@@ -1,19 +1,54 @@
-from django.contrib.auth.hashers import make_password
+from datetime import timedelta
+
 from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters import NumberFilter, FilterSet
 
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from rest_framework import permissions, status, generics, filters
+from rest_framework import permissions, status, generics
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.exceptions import ValidationError
-from rest_framework.pagination import PageNumberPagination
 
 from .models import Product, Order
-from .serializers import ProductSerializer, OrderSerializer
+from .passwords import hash_password
+from .serializers import (
+    CartItemSerializer,
+    DailySalesSerializer,
+    LoginSerializer,
+    OrderSerializer,
+    ProductImageSerializer,
+    ProductSerializer,
+    TopProductSerializer,
+)
 from .permissions import IsOwner
+from .pagination import ProductPagination, OrderPagination
+from .cache import catalog_cache
+from . import cart
+from .conditional import (
+    check_preconditions,
+    page_validators,
+    object_validators,
+    set_validators,
+)
+from .services import delete_orders, update_order_statuses
+from . import analytics, images
+from .instrumentation import registry
+from .routers import read_from_replica
+from .search import ProductSearchFilter
+from .throttling import (
+    LoginThrottle,
+    LoginUsernameThrottle,
+    RegisterThrottle,
+    SlidingWindowThrottle,
+)
 
 
 class ProductFilter(FilterSet):
@@ -27,6 +62,7 @@ class ProductFilter(FilterSet):
 
 @api_view(["POST"])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([RegisterThrottle])
 def register_user(request):
     if request.method == "POST":
         username = request.data.get("username")
@@ -45,7 +81,7 @@ def register_user(request):
             )
 
         user = User.objects.create(
-            username=username, email=email, password=make_password(password)
+            username=username, email=email, password=hash_password(password)
         )
         Token.objects.create(user=user)
 
@@ -55,6 +91,9 @@ def register_user(request):
 
 
 class CustomLogin(ObtainAuthToken):
+    serializer_class = LoginSerializer
+    throttle_classes = [LoginThrottle, LoginUsernameThrottle]
+
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(
             data=request.data, context={"request": request}
@@ -65,50 +104,508 @@ class CustomLogin(ObtainAuthToken):
         return Response({"token": token.key})
 
 
-class ProductRetrieveUpdateDestroyPagination(PageNumberPagination):
-    page_size = 3
+@api_view(["POST"])
+def logout_user(request):
+    if request.auth is not None:
+        request.auth.delete()
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def metrics(request):
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def get_int_param(request, name, default, minimum=0, maximum=None):
+    value = request.query_params.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: "A whole number is required."})
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValidationError({name: f"Must be between {minimum} and {maximum}."})
+    return value
+
+
+def get_date_range(request, default_days=30):
+    """``?start=`` and ``?end=`` (ISO dates); the last 30 days by default."""
+    dates = {}
+    for name in ("start", "end"):
+        value = request.query_params.get(name)
+        if value is None:
+            continue
+        try:
+            dates[name] = parse_date(value)
+        except ValueError:
+            dates[name] = None
+        if dates[name] is None:
+            raise ValidationError({name: "Use the YYYY-MM-DD format."})
+    end = dates.get("end") or timezone.localdate()
+    start = dates.get("start") or end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValidationError({"start": "Must not be after end."})
+    return start, end
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def analytics_revenue(request):
+    start, end = get_date_range(request)
+    days = analytics.revenue_by_day(start, end)
+    return Response(
+        {
+            "start": start,
+            "end": end,
+            "rolled_up_until": analytics.rolled_up_until(),
+            "days": DailySalesSerializer(days, many=True).data,
+        }
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def analytics_top_products(request):
+    start, end = get_date_range(request)
+    limit = get_int_param(request, "limit", 10, minimum=1, maximum=100)
+    products = analytics.top_products(start, end, limit)
+    return Response(
+        {
+            "start": start,
+            "end": end,
+            "rolled_up_until": analytics.rolled_up_until(),
+            "products": TopProductSerializer(products, many=True).data,
+        }
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def analytics_low_stock(request):
+    threshold = get_int_param(request, "threshold", 5)
+    limit = get_int_param(request, "limit", 50, minimum=1, maximum=500)
+    return Response({"products": analytics.low_stock(threshold, limit)})
+
+
+class ReplicaReadMixin:
+    """GETs run their queries on a read replica; see shop/routers.py."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS:
+            read_from_replica(request)
+
+
+class SparseFieldsetMixin:
+    """
+    ``?fields=name,price`` or ``?omit=description`` on reads narrows both the
+    response and the SQL: only the matching columns are selected and
+    prefetches for omitted relations are skipped. ``always_load`` columns
+    are kept for the cursor, ETags and permission checks.
+    """
+
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+    always_load = ("id", "created_at", "updated_at")
+    # Fields a list shows when ``?fields=`` is absent; None for all of them.
+    list_fields = None
+
+    def get_fieldset(self):
+        if not hasattr(self, "_fieldset"):
+            self._fieldset = self.parse_fieldset()
+        return self._fieldset
+
+    def parse_fieldset(self):
+        params = self.request.query_params
+        available = list(self.get_serializer_class()().fields)
+        fields = self.split_param(params.get(self.fields_query_param))
+        omit = self.split_param(params.get(self.omit_query_param)) or []
+        unknown = set(fields or []).union(omit).difference(available)
+        if unknown:
+            raise ValidationError(
+                {"fields": f"Unknown field(s): {', '.join(sorted(unknown))}."}
+            )
+        if fields is None:
+            fields = self.list_fields if self.is_list() else None
+            fields = fields or available
+        return [name for name in available if name in fields and name not in omit]
+
+    @staticmethod
+    def split_param(value):
+        if value is None:
+            return None
+        return [name.strip() for name in value.split(",") if name.strip()]
+
+    def is_list(self):
+        return "pk" not in self.kwargs
 
+    def is_sparse(self):
+        return self.request.method in permissions.SAFE_METHODS
 
-class ProductListCreateView(generics.ListCreateAPIView):
+    def get_sparse_fieldset(self):
+        """The fields the response narrows to, or None if it has them all."""
+        if not self.is_sparse():
+            return None
+        fieldset = self.get_fieldset()
+        if fieldset == list(self.get_serializer_class()().fields):
+            return None
+        return fieldset
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.is_sparse():
+            return queryset
+        fieldset = self.get_fieldset()
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        lookups = [
+            lookup
+            for lookup in queryset._prefetch_related_lookups
+            if getattr(lookup, "prefetch_to", lookup) in fieldset
+        ]
+        return (
+            queryset.only(*self.always_load, *columns.intersection(fieldset))
+            .prefetch_related(None)
+            .prefetch_related(*lookups)
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        if self.is_sparse():
+            kwargs.setdefault("fields", self.get_fieldset())
+        return super().get_serializer(*args, **kwargs)
+
+
+class ConditionalListMixin:
+    """
+    ETags for list pages, built from the page's rows and checked against
+    If-None-Match before any of them is serialized.
+
+    Pages are read with ``values()`` and built by the serializer's
+    ``represent_values`` when it has a ``values_plan``, skipping model
+    instances and per-field serializer calls.
+    """
+
+    values_serialization = True
+    # Read with every page for its ETag; see page_validators.
+    validator_fields = ("id", "updated_at")
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        use_values = self.values_serialization and serializer.values_plan is not None
+        if use_values:
+            ordering = self.paginator.get_ordering(queryset)
+            lookups = serializer.get_values_lookups() + list(self.validator_fields)
+            lookups += [name.lstrip("-") for name in ordering]
+            queryset = queryset.prefetch_related(None).values(*dict.fromkeys(lookups))
+        page = self.paginate_queryset(queryset)
+        etag = page_validators(request, self.paginator, page, self.validator_fields)
+        response = check_preconditions(request, etag)
+        if response is not None:
+            return response
+
+        if use_values:
+            response = self.get_paginated_response(serializer.represent_values(page))
+            response.plain_json = True
+        else:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        return set_validators(response, etag)
+
+
+class ConditionalObjectMixin:
+    """
+    ETag and Last-Modified on detail responses, 304 for unchanged copies, and
+    If-Match / If-Unmodified-Since checks before updates and deletes.
+    """
+
+    def get_object(self):
+        # Loaded once per request, shared by the precondition check and the
+        # update or delete that follows it.
+        if not hasattr(self, "_object"):
+            self._object = super().get_object()
+        return self._object
+
+    def get_sparse_fieldset(self):
+        # Overridden by SparseFieldsetMixin.
+        return None
+
+    def get_object_validators(self, instance):
+        return object_validators(instance, self.get_sparse_fieldset())
+
+    def check_object_preconditions(self, request):
+        return check_preconditions(
+            request, *self.get_object_validators(self.get_object())
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.check_object_preconditions(request)
+        if response is not None:
+            return response
+        response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, *self.get_object_validators(self.get_object()))
+
+    def update(self, request, *args, **kwargs):
+        response = self.check_object_preconditions(request)
+        if response is not None:
+            return response
+        response = super().update(request, *args, **kwargs)
+        return set_validators(response, *self.get_object_validators(self.get_object()))
+
+    def destroy(self, request, *args, **kwargs):
+        response = self.check_object_preconditions(request)
+        if response is not None:
+            return response
+        return super().destroy(request, *args, **kwargs)
+
+
+class ProductListCreateView(
+    ReplicaReadMixin,
+    SparseFieldsetMixin,
+    ConditionalListMixin,
+    generics.ListCreateAPIView,
+):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    # The listing leaves out the description and full-size image; ask for
+    # them with ?fields=.
+    list_fields = [
+        "id",
+        "name",
+        "price",
+        "stock",
+        "image_renditions",
+        "created_at",
+        "updated_at",
+    ]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]
     filterset_class = ProductFilter
     search_fields = ["name", "description"]
-    pagination_class = pagination_class = ProductRetrieveUpdateDestroyPagination
+    pagination_class = ProductPagination
+    throttle_classes = [SlidingWindowThrottle]
+    throttle_scope = "products"
 
     def get_permissions(self):
         if self.request.method == "POST":
             return [permissions.IsAdminUser()]  # only admins can add new products
         return []  # Publicly accessible for authenticated users
 
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return catalog_cache.fetch(
+            request, "list", lambda: build(request, *args, **kwargs)
+        )
+
 
-class ProductRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class ProductRetrieveUpdateDestroyView(
+    ReplicaReadMixin,
+    SparseFieldsetMixin,
+    ConditionalObjectMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        return catalog_cache.fetch(
+            request, "detail", lambda: build(request, *args, **kwargs)
+        )
+
+
+class BulkMixin:
+    max_rows = 1000
+
+    def get_rows(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({"error": "Expected a non-empty list of records."})
+        if len(rows) > self.max_rows:
+            raise ValidationError(
+                {"error": f"At most {self.max_rows} records per request."}
+            )
+        return rows
+
+    def get_instances(self, model, rows):
+        ids = {row.get("id") for row in rows if isinstance(row, dict)}
+        ids = [pk for pk in ids if isinstance(pk, int)]
+        return model.objects.in_bulk(ids)
+
+    @staticmethod
+    def row_error(index, errors):
+        return {"index": index, "status": "error", "errors": errors}
+
+    def error_response(self, results):
+        return Response({"results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProductImageView(APIView):
+    """
+    PUT a multipart ``image`` to set the product's image (202: the renditions
+    are generated in the background), DELETE to remove it.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def put(self, request, pk):
+        product = generics.get_object_or_404(Product, pk=pk)
+        serializer = ProductImageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        images.set_image(product, serializer.validated_data["image"])
+        data = ProductSerializer(product, context={"request": request}).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    def delete(self, request, pk):
+        images.clear_image(generics.get_object_or_404(Product, pk=pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProductBulkView(BulkMixin, APIView):
+    """
+    Create (POST) or partially update (PATCH) many products at once. Either
+    every row is applied, in one transaction, or none is and the response
+    lists the errors per row.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        rows = self.get_rows(request)
+        serializer = ProductSerializer(data=rows, many=True)
+        if not serializer.is_valid():
+            return self.error_response(
+                [
+                    self.row_error(index, errors)
+                    if errors
+                    else {"index": index, "status": "valid"}
+                    for index, errors in enumerate(serializer.errors)
+                ]
+            )
+
+        products = [Product(**data) for data in serializer.validated_data]
+        with transaction.atomic():
+            Product.objects.bulk_create(products)
+            catalog_cache.invalidate()
+        results = [
+            {"index": index, "status": "created", "id": product.id}
+            for index, product in enumerate(products)
+        ]
+        return Response({"results": results}, status=status.HTTP_201_CREATED)
+
+    def patch(self, request):
+        rows = self.get_rows(request)
+        products = self.get_instances(Product, rows)
+        validator = ProductSerializer(partial=True)
+        results, changes, fields, failed = [], [], {"updated_at"}, False
+
+        for index, row in enumerate(rows):
+            product = products.get(row.get("id")) if isinstance(row, dict) else None
+            if product is None:
+                results.append(self.row_error(index, "Not found."))
+                failed = True
+                continue
+            try:
+                data = validator.run_validation(row)
+            except ValidationError as exc:
+                results.append(self.row_error(index, exc.detail))
+                failed = True
+                continue
+            for field, value in data.items():
+                setattr(product, field, value)
+            fields.update(data)
+            changes.append(product)
+            results.append({"index": index, "status": "updated", "id": product.id})
+
+        if failed:
+            return self.error_response(results)
 
-class OrderListCreateView(generics.ListCreateAPIView):
-    queryset = Order.objects.all()
+        now = timezone.now()
+        for product in changes:
+            product.updated_at = now
+        with transaction.atomic():
+            Product.objects.bulk_update(changes, sorted(fields))
+            catalog_cache.invalidate()
+        return Response({"results": results})
+
+
+class OrderBulkStatusView(BulkMixin, APIView):
+    """
+    Change the status of many orders at once: ``[{"id": 1, "status": ...}]``.
+    Only Pending orders can change, matching the single-order update.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def patch(self, request):
+        rows = self.get_rows(request)
+        orders = self.get_instances(Order, rows)
+        statuses = {value for value, _ in Order._meta.get_field("status").choices}
+        results, changes, failed = [], [], False
+
+        for index, row in enumerate(rows):
+            order = orders.get(row.get("id")) if isinstance(row, dict) else None
+            if order is None:
+                error = "Not found."
+            elif row.get("status") not in statuses:
+                error = f"Status must be one of: {', '.join(sorted(statuses))}."
+            elif order.status != "Pending":
+                error = f"Cannot update a {order.status.lower()} Order"
+            else:
+                error = None
+
+            if error:
+                results.append(self.row_error(index, error))
+                failed = True
+                continue
+            order.status = row["status"]
+            changes.append(order)
+            results.append({"index": index, "status": "updated", "id": order.id})
+
+        if failed:
+            return self.error_response(results)
+        update_order_statuses(changes)
+        return Response({"results": results})
+
+
+class OrderListCreateView(
+    ReplicaReadMixin,
+    SparseFieldsetMixin,
+    ConditionalListMixin,
+    generics.ListCreateAPIView,
+):
+    queryset = Order.objects.with_items()
     serializer_class = OrderSerializer
+    always_load = ("id", "created_at", "updated_at", "user")
+    pagination_class = OrderPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ["status"]
 
     def get_queryset(self):
+        queryset = super().get_queryset()
         if not self.request.user.is_superuser:
-            return self.queryset.filter(user=self.request.user)
-        return Order.objects.all()
+            return queryset.filter(user=self.request.user)
+        return queryset
 
 
-class OrderRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Order.objects.all()
+class OrderRetrieveUpdateDestroyView(
+    ReplicaReadMixin,
+    SparseFieldsetMixin,
+    ConditionalObjectMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+):
+    queryset = Order.objects.with_items()
     serializer_class = OrderSerializer
+    always_load = ("id", "created_at", "updated_at", "user")
     permission_classes = [IsOwner]
 
     def update(self, request, *args, **kwargs):
         order = self.get_object()
 
-        if order.status == "Completed":
-            raise ValidationError("Cannot update a completed Order")
+        if order.status != "Pending":
+            raise ValidationError(f"Cannot update a {order.status.lower()} Order")
         return super().update(request, *args, **kwargs)
 
     def delete(self, request, *args, **kwargs):
@@ -117,3 +614,45 @@ class OrderRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
         if order.status == "Completed":
             raise ValidationError("Cannot delete a completed Order")
         return super().delete(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        delete_orders([instance.pk])
+
+
+class CartView(APIView):
+    """The requesting user's cart, with live prices and stock."""
+
+    def get(self, request):
+        return Response(cart.summarize(request.user.pk))
+
+    def delete(self, request):
+        cart.cart_store.clear(request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CartItemListView(APIView):
+    def post(self, request):
+        serializer = CartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = cart.add_item(request.user.pk, **serializer.validated_data)
+        return Response(cart.summarize(request.user.pk, lines))
+
+
+class CartItemView(APIView):
+    def put(self, request, product_id):
+        data = {"product_id": product_id, "quantity": request.data.get("quantity")}
+        serializer = CartItemSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        lines = cart.set_quantity(request.user.pk, **serializer.validated_data)
+        return Response(cart.summarize(request.user.pk, lines))
+
+    def delete(self, request, product_id):
+        lines = cart.remove_item(request.user.pk, product_id)
+        return Response(cart.summarize(request.user.pk, lines))
+
+
+class CartCheckoutView(APIView):
+    def post(self, request):
+        order = cart.checkout(request.user)
+        serializer = OrderSerializer(order, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)